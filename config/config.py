@@ -1,9 +1,82 @@
 MODELS = ["gpt-4o", "gpt-4-turbo", "gpt-4o-mini", "gpt-3.5-turbo-0125"]
 
+# Requests and tokens per minute allowed per model. Calls are paced to stay under these;
+# models without an entry are not paced (but still retried).
+MODEL_RATE_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30_000},
+    "gpt-4-turbo": {"rpm": 500, "tpm": 30_000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200_000},
+    "gpt-3.5-turbo-0125": {"rpm": 500, "tpm": 200_000},
+}
+EXPECTED_COMPLETION_TOKENS = 16  # used to estimate the token cost of a request before sending it
+
+MAX_RETRIES = 6  # retries on 429, 5xx and connection errors
+BACKOFF_BASE = 1.0  # seconds, doubled on every attempt
+BACKOFF_MAX = 60.0  # seconds
+
+# USD per million tokens, used for the cost figures in the evaluation output
+MODEL_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4-turbo": {"input": 10.00, "output": 30.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-3.5-turbo-0125": {"input": 0.50, "output": 1.50},
+}
+BATCH_PRICE_FACTOR = 0.5  # Batch API discount
+
 DEFAULT_WEIGHT = 1.0
 
 MAX_WORKERS = 5
 
+MAX_CONCURRENCY = 20  # max number of in-flight requests for the async engine
+
+# Connection pool of the shared OpenAI clients; keep it at least as large as MAX_WORKERS / MAX_CONCURRENCY
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 100
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds an idle connection is kept open
+HTTP_TIMEOUT = 60  # seconds
+HTTP2 = True  # used when the h2 package is installed
+
+TOP_LOGPROBS = 5
+
+# "first_token" reads True/False from the top logprobs of a free completion; "constrained" requests a single
+# token with a logit bias on the True/False token ids and scores the renormalized pair
+SCORING_MODE = "first_token"
+ANSWER_TOKENS = ("True", "False")
+ANSWER_LOGIT_BIAS = 100
+ANSWER_TOKEN_IDS = {}  # model -> {"True": id, "False": id}, for models tiktoken does not know
+
+# "default" asks the question before the input text; "prefix_cache" puts the input text first so
+# every question about the same text shares a long prompt prefix the provider can cache
+PROMPT_LAYOUT = "default"
+
+RESPONSE_CACHE_PATH = ".response_cache.db"
+RESPONSE_CACHE_MAX_ENTRIES = 200_000
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MB of stored payloads
+RESPONSE_CACHE_TTL = 90 * 24 * 3600  # seconds; None keeps entries until they are evicted by size
+
+RESULT_FLUSH_EVERY = 50  # records buffered by the JSONL result writer before they are written
+RESULT_FORMATS = ["json", "parquet", "sqlite"]  # written at the end of a run, next to the results JSONL
+RESULTS_DB_NAME = "results.db"  # SQLite results store in the output directory, shared by all runs
+
+STREAM_CHUNK_ROWS = 50_000  # question rows per DataFrame chunk when streaming a results file
+STREAM_READ_CHARS = 1 << 20  # characters read at a time from a JSON results file
+
+DASHBOARD_CACHE_FILES = 64  # parsed results files kept in memory by the dashboard
+DASHBOARD_CACHE_SELECTIONS = 8  # combined frames of file selections kept in memory by the dashboard
+RADAR_FIGURE_CACHE = 32  # rendered radar charts kept in memory by compare_scores.cached_radar_chart
+REGRESSION_THRESHOLD = 0.1  # score drop between runs that src.run_comparison flags as a regression
+AGREEMENT_RESAMPLES = 1000  # bootstrap resamples per model pair in src.agreement
+AGREEMENT_CONFIDENCE = 0.95  # width of the bootstrap confidence intervals
+AGREEMENT_WORKERS = None  # processes computing the bootstrap; None uses all CPUs, 1 computes in-process
+AGREEMENT_BOOTSTRAP_CELLS = 2_000_000  # resampled values per bootstrap chunk, bounding the memory per worker
+RELIABILITY_CATEGORIES = 5  # rating categories of src.reliability: the 1-5 human scale (scores 0, 0.25, .., 1)
+PARQUET_COMPRESSION = "zstd"
+PARQUET_TEXTS_PER_ROW_GROUP = 500
+AGGREGATE_CHUNK_TEXTS = 500  # texts re-aggregated at once by src.aggregation.iter_aggregated when a run is converted
+
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 30  # seconds between status checks of a submitted batch
+
 CREDS = "config/credentials.json"
 TOKEN_FILE = "config/token.pickle"
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
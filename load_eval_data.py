@@ -1,5 +1,6 @@
 import os
 import pickle
+import argparse
 import numpy as np
 import json
 from pathlib import Path
@@ -10,12 +11,18 @@ from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
-from config.config import CREDS, TOKEN_FILE, SCOPES, SHEET_ID, SHEET_NAMES, DEFAULT_WEIGHT
+from config.config import CREDS, TOKEN_FILE, SCOPES, SHEET_ID, SHEET_NAMES, DEFAULT_WEIGHT, RESULT_FORMATS, RESULTS_DB_NAME
 from config.evaluation_config import BOORMACHINE_ADVICE_TEXT, BATTERIJDUUR_IPHONE_TEXT, MONITOR_4K_TEXT, HIFI_SPEAKER_TEXT
 
 from src.concepts import QuestionEval, DimensionEval, ConceptEval, TextEval, ModelEval, Concept, Dimension, Question, ValidationScores
 from src.update_concepts import process_concept_csv
 from src.utils import fancy_print_output
+from src.result_writer import JsonlResultWriter, jsonl_to_json, iter_latest_text_evals
+from src.columnar import jsonl_to_parquet
+from src.aggregation import iter_aggregated
+from src.results_store import ResultsStore
+from src.checkpoint import load_progress
+from src.evaluation import weighted_score
 
 
 def authenticate():
@@ -96,7 +103,8 @@ def evaluate_question(
         "answer": token,
         "score": probability,
         "logprob": np.log(probability + 1e-9),
-        "positive_contribution": positive_contribution
+        "positive_contribution": positive_contribution,
+        "usage": None  # human annotation, no request
     }
 
 
@@ -138,9 +146,8 @@ def evaluate_concept(
         dimension_eval = evaluate_dimension(dimension, eval_scores)
         dimension_scores.append(dimension_eval)
 
-    # Calculate overall score for the concept, excluding None values
-    scores = [d["overall_score"] for d in dimension_scores if d["overall_score"] is not None]
-    overall_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
+    # Weighted overall score for the concept, excluding None values (same as the model evaluations)
+    overall_score = weighted_score([d["overall_score"] for d in dimension_scores], [d["weight"] for d in dimension_scores])
 
     return {
         "concept_description": concept["concept_description"],
@@ -165,9 +172,8 @@ def model_eval(
         concept_eval = evaluate_concept(concept, eval_scores)
         concept_scores.append(concept_eval)
     
-    # Calculate overall score for the model, excluding None values
-    scores = [c["overall_score"] for c in concept_scores if c["overall_score"] is not None]
-    overall_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
+    # Weighted overall score for the model, excluding None values (same as the model evaluations)
+    overall_score = weighted_score([c["overall_score"] for c in concept_scores], [c["weight"] for c in concept_scores])
 
     return {
         "model_name": model,
@@ -217,26 +223,48 @@ def text_eval(
     }
 
 
-def main(texts:dict, models:list, concepts:list[Concept], output_dir, eval_scores:dict) -> None:
-    """Runs evaluation pipeline and saves results to JSON file."""
-    
-    results = []
-    # Run evaluation
-    for label, text in texts.items():
-        text_eval_result = text_eval(models, text, label, concepts, eval_scores[label])
-        results.append(text_eval_result)
-        print(f"Evaluation for {label} completed.\n")
-
-    # Save results to JSON file
-    with open(f"{output_dir}validation_data.json", "w") as f:
-        json.dump(results, f, indent=4)
+def main(texts:dict, models:list, concepts:list[Concept], output_dir, eval_scores:dict, resume:bool = False) -> None:
+    """Runs evaluation pipeline and saves results to JSON file.
+
+    Every finished text is appended to validation_data.jsonl right away. With resume=True texts
+    that an earlier, interrupted run already finished are skipped.
+    """
+    jsonl_path = f"{output_dir}validation_data.jsonl"
+    completed_texts, _ = load_progress(jsonl_path, texts, models, concepts) if resume else (set(), {})
+    if completed_texts:
+        print(f"Resuming: skipping {len(completed_texts)} of {len(texts)} texts that are already done")
+
+    text_eval_result = None
+    with JsonlResultWriter(jsonl_path, append=resume) as writer:
+        # Run evaluation
+        for label, text in texts.items():
+            if label in completed_texts:
+                continue
+            text_eval_result = text_eval(models, text, label, concepts, eval_scores[label])
+            writer.write_text(text_eval_result)
+            print(f"Evaluation for {label} completed.\n")
+
+    # Save results to the JSON file, the columnar Parquet tables and/or the results store
+    if "json" in RESULT_FORMATS:
+        jsonl_to_json(jsonl_path, f"{output_dir}validation_data.json")
+    if "parquet" in RESULT_FORMATS:
+        jsonl_to_parquet(jsonl_path, f"{output_dir}validation_data.parquet")
+    if "sqlite" in RESULT_FORMATS:
+        with ResultsStore(f"{output_dir}{RESULTS_DB_NAME}") as store:
+            store.add_run("validation_data", iter_aggregated(iter_latest_text_evals(jsonl_path)), source="human")
 
     # Print results to console
-    fancy_print_output(text_eval_result)
+    if text_eval_result:
+        fancy_print_output(text_eval_result)
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Turn the human ratings from Google Sheets into evaluation results.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run, skipping texts that are already done")
+    args = parser.parse_args()
+
     # Load eval concepts from CSV
     csv_path = Path('eval_concepts/LLM_eval_concepten - Taalniveau B1.csv')
     process_concept_csv(csv_path, output_filepath=Path('eval_concepts/taalniveau_b1_concept.json'), concept_name="Taalniveau_B1")
@@ -246,12 +274,6 @@ if __name__ == "__main__":
 
     output_dir = "evaluation_results/"
 
-    # Load evaluation scores from Google Sheets
-    scores = {}
-    for name in SHEET_NAMES:
-        scores[name] = load_eval_scores_from_sheet(SHEET_ID, name)
-
-
     texts = {
         "B1 - Goed voorbeeld 1": BOORMACHINE_ADVICE_TEXT,
         "B1 - Goed voorbeeld 2": BATTERIJDUUR_IPHONE_TEXT,
@@ -259,7 +281,16 @@ if __name__ == "__main__":
         "B1 - Slecht voorbeeld 2": HIFI_SPEAKER_TEXT
     }
 
-    # #### FIX EVAL DATA
     models = ["LL-01-pro"]
-    main(texts, models, concepts['concepts'], output_dir, scores)
+
+    # Load evaluation scores from Google Sheets, except for texts an earlier run already finished
+    completed_texts, _ = load_progress(f"{output_dir}validation_data.jsonl", texts, models, concepts['concepts']) \
+        if args.resume else (set(), {})
+    scores = {}
+    for name in SHEET_NAMES:
+        if name not in completed_texts:
+            scores[name] = load_eval_scores_from_sheet(SHEET_ID, name)
+
+    # #### FIX EVAL DATA
+    main(texts, models, concepts['concepts'], output_dir, scores, resume=args.resume)
 
@@ -1,23 +1,45 @@
+import time
+import argparse
 from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
-import numpy as np
 from dotenv import load_dotenv
 from pprint import pprint
 import json
 from pathlib import Path
 from colorama import init
-from datetime import datetime
-from langchain_core.globals import set_llm_cache
-from langchain_community.cache import SQLiteCache
 
 from config.evaluation_config import BOORMACHINE_ADVICE_TEXT, BATTERIJDUUR_IPHONE_TEXT, MONITOR_4K_TEXT, HIFI_SPEAKER_TEXT
-from config.config import DEFAULT_WEIGHT, MODELS, MAX_WORKERS
+from config.config import MODELS, MAX_WORKERS, MAX_CONCURRENCY, RESPONSE_CACHE_PATH, PROMPT_LAYOUT, SCORING_MODE, RESULT_FORMATS, RESULTS_DB_NAME
 
 from src.concepts import QuestionEval, DimensionEval, ConceptEval, ModelEval, TextEval, Concept, Dimension, Question
 from src.update_concepts import process_concept_csv
 from src.utils import fancy_print_output
+from src.evaluation import (
+    build_messages,
+    question_request_params,
+    request_payload,
+    score_payload,
+    build_dimension_eval,
+    build_concept_eval,
+    build_model_eval,
+    build_text_eval,
+    set_response_cache,
+    get_response_cache,
+    set_prompt_layout,
+    set_scoring_mode
+)
+from src.response_cache import ResponseCache
+from src.async_engine import iter_async
+from src.scheduler import iter_scheduled
+from src.result_writer import JsonlResultWriter, jsonl_to_json, iter_text_evals, iter_latest_text_evals
+from src.columnar import jsonl_to_parquet
+from src.aggregation import iter_aggregated
+from src.results_store import ResultsStore
+from src.instrumentation import run_summary, print_run_summary
+from src.checkpoint import check_manifest, write_manifest, load_progress
+from src.batch_api import run_batch
+from src.http_client import get_client, connection_stats
 
-from prompts.eval_prompt import sys_eval_prompt, base_eval_prompt
 from prompts.voorbeelden import (
     B1,
     C1
@@ -25,7 +47,7 @@ from prompts.voorbeelden import (
 
 load_dotenv()
 init(autoreset=True)  # Initialize colorama
-set_llm_cache(SQLiteCache(database_path=".langchain.db"))
+set_response_cache(ResponseCache(RESPONSE_CACHE_PATH))
 
 
 # Function to evaluate a single question using LLM
@@ -38,58 +60,10 @@ def evaluate_question(
         input_text: str
         ) -> QuestionEval:
 
-    # Extract question details
-    question = question_obj["question"]
-    positive_contribution = question_obj["positive_contribution"]
-    examples = question_obj["examples"]
+    messages = build_messages(concept, dimension, question_obj, input_text)
+    payload = request_payload(client, question_request_params(model, messages))
 
-    system_prompt = sys_eval_prompt.format(concept=concept)
-    base_prompt = base_eval_prompt.format(concept=concept, dimension=dimension, question=question, input_text=input_text, examples=examples)
-    
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "developer", "content": system_prompt},
-            {"role": "user", "content": base_prompt}
-        ],
-        logprobs=True,
-        top_logprobs=5
-    )
-
-    top_logprobs = response.choices[0].logprobs.content[0].top_logprobs
-    probability = None  # Initialize probability to None
-    logprob_value = None  # Initialize logprob_value to None
-    token = None
-
-    for logprob in top_logprobs:
-        token = logprob.token.lower()
-
-        # If token is not true or false, assign None to probability
-        if token != "true" and token != "false":
-            continue
-
-        if positive_contribution == True:
-            if token == "true":
-                token = logprob.token
-                logprob_value = logprob.logprob
-                probability = np.round(np.exp(logprob_value), 3)
-                break  # Exit loop after finding the first valid token
-
-        elif positive_contribution == False:
-            if token == "false":
-                token = logprob.token
-                logprob_value = logprob.logprob
-                probability = 1 - np.round(np.exp(logprob_value), 3)
-                break  # Exit loop after finding the first valid token
-
-    return {
-        "label": question_obj["label"],
-        "question": question,
-        "answer": token,
-        "score": probability,
-        "logprob": logprob_value,
-        "positive_contribution": positive_contribution
-    }
+    return score_payload(question_obj, payload, model)
 
 
 # Function to evaluate a single dimension using LLM
@@ -108,16 +82,7 @@ def evaluate_dimension(
         question_eval = evaluate_question(client, model, concept, dimension, question, input_text)
         question_scores.append(question_eval)
 
-    # Calculate overall score for the dimension, excluding None values
-    scores = [q["score"] for q in question_scores if q["score"] is not None]
-    overall_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
-
-    return {
-        "dimension_description": dimension["dimension_description"],
-        "questions": question_scores,
-        "overall_score": overall_score,
-        "weight": dimension.get("weight", DEFAULT_WEIGHT)
-    }
+    return build_dimension_eval(dimension, question_scores)
 
 
 # Function to evaluate a single concept using LLM
@@ -135,16 +100,7 @@ def evaluate_concept(
         dimension_eval = evaluate_dimension(client, model, concept, dimension, input_text)
         dimension_scores.append(dimension_eval)
 
-    # Calculate overall score for the concept, excluding None values
-    scores = [d["overall_score"] for d in dimension_scores if d["overall_score"] is not None]
-    overall_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
-
-    return {
-        "concept_description": concept["concept_description"],
-        "dimensions": dimension_scores,
-        "overall_score": overall_score,
-        "weight": concept.get("weight", DEFAULT_WEIGHT)
-    }
+    return build_concept_eval(concept, dimension_scores)
 
 
 def model_eval(
@@ -154,25 +110,15 @@ def model_eval(
         label:str
         ) -> ModelEval:
     
-    # Initialize OpenAI client
-    client = OpenAI()
+    client = get_client()  # shared connection pool across threads and texts
     print(f"\nEvaluating text: {label} \nUsing model: {model}\n\n")
     
     concept_scores = []
     for concept in concepts:
         concept_eval = evaluate_concept(client, model, concept, input_text)
         concept_scores.append(concept_eval)
-    
-    # Calculate overall score for the model, excluding None values
-    scores = [c["overall_score"] for c in concept_scores if c["overall_score"] is not None]
-    overall_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
-
-    return {
-        "model_name": model,
-        "concepts_scores": concept_scores,
-        "overall_score": overall_score,
-        "weight": DEFAULT_WEIGHT
-    }
+
+    return build_model_eval(model, concept_scores)
 
 
 def text_eval( 
@@ -194,51 +140,117 @@ def text_eval(
                 print(f"Error evaluating model {model}: {e}")
                 evaluations[model] = None  # Handle errors gracefully
 
-    # Calculate aggregated score for the text, excluding None values
-    scores = [m["overall_score"] for m in evaluations.values() if m and m["overall_score"] is not None]
-    aggregated_score = np.round(np.mean(scores) if scores else None, 3)  # Default to 0 if all scores are None
-
-    metadata = {
-        "models_used": models,
-        "evaluation_parameters": {
-            "system_prompt": str(sys_eval_prompt),
-            "base_prompt": str(base_eval_prompt)
-        }
-    }
-
-    timestamp = datetime.now().strftime("%Y-%m-%d")
-
-
-    return {
-        "label": label,
-        "input_text": text,
-        "concepts": concepts,
-        "evaluations": evaluations,
-        "aggregated_score": aggregated_score,
-        "metadata": metadata,
-        "timestamp": timestamp
-    }
+    return build_text_eval(models, text, label, concepts, evaluations)
+
+
+def main(texts:dict, models:list, concepts:list[Concept], output_dir, engine:str = "queue", batched:bool = False,
+         batch_id:str = None, resume:bool = False, concurrency:int = None, formats:list = None) -> dict:
+    """Runs evaluation pipeline and saves results to JSON file.
+
+    engine="queue" drains every question of the run through one pool of MAX_WORKERS threads,
+    engine="threads" evaluates texts one after another with a thread per model,
+    engine="async" fans out every (text, model, question) call concurrently, writing each text as it finishes,
+    engine="batch" submits every request as one Batch API job and ingests its output
+    (pass batch_id to resume polling an earlier submission).
+    With batched=True all questions of a dimension are asked in one request (not for engine="threads").
+    With resume=True the results JSONL of an interrupted run is extended instead of overwritten:
+    finished texts are skipped and, for the queue engine, so are finished questions. Resuming a run that
+    used other models, concepts, scoring mode, prompt layout or prompts raises a ValueError.
+    concurrency overrides MAX_WORKERS (queue) or MAX_CONCURRENCY (async).
+    formats overrides RESULT_FORMATS: "json" for the nested JSON file, "parquet" for the columnar tables,
+    "sqlite" to add the run to the results store (RESULTS_DB_NAME) of the output directory.
+    Returns the run summary (see src.instrumentation).
+    """
+    
+    if batched and engine == "threads":
+        raise ValueError("Batched questioning is not supported by the threads engine")
+
+    start = time.perf_counter()
+    output_name = "model_eval_data_batched" if batched else "model_eval_data"
+    jsonl_path = f"{output_dir}{output_name}.jsonl"
+
+    manifest_path = f"{output_dir}{output_name}.manifest.json"
+    previous = check_manifest(manifest_path, models, concepts, batched) if resume else None
+    manifest = write_manifest(manifest_path, texts, models, concepts, batched, run_key=previous and previous.get("run_key"))
+
+    completed_texts, completed_questions = load_progress(jsonl_path, texts, models, concepts) if resume else (set(), {})
+    if completed_texts:
+        print(f"Resuming: skipping {len(completed_texts)} of {len(texts)} texts that are already done")
+    texts = {label: text for label, text in texts.items() if label not in completed_texts}
+
+    # Stream every finished text (and, for the queue engine, every finished question) to JSONL
+    text_eval_result = None
+    with JsonlResultWriter(jsonl_path, append=resume) as writer:
+        if engine == "queue":
+            results = iter_scheduled(texts, models, concepts, max_workers=concurrency or MAX_WORKERS, batched=batched, writer=writer,
+                                     completed=completed_questions)
+        elif engine == "batch":
+            results = run_batch(texts, models, concepts, output_dir, batched=batched, batch_id=batch_id)
+        elif engine == "async":
+            results = iter_async(texts, models, concepts, max_concurrency=concurrency or MAX_CONCURRENCY, batched=batched)
+        else:
+            results = (text_eval(models, text, label, concepts) for label, text in texts.items())
+
+        for text_eval_result in results:
+            writer.write_text(text_eval_result)
+            print(f"Evaluation for {text_eval_result['label']} completed.\n")
+
+    # Save results to the legacy JSON file, the columnar Parquet tables and/or the results store
+    formats = formats or RESULT_FORMATS
+    if "json" in formats:
+        jsonl_to_json(jsonl_path, f"{output_dir}{output_name}.json")
+    if "parquet" in formats:
+        jsonl_to_parquet(jsonl_path, f"{output_dir}{output_name}.parquet")
+    if "sqlite" in formats:
+        with ResultsStore(f"{output_dir}{RESULTS_DB_NAME}") as store:
+            run_id = store.add_run(output_name, iter_aggregated(iter_latest_text_evals(jsonl_path)), batched=batched, run_key=manifest["run_key"])
+        print(f"Stored as run {run_id} in {output_dir}{RESULTS_DB_NAME}")
 
+    # Print results to console
+    if text_eval_result:
+        fancy_print_output(text_eval_result)
 
-def main(texts:dict, models:list, concepts:list[Concept], output_dir) -> None:
-    """Runs evaluation pipeline and saves results to JSON file."""
-    
-    results = []
-    # Run evaluation
-    for label, text in texts.items():
-        text_eval_result = text_eval(models, text, label, concepts)
-        results.append(text_eval_result)
-        print(f"Evaluation for {label} completed.\n")
+    # Usage, cost and latency of the whole run (including texts finished before a resume)
+    summary = run_summary(iter_text_evals(jsonl_path), wall_time=time.perf_counter() - start)
+    with open(f"{output_dir}{output_name}.summary.json", "w") as f:
+        json.dump(summary, f, indent=4)
+    print_run_summary(summary)
 
-    # Save results to JSON file
-    with open(f"{output_dir}model_eval_data.json", "w") as f:
-        json.dump(results, f, indent=4)
+    if get_response_cache():
+        print(f"Response cache: {get_response_cache().stats()}")
+    print(f"HTTP connections: {connection_stats()}")
 
-    # Print results to console
-    fancy_print_output(text_eval_result)
+    return summary
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Lazarsfeld LLM evaluation pipeline.")
+    parser.add_argument("--engine", choices=["queue", "threads", "async", "batch"], default="queue",
+                        help="queue: one global pool of MAX_WORKERS threads, threads: one text at a time, "
+                             "async: all calls concurrently (bounded by MAX_CONCURRENCY), "
+                             "batch: one offline Batch API job")
+    parser.add_argument("--batch-id", default=None,
+                        help="with --engine batch: poll and ingest an already submitted batch")
+    parser.add_argument("--batched", action="store_true",
+                        help="ask all questions of a dimension in one structured-output request")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run, skipping texts and questions that are already done")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always call the API, bypassing the response cache")
+    parser.add_argument("--prompt-layout", choices=["default", "prefix_cache"], default=PROMPT_LAYOUT,
+                        help="prefix_cache: put the input text first so the provider can cache the shared prompt prefix")
+    parser.add_argument("--scoring", choices=["first_token", "constrained"], default=SCORING_MODE,
+                        help="constrained: one output token limited to True/False by a logit bias, scored from the "
+                             "renormalized pair (single questions only, not --batched)")
+    parser.add_argument("--formats", default=",".join(RESULT_FORMATS),
+                        help="comma-separated result formats to write next to the JSONL: json, parquet, sqlite")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        set_response_cache(None)
+    set_prompt_layout(args.prompt_layout)
+    set_scoring_mode(args.scoring)
+
     # load concept from json file
     csv_path = Path('eval_concepts/LLM_eval_concepten - Taalniveau B1.csv')
     process_concept_csv(csv_path, output_filepath=Path('eval_concepts/taalniveau_b1_concept.json'), concept_name="Taalniveau_B1")
@@ -257,7 +269,8 @@ if __name__ == "__main__":
 
     models = ["gpt-3.5-turbo-0125", "gpt-4o", "gpt-4-turbo"]
 
-    main(texts, models, concepts['concepts'], output_dir)
+    main(texts, models, concepts['concepts'], output_dir, engine=args.engine, batched=args.batched,
+         batch_id=args.batch_id, resume=args.resume, formats=args.formats.split(","))
 
 
 
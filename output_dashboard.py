@@ -8,14 +8,18 @@ import numpy as np
 import seaborn as sns
 from matplotlib.gridspec import GridSpec
 
+from config.config import DASHBOARD_CACHE_FILES, DASHBOARD_CACHE_SELECTIONS
 from src.analysis import (
-    load_evals_dict, 
-    create_eval_df, 
+    eval_file_path,
+    load_evals_dict,
+    create_eval_df,
+    load_eval_dfs,
     combine_eval_dfs, 
     calculate_average_question_score,
     calculate_average_dimension_score, 
     calculate_average_concept_score
 )
+from src.columnar import aggregate_tables, read_aggregates, table_paths
 
 # Set page configuration
 st.set_page_config(
@@ -31,10 +35,52 @@ This dashboard visualizes the results of language model evaluations based on the
 Select files to compare and explore evaluation scores across concepts and dimensions.
 """)
 
-# Get available evaluation files
+# Get available evaluation files: nested JSON (without extension) and columnar results (.parquet)
 def get_available_files():
-    files = glob.glob("evaluation_results/*.json")
-    return [os.path.basename(f).replace(".json", "") for f in files]
+    files = [
+        os.path.basename(f).replace(".json", "") for f in glob.glob("evaluation_results/*.json")
+        if not f.endswith((".summary.json", ".manifest.json", ".params.json"))
+    ]
+    files += [
+        os.path.basename(f) for f in glob.glob("evaluation_results/*.parquet")
+        if not f.endswith((".texts.parquet", ".concepts.parquet", ".aggregates.parquet"))
+    ]
+    return files
+
+# Cached data layer. A results file is identified by its path, size and modification time, so widget
+# interactions reuse the loaded aggregate tables, and a rewritten file is loaded again.
+def file_fingerprint(file):
+    stat = os.stat(eval_file_path(file))
+    return (file, stat.st_size, stat.st_mtime_ns)
+
+@st.cache_data(show_spinner=False, max_entries=DASHBOARD_CACHE_FILES)
+def load_text_eval(file, size, mtime_ns):
+    # size and mtime_ns are only part of the cache key
+    return load_evals_dict([file])[0]
+
+@st.cache_data(show_spinner=False, max_entries=DASHBOARD_CACHE_FILES)
+def load_file_dfs(file, size, mtime_ns):
+    # One DataFrame per text; Parquet files are read directly as columns
+    if file.endswith(".parquet"):
+        return load_eval_dfs([file])
+    return {file: create_eval_df(load_text_eval(file, size, mtime_ns))}
+
+@st.cache_data(show_spinner=False, max_entries=DASHBOARD_CACHE_FILES)
+def load_file_aggregates(file, size, mtime_ns):
+    # Columnar results come with aggregate tables materialized at write time; JSON files are aggregated once here
+    if file.endswith(".parquet") and os.path.exists(table_paths(eval_file_path(file))["aggregates"]):
+        return read_aggregates(eval_file_path(file))
+    return aggregate_tables(combine_eval_dfs(load_file_dfs(file, size, mtime_ns)))
+
+@st.cache_resource(show_spinner=False, max_entries=DASHBOARD_CACHE_SELECTIONS)
+def load_aggregates(fingerprints):
+    # Shared by all reruns without copying: callers must not modify the returned frames
+    aggregates = pd.concat([load_file_aggregates(*fingerprint) for fingerprint in fingerprints], ignore_index=True)
+    cross_model = aggregates["model"].isna()
+    return {
+        (level, by_model): rows.drop(columns=["level"] + ([] if by_model else ["model"])).reset_index(drop=True)
+        for (level, by_model), rows in aggregates.groupby(["level", ~cross_model], sort=False)
+    }
 
 # Sidebar for controls
 st.sidebar.header("Controls")
@@ -51,23 +97,11 @@ if not selected_files:
     st.warning("Please select at least one evaluation file to continue.")
     st.stop()
 
-# Load selected evaluations
+# Load selected evaluations (from the cache unless a file changed)
+fingerprints = tuple(file_fingerprint(file) for file in selected_files)
 with st.spinner("Loading evaluation data..."):
-    evals = load_evals_dict(selected_files)
-    
-    # Create DataFrames from evaluations
-    eval_dfs = {}
-    for text, eval_result in zip(selected_files, evals):
-        eval_dfs[text] = create_eval_df(eval_result)
-    
-    # Combine DataFrames for comparison
-    if len(eval_dfs) > 0:
-        combined_df = combine_eval_dfs(eval_dfs)
-
-# Calculate average scores across models for each text
-def calculate_cross_model_scores(df):
-    # Group by text_key, concept, and dimension, then average across models
-    return df.groupby(['text_key', 'concept', 'dimension']).agg({'score': 'mean'}).reset_index()
+    # (level, per model) -> mean question scores, see src.columnar.aggregate_tables
+    aggregates = load_aggregates(fingerprints)
 
 # Display tabs for different views
 tab1, tab2, tab3, tab4 = st.tabs([
@@ -81,11 +115,11 @@ tab1, tab2, tab3, tab4 = st.tabs([
 with tab1:
     st.header("Evaluation Overview")
     
-    # Calculate average scores across models
-    cross_model_scores = calculate_cross_model_scores(combined_df)
+    # Average scores across models per text, concept and dimension
+    cross_model_scores = aggregates[("dimension", False)]
     
     # Overall scores by text (averaging across dimensions and models)
-    overall_by_text = cross_model_scores.groupby('text_key').agg({'score': 'mean'}).reset_index()
+    overall_by_text = cross_model_scores.groupby('text_key', observed=True).agg({'score': 'mean'}).reset_index()
     
     # Display as bar chart
     if not overall_by_text.empty:
@@ -104,7 +138,7 @@ with tab1:
     st.subheader("Dimension Scores Across Texts")
     
     # Calculate average dimension scores
-    avg_dim_scores = cross_model_scores.groupby(['dimension', 'text_key']).agg({'score': 'mean'}).reset_index()
+    avg_dim_scores = cross_model_scores.groupby(['dimension', 'text_key'], observed=True).agg({'score': 'mean'}).reset_index()
     dim_pivot = avg_dim_scores.pivot(index='dimension', columns='text_key', values='score')
     
     # Display dimension scores as bar chart
@@ -156,15 +190,13 @@ with tab2:
     st.header("Dimension Score Comparison")
     
     # Model selection for dimension comparison
-    model_options = list(set(combined_df["model"])) if not combined_df.empty else []
+    model_dimension_scores = aggregates[("dimension", True)]
+    model_options = list(model_dimension_scores["model"].unique())
     selected_model = st.selectbox("Select Model for Comparison:", model_options)
     
     if selected_model:
-        # Filter by selected model
-        model_df = combined_df[combined_df["model"] == selected_model]
-        
-        # Calculate average dimension scores
-        avg_dim_scores = calculate_average_dimension_score(model_df)
+        # Average dimension scores of the selected model
+        avg_dim_scores = model_dimension_scores[model_dimension_scores["model"] == selected_model]
         
         # Pivot for comparison
         dim_pivot = avg_dim_scores.pivot(index='dimension', columns='text_key', values='score')
@@ -193,7 +225,7 @@ with tab3:
     col1, col2 = st.columns(2)
     
     with col1:
-        dimension_options = sorted(list(set(combined_df["dimension"]))) if not combined_df.empty else []
+        dimension_options = sorted(set(aggregates[("dimension", False)]["dimension"]))
         selected_dimension = st.selectbox("Filter by Dimension:", 
                                           options=["All"] + dimension_options)
     
@@ -201,14 +233,15 @@ with tab3:
         score_threshold = st.slider("Minimum Score Threshold:", 
                                    min_value=0.0, max_value=1.0, value=0.0, step=0.05)
     
-    # Filter data based on selections
-    filtered_df = combined_df.copy()
+    # Without a threshold the cross-model question scores are used as they are; with one, the scores of the
+    # individual models are filtered first and then averaged
+    question_scores = aggregates[("question", score_threshold > 0)]
     if selected_dimension != "All":
-        filtered_df = filtered_df[filtered_df["dimension"] == selected_dimension]
-    filtered_df = filtered_df[filtered_df["score"] >= score_threshold]
+        question_scores = question_scores[question_scores["dimension"] == selected_dimension]
+    question_scores = question_scores[question_scores["score"] >= score_threshold]
     
     # Calculate average question scores
-    avg_question_scores = calculate_average_question_score(filtered_df)
+    avg_question_scores = calculate_average_question_score(question_scores) if score_threshold > 0 else question_scores
     
     # Display question scores
     if not avg_question_scores.empty:
@@ -26,4 +26,81 @@ Bekijk de hele tekst goed. Wees hierbij erg kritisch. Geef niet het wenselijke a
 {question}
          
 Evalueer de tekst en beantwoordt de vraag met True of False, wees hierbij kritisch.
-""")
\ No newline at end of file
+""")
+
+# Same instructions as base_eval_prompt, but the input text comes first and the question-specific
+# part last. All questions about one text then share a long common prefix (system prompt + text),
+# which lets provider-side prompt caching reuse it.
+prefix_eval_prompt = PromptTemplate.from_template(
+    """
+# Tekst:
+{input_text}
+
+
+
+# Opdracht:
+Je hebt hierboven een stuk tekst gekregen. Je gaat de tekst evalueren op het gebied van {concept}. Je richt je hierbij op de volgende vraag:
+{question}
+De vraag draait om de dimensie {dimension} van het concept {concept}. Je mag de vraag alleen beantwoorden met 'True' of 'False'. 
+Bekijk de hele tekst goed. Wees hierbij erg kritisch. Geef niet het wenselijke antwoord, maar wees eerlijk. Het is beter om iets te streng te zijn dan te soepel.
+
+# Voorbeeld informatie:
+{examples}
+
+# Herhaling vraag:
+{question}
+         
+Evalueer de tekst en beantwoordt de vraag met True of False, wees hierbij kritisch.
+""")
+
+
+batched_eval_prompt = PromptTemplate.from_template(
+    """
+# Opdracht:
+Je krijgt een stuk tekst te zien. Je gaat de tekst evalueren op het gebied van {concept}. Je richt je hierbij op de dimensie {dimension} van het concept {concept}.
+Je beantwoordt hiervoor meerdere vragen. Elke vraag heeft een label. Je mag elke vraag alleen beantwoorden met true of false.
+Bekijk de hele tekst goed. Wees hierbij erg kritisch. Geef niet het wenselijke antwoord, maar wees eerlijk. Het is beter om iets te streng te zijn dan te soepel.
+
+# Vragen:
+{questions}
+
+# Tekst:
+{input_text}
+
+
+
+# Herhaling opdracht:
+Evalueer de tekst en geef voor elk label een JSON-veld met true of false, wees hierbij kritisch.
+""")
+
+batched_prefix_eval_prompt = PromptTemplate.from_template(
+    """
+# Tekst:
+{input_text}
+
+
+
+# Opdracht:
+Je hebt hierboven een stuk tekst gekregen. Je gaat de tekst evalueren op het gebied van {concept}. Je richt je hierbij op de dimensie {dimension} van het concept {concept}.
+Je beantwoordt hiervoor meerdere vragen. Elke vraag heeft een label. Je mag elke vraag alleen beantwoorden met true of false.
+Bekijk de hele tekst goed. Wees hierbij erg kritisch. Geef niet het wenselijke antwoord, maar wees eerlijk. Het is beter om iets te streng te zijn dan te soepel.
+
+# Vragen:
+{questions}
+
+# Herhaling opdracht:
+Evalueer de tekst en geef voor elk label een JSON-veld met true of false, wees hierbij kritisch.
+""")
+
+batched_question_prompt = PromptTemplate.from_template(
+    """## {label}
+{question}
+
+Voorbeeld informatie:
+{examples}
+""")
+
+
+# Prompt layouts: "default" asks the question before the text, "prefix_cache" puts the text first
+eval_prompts = {"default": base_eval_prompt, "prefix_cache": prefix_eval_prompt}
+batched_eval_prompts = {"default": batched_eval_prompt, "prefix_cache": batched_prefix_eval_prompt}
@@ -0,0 +1,155 @@
+import sys
+import json
+import time
+import numpy as np
+from typing import Dict, Iterable, Iterator, List
+
+from config.config import DEFAULT_WEIGHT, AGGREGATE_CHUNK_TEXTS
+from src.concepts import TextEval, Concept
+
+
+class ScoreTensor:
+    """Question scores of a whole run as one dense array.
+
+    `scores` has shape (texts, models, concepts, dimensions, questions) and holds NaN for
+    missing scores: unanswered questions, failed models and padding where a concept has fewer
+    dimensions or a dimension fewer questions than the largest one. `present` marks the
+    positions that exist in the concept structure at all.
+    """
+
+    def __init__(self, labels: List[str], models: List[str], concepts: List[Concept]):
+        self.labels = labels
+        self.models = models
+        self.concepts = concepts
+
+        n_dimensions = max(len(c["dimensions"]) for c in concepts)
+        n_questions = max(len(d["questions"]) for c in concepts for d in c["dimensions"])
+        shape = (len(labels), len(models), len(concepts), n_dimensions, n_questions)
+        self.scores = np.full(shape, np.nan)
+
+        # Structure: which (concept, dimension, question) positions exist, and their weights
+        self.present = np.zeros(shape[2:], dtype=bool)
+        self.dimension_weights = np.zeros(shape[2:4])
+        self.concept_weights = np.array([c.get("weight", DEFAULT_WEIGHT) for c in concepts], dtype=float)
+        for c, concept in enumerate(concepts):
+            for d, dimension in enumerate(concept["dimensions"]):
+                self.present[c, d, :len(dimension["questions"])] = True
+                self.dimension_weights[c, d] = dimension.get("weight", DEFAULT_WEIGHT)
+
+    @classmethod
+    def from_text_evals(cls, text_evals: List[TextEval]) -> "ScoreTensor":
+        """Fills a tensor from nested TextEvals that share the same models and concepts."""
+        models = list(dict.fromkeys(m for t in text_evals for m in t["evaluations"]))
+        tensor = cls([t["label"] for t in text_evals], models, text_evals[0]["concepts"])
+
+        # Gather every dimension's scores into one flat list with the flat offset of its first
+        # question, then scatter them into the array in a single assignment
+        _, n_models, n_concepts, n_dimensions, n_questions = tensor.scores.shape
+        model_positions = {model: m for m, model in enumerate(models)}
+        values, starts, lengths = [], [], []
+        for t, text_eval in enumerate(text_evals):
+            for model, model_eval in text_eval["evaluations"].items():
+                if model_eval is None:
+                    continue
+                base = (t * n_models + model_positions[model]) * n_concepts
+                for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                    for d, dimension_eval in enumerate(concept_eval["dimensions"]):
+                        row = [q["score"] for q in dimension_eval["questions"]]
+                        values.extend(row)
+                        starts.append(((base + c) * n_dimensions + d) * n_questions)
+                        lengths.append(len(row))
+
+        lengths = np.array(lengths, dtype=np.int64)
+        row_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        flat_index = np.repeat(np.array(starts, dtype=np.int64), lengths) + np.arange(lengths.sum()) - row_offsets
+        tensor.scores.reshape(-1)[flat_index] = np.array(values, dtype=float)  # None -> NaN
+        return tensor
+
+
+def _weighted_nanmean(values: np.ndarray, weights: np.ndarray, axis: int) -> np.ndarray:
+    """Weighted mean over one axis that skips NaN values, rounded like mean_score. All-NaN gives NaN."""
+    mask = ~np.isnan(values)
+    weights = np.broadcast_to(weights, values.shape) * mask
+    total = weights.sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (np.where(mask, values, 0.0) * weights).sum(axis=axis) / total
+    return np.round(np.where(total > 0, mean, np.nan), 3)
+
+
+def aggregate(tensor: ScoreTensor) -> Dict[str, np.ndarray]:
+    """Computes every overall score of the run in four reductions.
+
+    Questions are averaged per dimension, dimensions weighted by their weight per concept,
+    concepts weighted by their weight per model and models averaged per text. Missing scores
+    are left out and the remaining weights renormalized, as mean_score does with None.
+    """
+    scores = np.where(tensor.present, tensor.scores, np.nan)
+    dimension = _weighted_nanmean(scores, np.ones(scores.shape[-1]), axis=-1)  # (T, M, C, D)
+    concept = _weighted_nanmean(dimension, tensor.dimension_weights, axis=-1)  # (T, M, C)
+    model = _weighted_nanmean(concept, tensor.concept_weights, axis=-1)  # (T, M)
+    text = _weighted_nanmean(model, np.full(model.shape[-1], DEFAULT_WEIGHT), axis=-1)  # (T,)
+    return {"dimension": dimension, "concept": concept, "model": model, "text": text}
+
+
+def _to_scores(values: np.ndarray) -> list:
+    """Nested lists of floats with None for NaN, like the scores of the nested output."""
+    scores = values.astype(object)
+    scores[np.isnan(values)] = None
+    return scores.tolist()
+
+
+def apply_aggregates(text_evals: List[TextEval], tensor: ScoreTensor, aggregates: Dict[str, np.ndarray]) -> None:
+    """Writes the aggregated scores back into the overall_score fields of the nested TextEvals."""
+    dimension, concept, model, text = (_to_scores(aggregates[k]) for k in ("dimension", "concept", "model", "text"))
+    for t, text_eval in enumerate(text_evals):
+        evaluations = text_eval["evaluations"]
+        for m, model_name in enumerate(tensor.models):
+            model_eval = evaluations.get(model_name)
+            if model_eval is None:
+                continue
+            dimension_scores, concept_scores = dimension[t][m], concept[t][m]
+            for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                for dimension_eval, score in zip(concept_eval["dimensions"], dimension_scores[c]):
+                    dimension_eval["overall_score"] = score
+                concept_eval["overall_score"] = concept_scores[c]
+            model_eval["overall_score"] = model[t][m]
+        text_eval["aggregated_score"] = text[t]
+
+
+def aggregate_text_evals(text_evals: List[TextEval]) -> List[TextEval]:
+    """Recomputes all dimension, concept, model and text scores of a run in place, weight-aware."""
+    if text_evals:
+        tensor = ScoreTensor.from_text_evals(text_evals)
+        apply_aggregates(text_evals, tensor, aggregate(tensor))
+    return text_evals
+
+
+def iter_aggregated(text_evals: Iterable[TextEval], chunk_texts: int = AGGREGATE_CHUNK_TEXTS) -> Iterator[TextEval]:
+    """Yields the TextEvals with all their scores recomputed by aggregate_text_evals, a chunk of texts at a time.
+
+    This is how a run's results are aggregated when they are converted (JSON, Parquet, results
+    store), so memory stays bounded by one chunk. A chunk also ends where the concepts change.
+    """
+    chunk: List[TextEval] = []
+    for text_eval in text_evals:
+        if chunk and (len(chunk) >= chunk_texts or text_eval["concepts"] != chunk[0]["concepts"]):
+            yield from aggregate_text_evals(chunk)
+            chunk = []
+        chunk.append(text_eval)
+    yield from aggregate_text_evals(chunk)
+
+
+if __name__ == "__main__":
+    # Re-aggregate an existing results file: python -m src.aggregation results.json [output.json]
+    input_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else input_path
+
+    with open(input_path, "r") as f:
+        results = json.load(f)
+
+    start = time.perf_counter()
+    aggregate_text_evals(results)
+    print(f"Aggregated {len(results)} texts in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=4)
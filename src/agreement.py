@@ -0,0 +1,250 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from config.config import AGREEMENT_BOOTSTRAP_CELLS, AGREEMENT_CONFIDENCE, AGREEMENT_RESAMPLES, AGREEMENT_WORKERS
+from src.compare_scores import load_model_scores
+
+LEVELS = ("question", "dimension", "concept")
+METHODS = ("spearman", "pearson")
+LEVEL_KEYS = {
+    "question": ["label", "concept", "dimension", "question"],
+    "dimension": ["label", "concept", "dimension"],
+    "concept": ["label", "concept"],
+}
+REPORT_COLUMNS = ["level", "method", "model_a", "model_b", "n", "r", "ci_low", "ci_high"]
+
+
+def level_rows(scores: pd.DataFrame, level: str) -> pd.DataFrame:
+    """The question, dimension or concept rows of a frame like extract_all_model_scores makes.
+
+    An empty dimension or question may be '' or missing (as read back from CSV).
+    """
+    has_dimension = scores["dimension"].notna() & (scores["dimension"] != "")
+    has_question = scores["question"].notna() & (scores["question"] != "")
+    if level == "question":
+        mask = has_question
+    elif level == "dimension":
+        mask = has_dimension & ~has_question
+    elif level == "concept":
+        mask = ~has_dimension & (scores["concept"] != "TEXT")
+    else:
+        raise ValueError(f"Unknown level {level!r}, use one of {LEVELS}")
+    return scores[mask]
+
+
+def score_matrix(scores: pd.DataFrame, level: str = "question") -> pd.DataFrame:
+    """Scores at one level as a matrix: a row per text and question (or dimension, concept), a column per model."""
+    rows = level_rows(scores, level)
+    matrix = rows.pivot_table(index=LEVEL_KEYS[level], columns="model", values="score", aggfunc="mean", observed=True)
+    return matrix.reindex(columns=[model for model in rows["model"].unique() if model in matrix.columns])
+
+
+def _ranks(values: np.ndarray) -> np.ndarray:
+    """Ranks along the last axis, ties getting their average rank (like pandas' rank)."""
+    n = values.shape[-1]
+    order = np.argsort(values, axis=-1, kind="stable")
+    ordered = np.take_along_axis(values, order, axis=-1)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+    position = np.arange(n)
+    first = np.maximum.accumulate(np.where(starts, position, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(ends, position, n), axis=-1), axis=-1), axis=-1)
+    ranks = np.empty(values.shape, dtype=float)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=-1)
+    return ranks
+
+
+def _correlations(x: np.ndarray, y: np.ndarray, method: str) -> np.ndarray:
+    """Correlation of every row of x with the same row of y (NaN where either is constant)."""
+    if method == "spearman":
+        x, y = _ranks(x), _ranks(y)
+    x = x - x.mean(axis=-1, keepdims=True)
+    y = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (x * y).sum(axis=-1) / np.sqrt((x * x).sum(axis=-1) * (y * y).sum(axis=-1))
+
+
+def _weighted_ranks(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Average ranks of `values` within every bootstrap sample, a sample being a row of draw counts.
+
+    Values are sorted once; a value's rank in a sample is the number of drawn values below it
+    plus half of its own draws, so no sample is sorted again.
+    """
+    order = np.argsort(values, kind="stable")
+    ordered = values[order]
+    new_group = np.ones(len(values), dtype=bool)
+    new_group[1:] = ordered[1:] != ordered[:-1]
+    group = np.empty(len(values), dtype=np.intp)
+    group[order] = np.cumsum(new_group) - 1
+    counts = np.add.reduceat(weights[:, order], np.flatnonzero(new_group), axis=1)
+    ranks = np.cumsum(counts, axis=1) - counts + (counts + 1) / 2
+    return ranks[:, group]
+
+
+def _weighted_sums(weights: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Sum of weights * a * b per sample; a and b are per pair (1-D) or per sample and pair (2-D)."""
+    if a.ndim == 1:
+        return weights @ (a * b)
+    return np.einsum("ij,ij,ij->i", weights, a, b)
+
+
+def _bootstrap_chunk(x: np.ndarray, y: np.ndarray, method: str, resamples: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """Correlations of `resamples` bootstrap samples of the pairs (x, y), all computed at once.
+
+    A sample is represented by how often it draws every pair, which makes its correlation a
+    weighted one: a few sums over a (resamples x pairs) matrix instead of a sort per sample.
+    """
+    n = len(x)
+    draws = np.random.default_rng(seed).integers(0, n, size=(resamples, n))
+    draws += n * np.arange(resamples)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=resamples * n).reshape(resamples, n).astype(float)
+    if method == "spearman":
+        # The mean rank of every sample is (n + 1) / 2, so centered ranks need no weighted mean
+        x = _weighted_ranks(x, weights) - (n + 1) / 2
+        y = _weighted_ranks(y, weights) - (n + 1) / 2
+        mean_x = mean_y = 0.0
+    else:
+        x, y = x - x.mean(), y - y.mean()
+        mean_x, mean_y = weights @ x / n, weights @ y / n
+    covariance = _weighted_sums(weights, x, y) / n - mean_x * mean_y
+    variance_x = _weighted_sums(weights, x, x) / n - mean_x ** 2
+    variance_y = _weighted_sums(weights, y, y) / n - mean_y ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return covariance / np.sqrt(variance_x * variance_y)
+
+
+def _pairs(matrix: pd.DataFrame):
+    """(model_a, model_b, x, y) for every pair of models, restricted to the rows both have a score for."""
+    values = matrix.to_numpy(dtype=float)
+    for a, b in combinations(range(values.shape[1]), 2):
+        both = ~np.isnan(values[:, a]) & ~np.isnan(values[:, b])
+        yield matrix.columns[a], matrix.columns[b], values[both, a], values[both, b]
+
+
+def correlation_matrix(matrix: pd.DataFrame, method: str = "spearman") -> pd.DataFrame:
+    """Model x model correlations of a score_matrix, each pair over the rows both models scored."""
+    result = pd.DataFrame(np.eye(matrix.shape[1]), index=matrix.columns, columns=matrix.columns)
+    for a, b, x, y in _pairs(matrix):
+        result.loc[a, b] = result.loc[b, a] = _correlations(x, y, method) if len(x) > 1 else np.nan
+    return result
+
+
+def agreement_report(
+        scores: pd.DataFrame,
+        levels: Sequence[str] = LEVELS,
+        methods: Sequence[str] = METHODS,
+        resamples: int = AGREEMENT_RESAMPLES,
+        confidence: float = AGREEMENT_CONFIDENCE,
+        workers: Optional[int] = AGREEMENT_WORKERS,
+        seed: int = 0
+        ) -> pd.DataFrame:
+    """Correlation of every pair of models at every level and method, with bootstrap confidence intervals.
+
+    Each pair is resampled over the rows both models scored. The resamples of a pair are drawn as
+    one matrix of draw counts and correlated in one go (see _bootstrap_chunk), in chunks of at most
+    AGREEMENT_BOOTSTRAP_CELLS values spread over a pool of `workers` processes (1 computes them
+    in this process). The intervals are bootstrap percentiles and do not depend on the number
+    of workers for a given seed.
+    """
+    rows, tasks = [], []
+    for level in levels:
+        matrix = score_matrix(scores, level)
+        for method in methods:
+            for a, b, x, y in _pairs(matrix):
+                rows.append({"level": level, "method": method, "model_a": a, "model_b": b, "n": len(x),
+                             "r": _correlations(x, y, method) if len(x) > 1 else np.nan})
+                if len(x) > 1:
+                    chunk = max(1, min(resamples, AGREEMENT_BOOTSTRAP_CELLS // len(x)))
+                    for start in range(0, resamples, chunk):
+                        tasks.append((len(rows) - 1, x, y, method, min(chunk, resamples - start)))
+
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    arguments = [[task[i] for task in tasks] for i in range(1, 5)] + [seeds]
+    if workers == 1 or not tasks:
+        chunks = list(map(_bootstrap_chunk, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_bootstrap_chunk, *arguments))
+
+    samples: List[List[np.ndarray]] = [[] for _ in rows]
+    for task, chunk in zip(tasks, chunks):
+        samples[task[0]].append(chunk)
+    tail = (1 - confidence) / 2 * 100
+    for row, row_samples in zip(rows, samples):
+        with np.errstate(invalid="ignore"):
+            row["ci_low"], row["ci_high"] = (np.nanpercentile(np.concatenate(row_samples), [tail, 100 - tail])
+                                             if row_samples else (np.nan, np.nan))
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def reference_agreement(
+        scores: pd.DataFrame,
+        reference: str,
+        level: str = "question",
+        by: Optional[str] = None,
+        aggregate_models: Optional[Iterable[str]] = None,
+        method: str = "spearman"
+        ) -> pd.DataFrame:
+    """Correlation of every model with a reference model, optionally per concept or dimension (`by`).
+
+    `aggregate_models` is the mean score of those models (by default all but the reference),
+    compared to the reference as if it were one more model.
+    """
+    matrix = score_matrix(scores, level)
+    models = [model for model in matrix.columns if model != reference]
+    aggregate_models = models if aggregate_models is None else list(aggregate_models)
+    matrix["aggregate_models"] = matrix[aggregate_models].mean(axis=1)
+
+    groups = matrix.groupby(level=by, observed=True, sort=False) if by else [(None, matrix)]
+    rows = []
+    for group, group_matrix in groups:
+        for model in [*models, "aggregate_models"]:
+            both = group_matrix[[reference, model]].dropna()
+            rows.append({**({by: group} if by else {}), "model": model, "n": len(both),
+                         f"{method}_r": _correlations(both[reference].to_numpy(), both[model].to_numpy(), method)
+                         if len(both) > 1 else np.nan})
+    return pd.DataFrame(rows)
+
+
+def reference_differences(scores: pd.DataFrame, reference: str, level: str = "question") -> pd.DataFrame:
+    """Absolute difference of every model with a reference model per row, most deviating rows first.
+
+    max_diff and mean_diff summarize the differences of a row over the models.
+    """
+    matrix = score_matrix(scores, level)
+    models = [model for model in matrix.columns if model != reference]
+    differences = matrix[models].sub(matrix[reference], axis=0).abs().add_prefix("diff_")
+    differences["max_diff"] = differences.max(axis=1)
+    differences["mean_diff"] = differences.iloc[:, :len(models)].mean(axis=1)
+    return differences.sort_values("max_diff", ascending=False).reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agreement between the models of a results file")
+    parser.add_argument("file", help="Results file (JSON, JSONL or Parquet) or a flat score CSV")
+    parser.add_argument("--reference", help="Model to compare every other model with, e.g. LL-01-pro")
+    parser.add_argument("--resamples", type=int, default=AGREEMENT_RESAMPLES, help="Bootstrap resamples per pair")
+    parser.add_argument("--workers", type=int, default=AGREEMENT_WORKERS, help="Processes for the bootstrap")
+    parser.add_argument("--output", help="CSV file to write the agreement report to")
+    args = parser.parse_args()
+
+    scores = pd.read_csv(args.file) if args.file.endswith(".csv") else load_model_scores(args.file)
+    report = agreement_report(scores, resamples=args.resamples, workers=args.workers)
+    print(report.to_string(index=False))
+    if args.output:
+        report.to_csv(args.output, index=False)
+        print(f"Agreement report saved to {args.output}")
+
+    if args.reference:
+        print(f"\nAgreement with {args.reference}")
+        print(reference_agreement(scores, args.reference).to_string(index=False))
+        print(reference_agreement(scores, args.reference, by="dimension").to_string(index=False))
+        print(f"\nQuestions deviating most from {args.reference}")
+        print(reference_differences(scores, args.reference).head(20).to_string(index=False))
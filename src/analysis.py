@@ -2,37 +2,80 @@ import pandas as pd
 import json
 import matplotlib.pyplot as plt
 from src.concepts import TextEval
+from src.columnar import read_questions
+from src.flatten import flatten_text_evals
+from src.results_store import ResultsStore
+from src.streaming import load_question_frame
+
+EVAL_DF_COLUMNS = ['model', 'concept', 'dimension', 'question', 'score', 'logprob']
+
+
+def eval_file_path(file: str) -> str:
+    """Path of an evaluation file: JSON files are named without extension, Parquet files with it."""
+    return f'evaluation_results/{file}' if file.endswith('.parquet') else f'evaluation_results/{file}.json'
 
 
 def load_evals_dict(texts:list) -> list[TextEval]:
     """Loads evaluation results from JSON files into a list of TextEval objects."""
     evals = []
     for text in texts:
-        with open(f'evaluation_results/{text}.json', 'r') as f:
+        with open(eval_file_path(text), 'r') as f:
             evals.append(TextEval(json.load(f)))
 
     return evals
 
 
 def create_eval_df(eval_results:TextEval) -> pd.DataFrame:
-    """Creates a DataFrame from the evaluation results."""
-    data = []
-    
-    for model, eval in eval_results['evaluations'].items():
-        for concept in eval['concepts_scores']:
-            for dimension in concept['dimensions']:
-                for question in dimension['questions']:
-                    data.append({
-                        'model': model,
-                        'concept': concept['concept_description'],
-                        'dimension': dimension['dimension_description'],
-                        #'question_label': question['label'],
-                        'question': question['question'],
-                        'score': question['score'],
-                        'logprob': question['logprob'],
-                    })
-
-    return pd.DataFrame(data)
+    """Creates a DataFrame from the evaluation results, one row per question (see src.flatten)."""
+    return flatten_text_evals([eval_results], levels=['question'], columns=EVAL_DF_COLUMNS)
+
+
+def load_eval_dfs(files: list) -> dict[str, pd.DataFrame]:
+    """Loads evaluation files into DataFrames like create_eval_df makes them, one per text.
+
+    A JSON file holds one TextEval and is keyed by its file name. A columnar results file
+    (name ending in .parquet, see src.columnar) is read directly, without rebuilding the
+    nested results, and gives one DataFrame per text label.
+    """
+    eval_dfs = {}
+    for file in files:
+        if file.endswith('.parquet'):
+            df = read_questions(eval_file_path(file), columns=['label'] + EVAL_DF_COLUMNS)
+            for label, text_df in df.groupby('label', observed=True):
+                eval_dfs[label] = text_df.drop(columns='label').reset_index(drop=True)
+        else:
+            eval_dfs[file] = create_eval_df(load_evals_dict([file])[0])
+
+    return eval_dfs
+
+
+def query_eval_dfs(store: ResultsStore, **filters) -> dict[str, pd.DataFrame]:
+    """Like load_eval_dfs, but reads only the questions matching the filters from the results store.
+
+    Filters are columns of src.results_store.QUESTION_COLUMNS, e.g. run=3 or model=['gpt-4o', 'gpt-4-turbo'].
+    """
+    df = store.question_scores(columns=['label', 'model', 'concept', 'dimension', 'question'], **filters)
+    return {label: text_df.drop(columns='label').reset_index(drop=True) for label, text_df in df.groupby('label', sort=False)}
+
+
+def query_average_scores(store: ResultsStore, by: list[str], **filters) -> pd.DataFrame:
+    """Average question score per group, computed in SQL over the results store.
+
+    Same result as the calculate_average_* functions on a combined DataFrame, e.g.
+    by=['concept', 'dimension', 'text_key'] for calculate_average_dimension_score, plus the number
+    of scored questions per group (n). Only the aggregated rows are loaded into memory.
+    """
+    return store.mean_scores(by, **filters)
+
+
+def load_eval_frame(path: str, models: list = None, labels: list = None) -> pd.DataFrame:
+    """Streams a results file (JSON array or JSONL, any size) into one frame like combine_eval_dfs makes.
+
+    The nested results are never held in memory as a whole; texts and models outside `labels`
+    and `models` are skipped before they are flattened. The text label is the text_key.
+    """
+    frame = load_question_frame(path, models=models, labels=labels)
+    return frame.rename(columns={'label': 'text_key'})
 
 
 def combine_eval_dfs(eval_dfs: dict[str, pd.DataFrame]) -> pd.DataFrame:
@@ -44,19 +87,19 @@ def combine_eval_dfs(eval_dfs: dict[str, pd.DataFrame]) -> pd.DataFrame:
 
 def calculate_average_question_score(eval_df:pd.DataFrame) -> pd.DataFrame:
     """Calculates the average question score for each model and concept."""
-    avg_scores = eval_df.groupby(['concept', 'dimension', 'question', 'text_key']).agg({'score': 'mean'}).reset_index()
+    avg_scores = eval_df.groupby(['concept', 'dimension', 'question', 'text_key'], observed=True).agg({'score': 'mean'}).reset_index()
     return avg_scores
 
 
 def calculate_average_dimension_score(eval_df:pd.DataFrame) -> pd.DataFrame:
     """Calculates the average dimension score for each model and concept."""
-    avg_scores = eval_df.groupby(['concept', 'dimension', 'text_key']).agg({'score': 'mean'}).reset_index()
+    avg_scores = eval_df.groupby(['concept', 'dimension', 'text_key'], observed=True).agg({'score': 'mean'}).reset_index()
     return avg_scores
 
 
 def calculate_average_concept_score(eval_df:pd.DataFrame) -> pd.DataFrame:
     """Calculates the average concept score for each model."""
-    avg_scores = eval_df.groupby(['concept', 'text_key']).agg({'score': 'mean'}).reset_index()
+    avg_scores = eval_df.groupby(['concept', 'text_key'], observed=True).agg({'score': 'mean'}).reset_index()
     return avg_scores
 
 
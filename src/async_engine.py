@@ -0,0 +1,207 @@
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Deque, Iterator, Optional
+from openai import AsyncOpenAI
+
+from config.config import MAX_CONCURRENCY
+from src.concepts import QuestionEval, DimensionEval, ConceptEval, ModelEval, TextEval, Concept, Dimension, Question
+from src.evaluation import (
+    build_messages,
+    question_request_params,
+    arequest_payload,
+    score_payload,
+    build_dimension_eval,
+    build_concept_eval,
+    build_model_eval,
+    build_text_eval
+)
+from src.batched_eval import evaluate_dimension_batched_async
+from src.http_client import get_async_client, close_async_client
+
+TEXT_WINDOW_FACTOR = 2  # texts started ahead, as a multiple of the texts needed to fill MAX_CONCURRENCY
+
+
+async def evaluate_question_async(
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        model: str,
+        concept: Concept,
+        dimension: Dimension,
+        question_obj: Question,
+        input_text: str
+        ) -> QuestionEval:
+    """Evaluates a single question. The semaphore bounds the number of requests in flight."""
+    messages = build_messages(concept, dimension, question_obj, input_text)
+
+    queued_at = time.perf_counter()  # time spent waiting for the semaphore counts as queue wait
+    async with semaphore:
+        payload = await arequest_payload(client, question_request_params(model, messages), queued_at)
+
+    return score_payload(question_obj, payload, model)
+
+
+async def evaluate_dimension_async(
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        model: str,
+        concept: Concept,
+        dimension: Dimension,
+        input_text: str,
+        batched: bool = False
+        ) -> DimensionEval:
+
+    if batched:
+        queued_at = time.perf_counter()
+        async with semaphore:
+            return await evaluate_dimension_batched_async(client, model, concept, dimension, input_text, queued_at)
+
+    question_scores = await asyncio.gather(*[
+        evaluate_question_async(client, semaphore, model, concept, dimension, question, input_text)
+        for question in dimension["questions"]
+    ])
+
+    return build_dimension_eval(dimension, list(question_scores))
+
+
+async def evaluate_concept_async(
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        model: str,
+        concept: Concept,
+        input_text: str,
+        batched: bool = False
+        ) -> ConceptEval:
+
+    dimension_scores = await asyncio.gather(*[
+        evaluate_dimension_async(client, semaphore, model, concept, dimension, input_text, batched)
+        for dimension in concept["dimensions"]
+    ])
+
+    return build_concept_eval(concept, list(dimension_scores))
+
+
+async def model_eval_async(
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        model: str,
+        concepts: list[Concept],
+        input_text: str,
+        batched: bool = False
+        ) -> ModelEval:
+
+    concept_scores = await asyncio.gather(*[
+        evaluate_concept_async(client, semaphore, model, concept, input_text, batched)
+        for concept in concepts
+    ])
+
+    return build_model_eval(model, list(concept_scores))
+
+
+async def text_eval_async(
+        client: AsyncOpenAI,
+        semaphore: asyncio.Semaphore,
+        models: list[str],
+        text: str,
+        label: str,
+        concepts: list[Concept],
+        batched: bool = False
+        ) -> TextEval:
+
+    results = await asyncio.gather(
+        *[model_eval_async(client, semaphore, model, concepts, text, batched) for model in models],
+        return_exceptions=True
+    )
+
+    evaluations = {}
+    for model, result in zip(models, results):
+        if isinstance(result, Exception):
+            print(f"Error evaluating model {model} on {label}: {result}")
+            evaluations[model] = None  # Handle errors gracefully, same as text_eval
+        else:
+            evaluations[model] = result
+
+    return build_text_eval(models, text, label, concepts, evaluations)
+
+
+async def stream_async(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        max_concurrency: Optional[int] = None,
+        batched: bool = False
+        ) -> AsyncIterator[TextEval]:
+    """Evaluates texts concurrently, yielding each TextEval as soon as it and every text before it are done.
+
+    Texts are yielded in the order of `texts`. Only a window of texts is started ahead of the
+    first unfinished one, enough to keep `max_concurrency` requests in flight, so memory does not
+    grow with the corpus. With batched=True every dimension is asked in a single request.
+    """
+    client = get_async_client()
+    max_concurrency = max_concurrency or MAX_CONCURRENCY
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    requests_per_text = len(models) * sum(
+        1 if batched else len(dimension["questions"]) for concept in concepts for dimension in concept["dimensions"]
+    )
+    window = TEXT_WINDOW_FACTOR * max(1, -(-max_concurrency // max(requests_per_text, 1)))
+
+    labels = iter(texts)
+    pending: Deque[asyncio.Task] = deque()  # started texts in order, not yet yielded
+
+    def start_texts() -> None:
+        while len(pending) < window:
+            label = next(labels, None)
+            if label is None:
+                return
+            pending.append(asyncio.create_task(
+                text_eval_async(client, semaphore, models, texts[label], label, concepts, batched)
+            ))
+
+    try:
+        start_texts()
+        while pending:
+            result = await pending[0]  # later texts keep running meanwhile
+            pending.popleft()
+            start_texts()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        await close_async_client()
+
+
+def iter_async(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        max_concurrency: Optional[int] = None,
+        batched: bool = False
+        ) -> Iterator[TextEval]:
+    """Runs stream_async on its own event loop and yields its TextEvals to synchronous code, like iter_scheduled."""
+    loop = asyncio.new_event_loop()
+    results = stream_async(texts, models, concepts, max_concurrency, batched)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+
+async def run_async(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        max_concurrency: Optional[int] = None,
+        batched: bool = False
+        ) -> list[TextEval]:
+    """Evaluates every text and returns all TextEvals in the order of `texts`.
+
+    The results have the same structure as main.text_eval. Use stream_async (or iter_async) to
+    handle every text as soon as it is done instead.
+    """
+    return [text_eval async for text_eval in stream_async(texts, models, concepts, max_concurrency, batched)]
@@ -0,0 +1,213 @@
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from openai import OpenAI
+
+from config.config import BATCH_COMPLETION_WINDOW, BATCH_POLL_INTERVAL
+from src.concepts import TextEval, Concept
+from src.checkpoint import text_hash, work_item_id
+from src.evaluation import get_response_cache
+from src.response_cache import ResponseCache
+from src.http_client import get_client
+from src.scheduler import WorkItem, flatten_run, work_item_params, score_work_item, store_result, assemble_text_eval
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def custom_ids(items: List[WorkItem], texts: dict, concepts: list[Concept]) -> List[str]:
+    """Ids of work items, used to match batch output lines back to their request.
+
+    They are the stable work item ids of src.checkpoint (text hash, model, concept, question or
+    dimension), so they still match when texts are skipped on resume or the lists are reordered.
+    """
+    digests = {label: text_hash(text) for label, text in texts.items()}
+    return [work_item_id(item, digests, concepts) for item in items]
+
+
+def params_path(input_path: Path) -> Path:
+    """Sidecar of a batch input file with the hashed request parameters of every custom_id."""
+    return input_path.with_suffix(".params.json")
+
+
+def write_batch_file(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        path: Path,
+        batched: bool = False
+        ) -> Dict[str, str]:
+    """Writes one batch request line per work item, plus the params sidecar.
+
+    Identical requests (the same text under two labels) share one line. Returns the hashed
+    request parameters by custom_id, in file order.
+    """
+    items = flatten_run(texts, models, concepts, batched)
+    params_keys = {}
+
+    with open(path, "w", encoding="utf-8") as f:
+        for item, item_id in zip(items, custom_ids(items, texts, concepts)):
+            if item_id in params_keys:
+                continue
+            params = work_item_params(item, texts, concepts)
+            params_keys[item_id] = ResponseCache.make_key(params)
+            line = {
+                "custom_id": item_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": params
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    write_batch_params(path, params_keys)
+    print(f"Wrote {len(params_keys)} batch requests to {path}")
+    return params_keys
+
+
+def write_batch_params(input_path: Path, params_keys: Dict[str, str], batch_id: Optional[str] = None) -> None:
+    """Writes the params sidecar of a batch input file; batch_id is filled in once the batch is submitted."""
+    with open(params_path(input_path), "w", encoding="utf-8") as f:
+        json.dump({"batch_id": batch_id, "params": params_keys}, f)
+
+
+def read_batch_params(input_path: Path, batch_id: str) -> Dict[str, str]:
+    """Hashed request parameters by custom_id, as recorded when `batch_id` was submitted."""
+    path = params_path(input_path)
+    if not path.exists():
+        raise RuntimeError(f"No request parameters recorded for batch {batch_id} ({path} is missing)")
+    with open(path, "r", encoding="utf-8") as f:
+        recorded = json.load(f)
+    if recorded["batch_id"] != batch_id:
+        raise RuntimeError(f"{path} belongs to batch {recorded['batch_id']}, not to {batch_id}")
+    return recorded["params"]
+
+
+def submit_batch(client: OpenAI, path: Path) -> str:
+    """Uploads a batch input file and starts the batch. Returns the batch id."""
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW
+    )
+    print(f"Submitted batch {batch.id} ({path})")
+    return batch.id
+
+
+def wait_for_batch(client: OpenAI, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL):
+    """Polls a batch until it reaches a final status and returns it."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        print(f"Batch {batch_id}: {batch.status}{progress}")
+
+        if batch.status in FINAL_BATCH_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def payload_from_body(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts a chat completion body from the batch output into a response payload."""
+    return {
+        "content": body["choices"][0]["logprobs"]["content"],
+        "usage": body.get("usage")
+    }
+
+
+def read_batch_output(client: OpenAI, batch) -> Dict[str, Any]:
+    """Downloads the output and error files of a batch and maps custom_id to response body or error."""
+    outputs = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                outputs[record["custom_id"]] = RuntimeError(record.get("error") or response.get("body"))
+            else:
+                outputs[record["custom_id"]] = response["body"]
+    return outputs
+
+
+def ingest_batch_output(
+        outputs: Dict[str, Any],
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        params_keys: Dict[str, str],
+        batched: bool = False
+        ) -> list[TextEval]:
+    """Rebuilds the TextEvals of a run from batch output.
+
+    `params_keys` holds the hashed request parameters of every custom_id at submission (see
+    read_batch_params). An output whose work item now renders different parameters (another
+    prompt layout, scoring mode or prompt template) fails that item instead of being scored.
+    Successful responses are also stored in the response cache, so a later interactive run
+    over the same texts does not pay for them again.
+    """
+    cache = get_response_cache()
+    results_by_text = {label: {} for label in texts}
+
+    items = flatten_run(texts, models, concepts, batched)
+    for item, item_id in zip(items, custom_ids(items, texts, concepts)):
+        output = outputs.get(item_id, RuntimeError("missing from batch output"))
+        params = work_item_params(item, texts, concepts)
+        if not isinstance(output, Exception) and params_keys.get(item_id) != ResponseCache.make_key(params):
+            output = RuntimeError("request parameters changed since the batch was submitted")
+        if isinstance(output, Exception):
+            store_result(results_by_text[item["text_label"]], item, output)
+            continue
+
+        payload = payload_from_body(output)
+        if cache:
+            cache.put(params, payload)
+        try:
+            # Batch pricing applies; the timing of single requests is unknown
+            result = score_work_item(item, concepts, {**payload, "latency": None, "queue_wait": None, "batch": True})
+        except Exception as e:
+            result = e
+        store_result(results_by_text[item["text_label"]], item, result)
+
+    return [
+        assemble_text_eval(label, text, models, concepts, results_by_text[label])
+        for label, text in texts.items()
+    ]
+
+
+def run_batch(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        batch_dir: str,
+        batched: bool = False,
+        batch_id: Optional[str] = None
+        ) -> list[TextEval]:
+    """Runs a whole evaluation through the Batch API: write, submit, poll and ingest.
+
+    Pass the batch_id of an earlier submission to skip straight to polling and ingestion; its
+    params sidecar (batch_input.params.json) has to be in batch_dir.
+    """
+    client = get_client().with_options(max_retries=2)  # file and batch calls are not paced by src.rate_limit
+    input_path = Path(batch_dir) / "batch_input.jsonl"
+
+    if batch_id is None:
+        params_keys = write_batch_file(texts, models, concepts, input_path, batched)
+        batch_id = submit_batch(client, input_path)
+        write_batch_params(input_path, params_keys, batch_id)
+    else:
+        params_keys = read_batch_params(input_path, batch_id)
+
+    batch = wait_for_batch(client, batch_id)
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status {batch.status}")
+
+    outputs = read_batch_output(client, batch)
+    print(f"Ingesting {len(outputs)} batch responses")
+    return ingest_batch_output(outputs, texts, models, concepts, params_keys, batched)
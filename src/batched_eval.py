@@ -0,0 +1,134 @@
+import re
+import json
+from typing import Any, Dict, List, Optional
+from openai import OpenAI, AsyncOpenAI
+
+from src.concepts import DimensionEval, Concept, Dimension
+from src.evaluation import (
+    request_params,
+    request_payload,
+    arequest_payload,
+    score_question,
+    compact_logprobs,
+    usage_from_payload,
+    get_prompt_layout,
+    build_dimension_eval
+)
+
+from prompts.eval_prompt import sys_eval_prompt, batched_eval_prompts, batched_question_prompt
+
+
+def build_batched_messages(concept: Concept, dimension: Dimension, input_text: str) -> List[Dict[str, str]]:
+    """Renders one prompt that asks every question of a dimension at once."""
+    questions = "\n".join(
+        batched_question_prompt.format(label=q["label"], question=q["question"], examples=q["examples"])
+        for q in dimension["questions"]
+    )
+
+    system_prompt = sys_eval_prompt.format(concept=concept)
+    base_prompt = batched_eval_prompts[get_prompt_layout()].format(concept=concept, dimension=dimension, questions=questions, input_text=input_text)
+
+    return [
+        {"role": "developer", "content": system_prompt},
+        {"role": "user", "content": base_prompt}
+    ]
+
+
+def batched_response_format(dimension: Dimension) -> Dict[str, Any]:
+    """Structured output schema with one boolean slot per question label."""
+    labels = [q["label"] for q in dimension["questions"]]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "dimension_answers",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {label: {"type": "boolean"} for label in labels},
+                "required": labels,
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def slot_logprobs(payload: Dict[str, Any], labels: List[str]) -> Dict[str, List[Dict[str, float]]]:
+    """Finds the token holding the value of each label and returns its top logprobs.
+
+    The answer text is rebuilt from the returned tokens so every JSON value can be mapped back
+    to the token it starts in. Punctuation glued to that token (e.g. ':true') is stripped, so
+    the alternatives read as plain 'true'/'false' for score_question. Labels that cannot be
+    found get an empty list, which scores as None.
+    """
+    tokens = payload["content"]
+    text = "".join(t["token"] for t in tokens)
+
+    # Character offset at which each token starts
+    offsets = []
+    position = 0
+    for t in tokens:
+        offsets.append(position)
+        position += len(t["token"])
+
+    slots = {}
+    for label in labels:
+        match = re.search(re.escape(json.dumps(label)) + r"\s*:\s*", text)
+        if match is None:
+            slots[label] = []
+            continue
+
+        value_start = match.end()
+        index = max(i for i, offset in enumerate(offsets) if offset <= value_start)
+
+        slots[label] = [
+            {"token": re.sub(r"[^A-Za-z]", "", logprob["token"]), "logprob": logprob["logprob"]}
+            for logprob in tokens[index]["top_logprobs"]
+        ]
+
+    return slots
+
+
+def batched_request_params(model: str, concept: Concept, dimension: Dimension, input_text: str) -> Dict[str, Any]:
+    """Request parameters for asking every question of a dimension at once."""
+    messages = build_batched_messages(concept, dimension, input_text)
+    return request_params(model, messages, response_format=batched_response_format(dimension))
+
+
+def score_dimension_payload(dimension: Dimension, payload: Dict[str, Any], model: str) -> DimensionEval:
+    """Scores every question of a dimension from a batched response payload.
+
+    The usage of the single request is split evenly over the questions it answered.
+    """
+    slots = slot_logprobs(payload, [q["label"] for q in dimension["questions"]])
+    usage = usage_from_payload(payload, model, share=len(dimension["questions"]))
+    question_scores = [
+        {**score_question(q, slots[q["label"]]), "top_logprobs": compact_logprobs(slots[q["label"]]), "usage": usage}
+        for q in dimension["questions"]
+    ]
+    return build_dimension_eval(dimension, question_scores)
+
+
+def evaluate_dimension_batched(
+        client: OpenAI,
+        model: str,
+        concept: Concept,
+        dimension: Dimension,
+        input_text: str,
+        queued_at: Optional[float] = None
+        ) -> DimensionEval:
+    """Evaluates all questions of a dimension with a single structured-output request."""
+    params = batched_request_params(model, concept, dimension, input_text)
+    return score_dimension_payload(dimension, request_payload(client, params, queued_at), model)
+
+
+async def evaluate_dimension_batched_async(
+        client: AsyncOpenAI,
+        model: str,
+        concept: Concept,
+        dimension: Dimension,
+        input_text: str,
+        queued_at: Optional[float] = None
+        ) -> DimensionEval:
+    """Async counterpart of evaluate_dimension_batched."""
+    params = batched_request_params(model, concept, dimension, input_text)
+    return score_dimension_payload(dimension, await arequest_payload(client, params, queued_at), model)
@@ -0,0 +1,198 @@
+import io
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import main
+from src.concepts import Concept
+from src.evaluation import set_response_cache
+from src.http_client import connection_stats
+from src.mock_openai import MockBehaviour, MockServer, start_in_background
+
+QUESTIONS_PER_DIMENSION = 4
+TEXT_LENGTH = 2000  # characters per synthetic text
+BASELINE_PATH = "benchmarks/baseline.json"
+REGRESSION_THRESHOLD = 0.9  # calls/sec below this fraction of the baseline is reported as a regression
+
+
+def synthetic_concepts(n_questions: int) -> List[Concept]:
+    """One concept with n_questions questions, QUESTIONS_PER_DIMENSION per dimension."""
+    dimensions = []
+    for start in range(0, n_questions, QUESTIONS_PER_DIMENSION):
+        d = len(dimensions)
+        questions = [
+            {
+                "label": f"D{d}-Q{q}",
+                "question": f"Voldoet de tekst aan criterium {q} van dimensie {d}?",
+                "examples": "",
+                "positive_contribution": q % 2 == 0
+            }
+            for q in range(start, min(start + QUESTIONS_PER_DIMENSION, n_questions))
+        ]
+        dimensions.append({"dimension_description": f"Dimensie {d}", "questions": questions, "weight": 1.0})
+
+    return [{"concept_description": "Benchmark", "dimensions": dimensions, "weight": 1.0}]
+
+
+def synthetic_texts(n_texts: int, length: int = TEXT_LENGTH) -> Dict[str, str]:
+    """n_texts distinct texts of roughly `length` characters."""
+    return {
+        f"Tekst {i}": (f"Dit is benchmarktekst {i}. " * (length // 24 + 1))[:length]
+        for i in range(n_texts)
+    }
+
+
+def parse_size(size: str) -> Dict[str, int]:
+    """Parses a corpus size written as TEXTSxMODELSxQUESTIONS, e.g. 10x2x8."""
+    texts, models, questions = (int(part) for part in size.lower().split("x"))
+    return {"texts": texts, "models": models, "questions": questions}
+
+
+def case_id(case: Dict[str, Any]) -> str:
+    batched = "-batched" if case["batched"] else ""
+    return f"{case['engine']}{batched}-{case['texts']}x{case['models']}x{case['questions']}-c{case['concurrency']}"
+
+
+def run_case(
+        server: MockServer,
+        engine: str,
+        size: Dict[str, int],
+        concurrency: Optional[int],
+        batched: bool = False,
+        trace_memory: bool = False
+        ) -> Dict[str, Any]:
+    """Runs main.main once over a synthetic corpus against the mock server and measures it."""
+    texts = synthetic_texts(size["texts"])
+    models = [f"bench-model-{m}" for m in range(size["models"])]
+    concepts = synthetic_concepts(size["questions"])
+
+    server.state.reset_counters()
+    connections_before = connection_stats()["connections"]
+    if trace_memory:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as output_dir, redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        main.main(texts, models, concepts, output_dir + "/", engine=engine, batched=batched, concurrency=concurrency)
+        wall_time = time.perf_counter() - start
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    counters = dict(server.state.counters)
+    connections = connection_stats()["connections"] - connections_before
+    return {
+        "engine": engine,
+        "batched": batched,
+        **size,
+        "concurrency": concurrency if engine in ("queue", "async") else size["models"],
+        "calls": counters["ok"],
+        "failed_calls": counters["errors"] + counters["rate_limited"],
+        "wall_time": wall_time,
+        "calls_per_sec": counters["ok"] / wall_time if wall_time else None,
+        "connections": connections,
+        "peak_memory_mb": peak_memory
+    }
+
+
+def compare_to_baseline(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Matches results to baseline cases and computes the calls/sec ratio (new / baseline)."""
+    baseline_by_id = {case_id(case): case for case in baseline}
+    comparison = []
+    for result in results:
+        reference = baseline_by_id.get(case_id(result))
+        if reference is None or not reference["calls_per_sec"]:
+            continue
+        ratio = result["calls_per_sec"] / reference["calls_per_sec"]
+        comparison.append({
+            "case": case_id(result),
+            "baseline_calls_per_sec": reference["calls_per_sec"],
+            "calls_per_sec": result["calls_per_sec"],
+            "ratio": ratio,
+            "regression": ratio < REGRESSION_THRESHOLD
+        })
+    return comparison
+
+
+def run_benchmark(
+        sizes: List[str],
+        engines: List[str],
+        concurrencies: List[int],
+        behaviour: MockBehaviour,
+        batched: bool = False,
+        trace_memory: bool = False
+        ) -> List[Dict[str, Any]]:
+    """Runs every engine x size x concurrency case against one mock server and prints a line per case."""
+    server = start_in_background(behaviour=behaviour)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    set_response_cache(None)  # measure the API path, not the response cache
+
+    results = []
+    try:
+        for size in sizes:
+            for engine in engines:
+                # The threads engine always uses one thread per model
+                for concurrency in (concurrencies if engine in ("queue", "async") else [None]):
+                    result = run_case(server, engine, parse_size(size), concurrency, batched, trace_memory)
+                    results.append(result)
+                    memory = f", peak {result['peak_memory_mb']:.1f} MB" if trace_memory else ""
+                    print(f"{case_id(result)}: {result['calls']} calls in {result['wall_time']:.2f}s "
+                          f"({result['calls_per_sec']:.1f} calls/s, {result['connections']} connections, "
+                          f"{result['failed_calls']} failed attempts{memory})")
+    finally:
+        server.shutdown()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmark of the evaluation pipeline against the local mock server.")
+    parser.add_argument("--sizes", default="4x2x8,20x3x16", help="comma-separated corpus sizes as TEXTSxMODELSxQUESTIONS")
+    parser.add_argument("--engines", default="queue,async,threads", help="comma-separated engines to run")
+    parser.add_argument("--concurrency", default="5,20", help="comma-separated worker/concurrency settings (queue and async)")
+    parser.add_argument("--batched", action="store_true", help="ask all questions of a dimension in one request")
+    parser.add_argument("--latency", type=float, default=0.05, help="median mock latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="log-normal spread of the mock latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock calls failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of mock calls rejected with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true", help="trace peak Python memory (slows the run down)")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour(args.latency, args.latency_sigma, args.error_rate, args.rate_limit_rate, seed=args.seed)
+    results = run_benchmark(
+        args.sizes.split(","),
+        args.engines.split(","),
+        [int(c) for c in args.concurrency.split(",")],
+        behaviour,
+        batched=args.batched,
+        trace_memory=args.memory
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.save_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            comparison = compare_to_baseline(results, json.load(f))
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['case']}: {row['ratio']:.2f}x baseline ({row['baseline_calls_per_sec']:.1f} -> {row['calls_per_sec']:.1f} calls/s){flag}")
@@ -0,0 +1,173 @@
+import os
+import json
+import uuid
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.concepts import QuestionEval, Concept
+from src.evaluation import get_prompt_layout, get_scoring_mode
+from src.result_writer import iter_records
+
+from prompts.eval_prompt import sys_eval_prompt, eval_prompts, batched_eval_prompts, batched_question_prompt
+
+
+def text_hash(text: str) -> str:
+    """Short content hash of an input text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def question_id(text_digest: str, model: str, concept_description: str, question_label: str) -> str:
+    """Stable id of one question evaluation, independent of the order of texts, models or questions."""
+    key = "\x1f".join([text_digest, model, concept_description, question_label])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+
+
+def item_question_ids(item: Dict[str, Any], text_digests: Dict[str, str], concepts: List[Concept]) -> List[str]:
+    """Ids of the questions a work item covers: one, or all questions of the dimension for a batched item."""
+    concept = concepts[item["concept_index"]]
+    questions = concept["dimensions"][item["dimension_index"]]["questions"]
+    if item["question_index"] is not None:
+        questions = [questions[item["question_index"]]]
+
+    return [
+        question_id(text_digests[item["text_label"]], item["model"], concept["concept_description"], q["label"])
+        for q in questions
+    ]
+
+
+def work_item_id(item: Dict[str, Any], text_digests: Dict[str, str], concepts: List[Concept]) -> str:
+    """Stable id of a work item: the id of its question, or of its whole dimension for a batched item."""
+    concept = concepts[item["concept_index"]]
+    dimension = concept["dimensions"][item["dimension_index"]]
+    if item["question_index"] is None:
+        key = "dimension:" + dimension["dimension_description"]
+    else:
+        key = dimension["questions"][item["question_index"]]["label"]
+    return question_id(text_digests[item["text_label"]], item["model"], concept["concept_description"], key)
+
+
+def concepts_hash(concepts: List[Concept]) -> str:
+    """Short content hash of a concept tree: questions, examples, weights and contributions."""
+    return text_hash(json.dumps(concepts, sort_keys=True, ensure_ascii=False))
+
+
+def run_settings(models: List[str], concepts: List[Concept], batched: bool = False) -> Dict[str, Any]:
+    """Settings that change what the scores of a run mean.
+
+    The models, a hash of the concepts, the question mode, scoring mode, prompt layout and a hash of the prompts.
+    """
+    layout = get_prompt_layout()
+    templates = [sys_eval_prompt, batched_eval_prompts[layout], batched_question_prompt] if batched \
+        else [sys_eval_prompt, eval_prompts[layout]]
+    return {
+        "models": list(models),
+        "concepts": concepts_hash(concepts),
+        "batched": batched,
+        "scoring_mode": get_scoring_mode(),
+        "prompt_layout": layout,
+        "prompts": text_hash("\x1f".join(template.template for template in templates))
+    }
+
+
+def setup_hash(settings: Dict[str, Any]) -> str:
+    """Short hash of run settings without the model list: runs with equal hashes score a model the same way."""
+    return text_hash(json.dumps({key: value for key, value in settings.items() if key != "models"}, sort_keys=True))[:8]
+
+
+def check_manifest(path: str, models: List[str], concepts: List[Concept], batched: bool = False) -> Optional[Dict[str, Any]]:
+    """Raises a ValueError if the run of an existing manifest used other settings than the current ones.
+
+    Resuming such a run would mix scores of two methods in one results file. Returns the existing
+    manifest, or None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    recorded = manifest.get("settings", {})
+
+    current = run_settings(models, concepts, batched)
+    changed = [f"{key}: {recorded.get(key)!r} -> {value!r}" for key, value in current.items() if recorded.get(key) != value]
+    if changed:
+        raise ValueError(f"Cannot resume the run of {path} with other settings ({', '.join(changed)})")
+    return manifest
+
+
+def write_manifest(
+        path: str,
+        texts: dict,
+        models: list[str],
+        concepts: List[Concept],
+        batched: bool = False,
+        run_key: Optional[str] = None
+        ) -> Dict[str, Any]:
+    """Writes the manifest of a run: its settings, texts, models and the stable id of every question evaluation.
+
+    `run_key` identifies the logical run across resumes (pass the key of the manifest being
+    resumed); a new run gets a new key.
+    """
+    digests = {label: text_hash(text) for label, text in texts.items()}
+    work_items = []
+    for label in texts:
+        for model in models:
+            for concept in concepts:
+                for dimension in concept["dimensions"]:
+                    for q in dimension["questions"]:
+                        work_items.append({
+                            "id": question_id(digests[label], model, concept["concept_description"], q["label"]),
+                            "text_label": label,
+                            "model": model,
+                            "concept": concept["concept_description"],
+                            "dimension": dimension["dimension_description"],
+                            "question_label": q["label"]
+                        })
+
+    manifest = {
+        "run_key": run_key or uuid.uuid4().hex,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "models": models,
+        "batched": batched,
+        "settings": run_settings(models, concepts, batched),
+        "texts": digests,
+        "work_items": work_items
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    return manifest
+
+
+def load_progress(
+        jsonl_path: str,
+        texts: dict,
+        models: Optional[List[str]] = None,
+        concepts: Optional[List[Concept]] = None
+        ) -> Tuple[Set[str], Dict[str, QuestionEval]]:
+    """Reads what an earlier run already finished from its results JSONL file.
+
+    Returns the labels of texts with a complete text record (for the same input text) and the
+    results of finished questions by question id. With `models` and `concepts` a text record only
+    counts if it holds an evaluation of every model for the same concepts; the finished questions
+    of other texts are still reused. A missing file means nothing is done yet.
+    """
+    completed_texts: Set[str] = set()
+    completed_questions: Dict[str, QuestionEval] = {}
+    if not os.path.exists(jsonl_path):
+        return completed_texts, completed_questions
+
+    digests = {label: text_hash(text) for label, text in texts.items()}
+    concepts_digest = concepts_hash(concepts) if concepts is not None else None
+    for record in iter_records(jsonl_path):
+        if record["type"] == "question" and "item_id" in record:
+            completed_questions[record["item_id"]] = record["result"]
+        elif record["type"] != "text" or digests.get(record["label"]) != text_hash(record["input_text"]):
+            continue
+        elif models is not None and not all(record["evaluations"].get(model) for model in models):
+            continue
+        elif concepts_digest is not None and concepts_hash(record["concepts"]) != concepts_digest:
+            continue
+        else:
+            completed_texts.add(record["label"])
+
+    return completed_texts, completed_questions
@@ -0,0 +1,420 @@
+import sys
+import json
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config.config import DEFAULT_WEIGHT, PARQUET_COMPRESSION, PARQUET_TEXTS_PER_ROW_GROUP
+from src.concepts import Concept, TextEval
+from src.evaluation import sum_usage
+from src.aggregation import iter_aggregated
+from src.result_writer import iter_latest_text_evals, _to_builtin
+
+USAGE_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "queue_wait", "cost")
+
+# One row per question evaluation. Repeating strings are dictionary-encoded, so they are stored
+# once per row group and read back as pandas categoricals.
+categorical = pa.dictionary(pa.int32(), pa.string())
+QUESTION_SCHEMA = pa.schema([
+    ("label", categorical),
+    ("model", categorical),
+    ("concept", categorical),
+    ("dimension", categorical),
+    ("question_label", categorical),
+    ("question", categorical),
+    ("concept_index", pa.int16()),
+    ("dimension_index", pa.int16()),
+    ("question_index", pa.int16()),
+    ("answer", categorical),
+    ("score", pa.float64()),
+    ("logprob", pa.float64()),
+    ("positive_contribution", pa.bool_()),
+    ("dimension_score", pa.float64()),
+    ("concept_score", pa.float64()),
+    ("model_score", pa.float64()),
+    ("text_score", pa.float64()),
+    *[(f"usage_{field}", pa.float64()) for field in USAGE_FIELDS],
+    ("usage_from_cache", pa.bool_()),
+    ("top_tokens", pa.list_(pa.string())),
+    ("top_logprobs", pa.list_(pa.float64())),
+])
+
+# One row per text: the input text is stored once instead of in every question row
+TEXT_SCHEMA = pa.schema([
+    ("label", pa.string()),
+    ("input_text", pa.string()),
+    ("models", pa.list_(pa.string())),  # every model of the text, including ones that failed
+    ("aggregated_score", pa.float64()),
+    ("timestamp", categorical),
+    ("metadata", categorical),  # JSON, identical for most texts of a run
+])
+
+# One row per question of the concept tree that the run used
+CONCEPT_SCHEMA = pa.schema([
+    ("concept_index", pa.int16()),
+    ("concept", pa.string()),
+    ("concept_weight", pa.float64()),
+    ("dimension_index", pa.int16()),
+    ("dimension", pa.string()),
+    ("dimension_weight", pa.float64()),
+    ("question_index", pa.int16()),
+    ("question_label", pa.string()),
+    ("question", pa.string()),
+    ("examples", pa.string()),
+    ("positive_contribution", pa.bool_()),
+])
+
+
+# Grouping columns of each level of the aggregate tables, below the text
+AGGREGATE_LEVELS = {
+    "text": [],
+    "concept": ["concept"],
+    "dimension": ["concept", "dimension"],
+    "question": ["concept", "dimension", "question"],
+}
+
+
+def table_paths(path: str) -> Dict[str, str]:
+    """The files of a columnar result: questions at `path`, texts, concepts and aggregates next to it."""
+    base = path[:-len(".parquet")] if path.endswith(".parquet") else path
+    return {
+        "questions": f"{base}.parquet",
+        "texts": f"{base}.texts.parquet",
+        "concepts": f"{base}.concepts.parquet",
+        "aggregates": f"{base}.aggregates.parquet"
+    }
+
+
+def _float(value) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def question_columns(text_evals: Iterable[TextEval]) -> Dict[str, list]:
+    """Flattens TextEvals into one column list per QUESTION_SCHEMA field."""
+    columns = {name: [] for name in QUESTION_SCHEMA.names}
+    for text_eval in text_evals:
+        text_score = _float(text_eval.get("aggregated_score"))
+        for model, model_eval in text_eval["evaluations"].items():
+            if model_eval is None:
+                continue
+            model_score = _float(model_eval["overall_score"])
+            for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                concept_score = _float(concept_eval["overall_score"])
+                for d, dimension_eval in enumerate(concept_eval["dimensions"]):
+                    dimension_score = _float(dimension_eval["overall_score"])
+                    for q, question_eval in enumerate(dimension_eval["questions"]):
+                        usage = question_eval.get("usage") or {}
+                        distribution = question_eval.get("top_logprobs") or {}
+                        row = {
+                            "label": text_eval["label"],
+                            "model": model,
+                            "concept": concept_eval["concept_description"],
+                            "dimension": dimension_eval["dimension_description"],
+                            "question_label": question_eval["label"],
+                            "question": question_eval["question"],
+                            "concept_index": c,
+                            "dimension_index": d,
+                            "question_index": q,
+                            "answer": None if question_eval["answer"] is None else str(question_eval["answer"]),
+                            "score": _float(question_eval["score"]),
+                            "logprob": _float(question_eval["logprob"]),
+                            "positive_contribution": question_eval["positive_contribution"],
+                            "dimension_score": dimension_score,
+                            "concept_score": concept_score,
+                            "model_score": model_score,
+                            "text_score": text_score,
+                            **{f"usage_{field}": _float(usage.get(field)) for field in USAGE_FIELDS},
+                            "usage_from_cache": usage.get("from_cache"),
+                            "top_tokens": distribution.get("tokens"),
+                            "top_logprobs": distribution.get("logprobs"),
+                        }
+                        for name, value in row.items():
+                            columns[name].append(value)
+    return columns
+
+
+def text_columns(text_evals: Iterable[TextEval]) -> Dict[str, list]:
+    columns = {name: [] for name in TEXT_SCHEMA.names}
+    for text_eval in text_evals:
+        columns["label"].append(text_eval["label"])
+        columns["input_text"].append(text_eval["input_text"])
+        columns["models"].append(list(text_eval["evaluations"]))
+        columns["aggregated_score"].append(_float(text_eval.get("aggregated_score")))
+        columns["timestamp"].append(text_eval.get("timestamp"))
+        columns["metadata"].append(json.dumps(text_eval.get("metadata"), ensure_ascii=False, default=_to_builtin))
+    return columns
+
+
+def concept_columns(concepts: List[Concept]) -> Dict[str, list]:
+    columns = {name: [] for name in CONCEPT_SCHEMA.names}
+    for c, concept in enumerate(concepts):
+        for d, dimension in enumerate(concept["dimensions"]):
+            for q, question in enumerate(dimension["questions"]):
+                row = {
+                    "concept_index": c,
+                    "concept": concept["concept_description"],
+                    "concept_weight": concept.get("weight"),
+                    "dimension_index": d,
+                    "dimension": dimension["dimension_description"],
+                    "dimension_weight": dimension.get("weight"),
+                    "question_index": q,
+                    "question_label": question["label"],
+                    "question": question["question"],
+                    "examples": question.get("examples"),
+                    "positive_contribution": question["positive_contribution"],
+                }
+                for name, value in row.items():
+                    columns[name].append(value)
+    return columns
+
+
+def _table(columns: Dict[str, list], schema: pa.Schema) -> pa.Table:
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def aggregate_tables(questions: pd.DataFrame) -> pd.DataFrame:
+    """Mean question scores of every text at the text, concept, dimension and question level.
+
+    `questions` has text_key, model, concept, dimension, question and score columns, like a
+    combined eval DataFrame of src.analysis. Every level is aggregated per model and across
+    models (model is None); n is the number of scored questions behind each mean. The result
+    is one long table with a level column, small enough to filter instead of regrouping raw rows.
+    """
+    frames = []
+    for level, keys in AGGREGATE_LEVELS.items():
+        for models in (["model"], []):
+            group = ["text_key"] + models + keys
+            frame = questions.groupby(group, observed=True, sort=False)["score"].agg(["mean", "count"]).reset_index()
+            frame = frame.rename(columns={"mean": "score", "count": "n"}).astype({key: object for key in group})
+            frames.append(frame.assign(level=level))
+
+    columns = ["level", "text_key", "model", "concept", "dimension", "question", "score", "n"]
+    return pd.concat(frames, ignore_index=True).reindex(columns=columns)
+
+
+def write_columnar(text_evals: Iterable[TextEval], path: str) -> int:
+    """Writes TextEvals as questions, texts, concepts and aggregates Parquet files (see table_paths).
+
+    Texts are written in row groups of PARQUET_TEXTS_PER_ROW_GROUP, so the whole run never has
+    to be flattened in memory at once. All texts must share the same concepts. The aggregate
+    tables (see aggregate_tables) are computed from the written question table.
+    Returns the number of texts written.
+    """
+    paths = table_paths(path)
+    concepts = None
+    count = 0
+    chunk: List[TextEval] = []
+
+    with pq.ParquetWriter(paths["questions"], QUESTION_SCHEMA, compression=PARQUET_COMPRESSION) as questions, \
+            pq.ParquetWriter(paths["texts"], TEXT_SCHEMA, compression=PARQUET_COMPRESSION) as texts:
+
+        def flush():
+            questions.write_table(_table(question_columns(chunk), QUESTION_SCHEMA))
+            texts.write_table(_table(text_columns(chunk), TEXT_SCHEMA))
+            chunk.clear()
+
+        for text_eval in text_evals:
+            if concepts is None:
+                concepts = text_eval["concepts"]
+            elif text_eval["concepts"] != concepts:
+                raise ValueError(f"Text {text_eval['label']} uses different concepts than the rest of the run")
+            chunk.append(text_eval)
+            count += 1
+            if len(chunk) >= PARQUET_TEXTS_PER_ROW_GROUP:
+                flush()
+        if chunk:
+            flush()
+
+    pq.write_table(_table(concept_columns(concepts or []), CONCEPT_SCHEMA), paths["concepts"],
+                   compression=PARQUET_COMPRESSION)
+
+    questions = read_questions(path, columns=["label", "model", "concept", "dimension", "question", "score"])
+    aggregates = aggregate_tables(questions.rename(columns={"label": "text_key"}))
+    aggregates.to_parquet(paths["aggregates"], compression=PARQUET_COMPRESSION, index=False)
+    return count
+
+
+def jsonl_to_parquet(jsonl_path: str, path: str) -> int:
+    """Converts a results JSONL file to the columnar format, keeping the last record of every text."""
+    return write_columnar(iter_aggregated(iter_latest_text_evals(jsonl_path)), path)
+
+
+def read_questions(path: str, columns: Optional[List[str]] = None, filters: Optional[list] = None) -> pd.DataFrame:
+    """Reads the question table. Label, model, concept, dimension and question come back as categoricals.
+
+    Only the requested columns are read; filters are pyarrow row filters such as
+    [("model", "==", "gpt-4o")] and skip non-matching row groups without decoding them.
+    """
+    return pd.read_parquet(table_paths(path)["questions"], columns=columns, filters=filters)
+
+
+def read_aggregates(path: str, level: Optional[str] = None, cross_model: Optional[bool] = None) -> pd.DataFrame:
+    """Reads the aggregate tables of a columnar result, optionally one level and per model or cross-model only."""
+    filters = []
+    if level is not None:
+        filters.append(("level", "==", level))
+    aggregates = pd.read_parquet(table_paths(path)["aggregates"], filters=filters or None)
+    if cross_model is not None:
+        aggregates = aggregates[aggregates["model"].isna() == cross_model]
+    return aggregates.reset_index(drop=True)
+
+
+def read_texts(path: str) -> pd.DataFrame:
+    return pd.read_parquet(table_paths(path)["texts"])
+
+
+def read_concepts(path: str) -> List[Concept]:
+    """Rebuilds the nested concept list from the concept table."""
+    table = pd.read_parquet(table_paths(path)["concepts"])
+    concepts = []
+    for c, concept_rows in table.groupby("concept_index", sort=True):
+        dimensions = []
+        for d, rows in concept_rows.groupby("dimension_index", sort=True):
+            rows = rows.sort_values("question_index")
+            dimension = {
+                "dimension_description": rows["dimension"].iloc[0],
+                "questions": [
+                    {
+                        "label": row.question_label,
+                        "question": row.question,
+                        "examples": row.examples,
+                        "positive_contribution": bool(row.positive_contribution)
+                    }
+                    for row in rows.itertuples()
+                ],
+            }
+            if pd.notna(rows["dimension_weight"].iloc[0]):
+                dimension["weight"] = float(rows["dimension_weight"].iloc[0])
+            dimensions.append(dimension)
+        concept = {"concept_description": concept_rows["concept"].iloc[0], "dimensions": dimensions}
+        if pd.notna(concept_rows["concept_weight"].iloc[0]):
+            concept["weight"] = float(concept_rows["concept_weight"].iloc[0])
+        concepts.append(concept)
+    return concepts
+
+
+def _none(value) -> Any:
+    """A scalar DataFrame cell with NaN/NA as None."""
+    return None if pd.isna(value) else value
+
+
+def read_text_evals(path: str) -> List[TextEval]:
+    """Rebuilds the nested TextEvals of a columnar result, e.g. for code that expects the JSON format.
+
+    Usage totals of dimensions, concepts, models and texts are recomputed from the question usage.
+    """
+    concepts = read_concepts(path)
+    texts = read_texts(path)
+    questions = read_questions(path)
+    for name in ("label", "model", "concept", "dimension", "question_label", "question", "answer"):
+        questions[name] = questions[name].astype(object)
+    rows_by_text = {label: rows for label, rows in questions.groupby("label", sort=False, observed=True)}
+
+    text_evals = []
+    for text in texts.itertuples():
+        rows = rows_by_text.get(text.label)
+        rows_by_model = {} if rows is None else {model: r for model, r in rows.groupby("model", sort=False)}
+        evaluations = {}
+        for model in text.models:
+            model_rows = rows_by_model.get(model)
+            evaluations[model] = None if model_rows is None else _model_eval(model, model_rows, concepts)
+
+        text_eval = {
+            "label": text.label,
+            "input_text": text.input_text,
+            "concepts": concepts,
+            "evaluations": evaluations,
+            "aggregated_score": _none(text.aggregated_score),
+        }
+        if any(m and "usage" in m for m in evaluations.values()):
+            text_eval["usage"] = sum_usage([m.get("usage") for m in evaluations.values() if m])
+        text_eval["metadata"] = json.loads(text.metadata)
+        text_eval["timestamp"] = _none(text.timestamp)
+        text_evals.append(text_eval)
+    return text_evals
+
+
+def _model_eval(model: str, rows: pd.DataFrame, concepts: List[Concept]) -> Dict[str, Any]:
+    has_usage = rows["usage_requests"].notna().any()
+    rows = rows.sort_values(["concept_index", "dimension_index", "question_index"])
+    records = rows.to_dict("records")
+    rows_by_dimension = defaultdict(list)
+    for record in records:
+        rows_by_dimension[record["concept_index"], record["dimension_index"]].append(record)
+
+    concept_scores = []
+    for c, concept in enumerate(concepts):
+        dimension_scores = []
+        concept_score = None
+        for d, dimension in enumerate(concept["dimensions"]):
+            question_rows = rows_by_dimension[c, d]
+            question_evals = [_question_eval(model, r) for r in question_rows]
+            if question_rows:
+                concept_score = _none(question_rows[0]["concept_score"])
+            dimension_eval = {
+                "dimension_description": dimension["dimension_description"],
+                "questions": question_evals,
+                "overall_score": _none(question_rows[0]["dimension_score"]) if question_rows else None,
+                "weight": dimension.get("weight", DEFAULT_WEIGHT),
+            }
+            if has_usage:
+                dimension_eval["usage"] = sum_usage([q.get("usage") for q in question_evals])
+            dimension_scores.append(dimension_eval)
+
+        concept_eval = {
+            "concept_description": concept["concept_description"],
+            "dimensions": dimension_scores,
+            "overall_score": concept_score,
+            "weight": concept.get("weight", DEFAULT_WEIGHT),
+        }
+        if has_usage:
+            concept_eval["usage"] = sum_usage([d.get("usage") for d in dimension_scores])
+        concept_scores.append(concept_eval)
+
+    model_eval = {
+        "model_name": model,
+        "concepts_scores": concept_scores,
+        "overall_score": _none(records[0]["model_score"]),
+        "weight": DEFAULT_WEIGHT,
+    }
+    if has_usage:
+        model_eval["usage"] = sum_usage([c.get("usage") for c in concept_scores])
+    return model_eval
+
+
+def _question_eval(model: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    usage = None
+    if not pd.isna(row["usage_requests"]):
+        usage = {"model": model, **{field: _none(row[f"usage_{field}"]) for field in USAGE_FIELDS},
+                 "from_cache": bool(row["usage_from_cache"])}
+    top_logprobs = None
+    if row["top_tokens"] is not None:
+        top_logprobs = {"tokens": list(row["top_tokens"]), "logprobs": list(row["top_logprobs"])}
+    return {
+        "label": row["question_label"],
+        "question": row["question"],
+        "answer": _none(row["answer"]),
+        "score": _none(row["score"]),
+        "logprob": _none(row["logprob"]),
+        "positive_contribution": bool(row["positive_contribution"]),
+        "top_logprobs": top_logprobs,
+        "usage": usage
+    }
+
+
+if __name__ == "__main__":
+    # Convert an existing run: python -m src.columnar model_eval_data.jsonl|json [model_eval_data.parquet]
+    input_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else input_path.rsplit(".", 1)[0] + ".parquet"
+
+    start = time.perf_counter()
+    if input_path.endswith(".jsonl"):
+        count = jsonl_to_parquet(input_path, output_path)
+    else:
+        with open(input_path, "r") as f:
+            count = write_columnar(json.load(f), output_path)
+    print(f"Wrote {count} texts to {table_paths(output_path)['questions']} in {time.perf_counter() - start:.1f}s")
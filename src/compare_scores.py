@@ -1,61 +1,168 @@
+import hashlib
+import io
 import json
+import threading
+import weakref
+from collections import OrderedDict
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 
+from config.config import RADAR_FIGURE_CACHE
+from src.columnar import read_questions
+from src.flatten import flatten_text_evals
+from src.results_store import ResultsStore, QUESTION_FROM, where_clause
+from src.streaming import iter_result_file
+
+SCORE_LEVELS = ('model', 'concept', 'dimension', 'question')
+SCORE_FLAT_COLUMNS = ['label', 'model', 'concept', 'dimension', 'question_label', 'score']
+
 def load_json(path):
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 def extract_all_model_scores(data):
-    flat_data = []
-
-    for item in data:
-        label = item['label']
-        for model_key, model_data in item['evaluations'].items():
-            model = model_data['model_name']
-            flat_data.append({
-                'label': label,
-                'model': model,
-                'concept': 'TEXT',
-                'dimension': '',
-                'question': '',
-                'score': model_data.get('overall_score')
-            })
-
-            for concept in model_data['concepts_scores']:
-                concept_desc = concept['concept_description']
-                flat_data.append({
-                    'label': label,
-                    'model': model,
-                    'concept': concept_desc,
-                    'dimension': '',
-                    'question': '',
-                    'score': concept.get('overall_score')
-                })
-
-                for dimension in concept['dimensions']:
-                    dim_desc = dimension['dimension_description']
-                    flat_data.append({
-                        'label': label,
-                        'model': model,
-                        'concept': concept_desc,
-                        'dimension': dim_desc,
-                        'question': '',
-                        'score': dimension.get('overall_score')
-                    })
-
-                    for question in dimension['questions']:
-                        flat_data.append({
-                            'label': label,
-                            'model': model,
-                            'concept': concept_desc,
-                            'dimension': dim_desc,
-                            'question': question['label'],
-                            'score': question['score']
-                        })
-
-    return pd.DataFrame(flat_data)
+    """Model, concept, dimension and question scores of the texts in one long frame, in nested order.
+
+    Built on flatten_text_evals: model rows have concept 'TEXT', higher-level rows have '' as
+    dimension and question, and a question row holds the question label. String columns are
+    categoricals.
+    """
+    return score_rows(flatten_text_evals(data, levels=SCORE_LEVELS, columns=SCORE_FLAT_COLUMNS))
+
+def score_rows(flat):
+    """The extract_all_model_scores columns of a frame from flatten_text_evals."""
+    def filled(column, value):
+        if value not in column.cat.categories:
+            column = column.cat.add_categories(value)
+        return column.fillna(value)
+
+    return pd.DataFrame({
+        'label': flat['label'],
+        'model': flat['model'],
+        'concept': filled(flat['concept'], 'TEXT'),
+        'dimension': filled(flat['dimension'], ''),
+        'question': filled(flat['question_label'], ''),
+        'score': flat['score']
+    }).reset_index(drop=True)
+
+def extract_columnar_scores(questions):
+    """The rows of extract_all_model_scores, built from a columnar question table without loops.
+
+    Every model, concept and dimension row is taken from the first question row of its group,
+    and sorting on that row's position restores the nested order of the JSON version.
+    """
+    names = ['label', 'model', 'concept', 'dimension', 'question_label']
+    questions = questions.astype({name: object for name in names}).reset_index(drop=True)
+    questions['position'] = questions.index
+
+    levels = [
+        (['label', 'model'], 'model_score'),
+        (['label', 'model', 'concept_index'], 'concept_score'),
+        (['label', 'model', 'concept_index', 'dimension_index'], 'dimension_score'),
+    ]
+    frames = []
+    for level, (keys, score) in enumerate(levels):
+        rows = questions.drop_duplicates(keys)
+        frames.append(pd.DataFrame({
+            'label': rows['label'],
+            'model': rows['model'],
+            'concept': 'TEXT' if level == 0 else rows['concept'],
+            'dimension': rows['dimension'] if level == 2 else '',
+            'question': '',
+            'score': rows[score],
+            'position': rows['position'],
+            'level': level
+        }))
+    frames.append(pd.DataFrame({
+        'label': questions['label'],
+        'model': questions['model'],
+        'concept': questions['concept'],
+        'dimension': questions['dimension'],
+        'question': questions['question_label'],
+        'score': questions['score'],
+        'position': questions['position'],
+        'level': len(levels)
+    }))
+
+    flat = pd.concat(frames).sort_values(['position', 'level'], kind='stable')
+    return flat.drop(columns=['position', 'level']).reset_index(drop=True)
+
+
+def load_model_scores(path):
+    """extract_all_model_scores for a results file: nested JSON, results JSONL or columnar Parquet.
+
+    JSON and JSONL files are streamed into the flattener one text at a time, so the nested
+    results are never all in memory at once.
+    """
+    if path.endswith('.parquet'):
+        columns = ['label', 'model', 'concept', 'dimension', 'question_label', 'concept_index', 'dimension_index',
+                   'score', 'dimension_score', 'concept_score', 'model_score']
+        return extract_columnar_scores(read_questions(path, columns=columns))
+
+    return extract_all_model_scores(iter_result_file(path))
+
+
+# Filters of query_model_scores, applied to the union of all score levels
+SCORE_LEVEL_COLUMNS = {"run": "s.run", "run_name": "s.run_name", "label": "s.label", "text_key": "s.label",
+                       "text_hash": "s.text_hash", "model": "s.model", "concept": "s.concept"}
+SCORE_LEVELS_SQL = """
+    SELECT m.run_id AS run, r.name AS run_name, t.label, t.text_hash, m.model, 'TEXT' AS concept,
+           '' AS dimension, '' AS question, m.overall_score AS score,
+           t.text_id AS text_order, m.model_eval_id AS model_order, -1 AS c, -1 AS d, -1 AS q
+    FROM models m JOIN texts t ON t.text_id = m.text_id JOIN runs r ON r.run_id = m.run_id
+    WHERE m.failed = 0
+    UNION ALL
+    SELECT m.run_id, r.name, t.label, t.text_hash, m.model, c.concept, '', '', c.overall_score,
+           t.text_id, m.model_eval_id, c.concept_index, -1, -1
+    FROM concepts c JOIN models m ON m.model_eval_id = c.model_eval_id
+    JOIN texts t ON t.text_id = m.text_id JOIN runs r ON r.run_id = m.run_id
+    UNION ALL
+    SELECT m.run_id, r.name, t.label, t.text_hash, m.model, c.concept, d.dimension, '', d.overall_score,
+           t.text_id, m.model_eval_id, c.concept_index, d.dimension_index, -1
+    FROM dimensions d JOIN concepts c ON c.concept_eval_id = d.concept_eval_id
+    JOIN models m ON m.model_eval_id = c.model_eval_id
+    JOIN texts t ON t.text_id = m.text_id JOIN runs r ON r.run_id = m.run_id
+    UNION ALL
+    SELECT q.run_id, r.name, t.label, t.text_hash, q.model, q.concept, q.dimension, q.question_label, q.score,
+           t.text_id, c.model_eval_id, c.concept_index, d.dimension_index, q.question_index
+    FROM questions q JOIN dimensions d ON d.dimension_eval_id = q.dimension_eval_id
+    JOIN concepts c ON c.concept_eval_id = d.concept_eval_id
+    JOIN texts t ON t.text_id = q.text_id JOIN runs r ON r.run_id = q.run_id
+"""
+
+
+def query_model_scores(store: ResultsStore, **filters):
+    """The rows of extract_all_model_scores for the runs, texts and models matching the filters.
+
+    Reads from the results store instead of a JSON file, e.g. query_model_scores(store, run=3);
+    the run column tells rows of different runs apart.
+    """
+    where, params = where_clause(filters, SCORE_LEVEL_COLUMNS)
+    return store.query(f"""
+        SELECT s.run, s.label, s.model, s.concept, s.dimension, s.question, s.score
+        FROM ({SCORE_LEVELS_SQL}) s{where}
+        ORDER BY s.run, s.text_order, s.model_order, s.c, s.d, s.q""", params)
+
+
+def query_run_differences(store: ResultsStore, run_a: int, run_b: int, **filters):
+    """Question scores of two stored runs side by side, joined and differenced in SQL.
+
+    Questions are matched on text content (text_hash), model, concept and question label, so a
+    text keeps matching when its label changes. Filters are columns of QUESTION_COLUMNS.
+    """
+    where, params = where_clause(filters)
+    where = where.replace(" WHERE ", " AND ") if where else ""
+    select = f"""
+        SELECT t.text_hash, t.label, q.model, q.concept, q.dimension, q.question_label AS question, q.score
+        {QUESTION_FROM} WHERE q.run_id = ?{where}"""
+    return store.query(f"""
+        SELECT a.label, a.model, a.concept, a.dimension, a.question,
+               a.score AS score_a, b.score AS score_b, b.score - a.score AS difference
+        FROM ({select}) a JOIN ({select}) b
+          ON b.text_hash = a.text_hash AND b.model = a.model AND b.concept = a.concept AND b.question = a.question
+        ORDER BY a.label, a.model, a.concept, a.dimension, a.question""", [run_a, *params, run_b, *params])
+
 
 def compare_datasets(df1, df2):
     df1['source'] = 'file1'
@@ -64,49 +171,74 @@ def compare_datasets(df1, df2):
     pivoted = combined.pivot_table(
         index=['label', 'model', 'concept', 'dimension', 'question'],
         columns='source',
-        values='score'
+        values='score',
+        observed=True
     ).reset_index()
 
     pivoted['difference'] = pivoted['file2'] - pivoted['file1']
     return pivoted
 
 
-def plot_radar_chart(df, concept, models_to_include, label_to_focus_on):
-    # Filter the DataFrame
-    df_filtered = df[(df['concept'] == concept) & (df['model'].isin(models_to_include)) & (df['label'] == label_to_focus_on)]
+def compare_question_modes(single_df, batched_df, threshold=0.5):
+    """Compares question scores from single-question and batched (per-dimension) runs.
 
-    # Get unique dimensions
-    dimensions = df_filtered['dimension'].unique()
-    dimensions = [dim for dim in dimensions if dim != '' and str(dim) != 'nan']  # Remove empty string and 'nan'
-    num_dimensions = len(dimensions)
+    Both inputs come from extract_all_model_scores. Returns one row per question with both
+    scores and their difference, and prints how well the two modes agree.
+    """
+    keys = ['label', 'model', 'concept', 'dimension', 'question']
+    single = single_df[single_df['question'] != ''][keys + ['score']]
+    batched = batched_df[batched_df['question'] != ''][keys + ['score']]
+
+    merged = single.merge(batched, on=keys, how='inner', suffixes=('_single', '_batched'))
+    merged['difference'] = merged['score_batched'] - merged['score_single']
+
+    both = merged.dropna(subset=['score_single', 'score_batched'])
+    same_answer = (both['score_single'] >= threshold) == (both['score_batched'] >= threshold)
+
+    print(f"Compared {len(both)} questions ({len(merged) - len(both)} without a score in one of the modes)")
+    print(f"Mean absolute difference: {both['difference'].abs().mean():.3f}")
+    print(f"Pearson correlation: {both['score_single'].corr(both['score_batched']):.3f}")
+    print(f"Same answer at threshold {threshold}: {same_answer.mean():.1%}")
+
+    return merged
 
-    # Create a dictionary to store scores for each model
-    model_scores = {model: [np.nan] * num_dimensions for model in models_to_include}
 
-    # Populate the model_scores dictionary
-    for model in models_to_include:
-        for i, dimension in enumerate(dimensions):
-            # Get the score for the current model and dimension
-            score = df_filtered[(df_filtered['model'] == model) & (df_filtered['dimension'] == dimension)]['score'].values
-            # Assign the score if it exists, otherwise leave as NaN
-            if len(score) > 0:
-                model_scores[model][i] = score[0]
+def radar_data(df, concept, models_to_include, label_to_focus_on):
+    """Scores of one concept and text as a dimension x model table, built with a single pivot.
+
+    Dimensions are rows in order of appearance, models are columns in the given order. Only the
+    first row of each (model, dimension) is used, which in extract_all_model_scores order is the
+    dimension score; missing cells are NaN.
+    """
+    rows = df[(df['concept'] == concept) & (df['label'] == label_to_focus_on) & df['model'].isin(models_to_include)]
+    rows = rows[rows['dimension'].notna() & (rows['dimension'] != '')]
+    dimensions = list(rows['dimension'].unique())
+    scores = rows.drop_duplicates(['model', 'dimension']).pivot(index='dimension', columns='model', values='score')
+    return scores.reindex(index=dimensions, columns=list(models_to_include))
+
+
+def plot_radar_chart(df, concept, models_to_include, label_to_focus_on):
+    # Dimension x model scores from one pivot
+    scores_table = radar_data(df, concept, models_to_include, label_to_focus_on)
+    dimensions = list(scores_table.index)
+    num_dimensions = len(dimensions)
 
     # Set up the radar chart
     angles = np.linspace(0, 2 * np.pi, num_dimensions, endpoint=False).tolist()
     angles += angles[:1]  # Close the circle
 
-    # Create the radar chart
-    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(polar=True))
+    # Create the radar chart (a Figure outside pyplot, so figures that are kept around are not all left open)
+    fig = Figure(figsize=(8, 8))
+    ax = fig.add_subplot(polar=True)
 
     # Aesthetics: remove spines, set background color
     ax.spines['polar'].set_visible(False)
     ax.set_facecolor('#F0F0F0')
 
     # Plot each model
-    for model, scores in model_scores.items():
+    for model, scores in scores_table.items():
         # Replace NaN values with 0 for plotting
-        scores = [0 if np.isnan(score) else score for score in scores]
+        scores = scores.fillna(0).tolist()
         scores += scores[:1]  # Close the circle
 
         ax.plot(angles, scores, linewidth=2, linestyle='solid', label=model)
@@ -120,9 +252,54 @@ def plot_radar_chart(df, concept, models_to_include, label_to_focus_on):
     ax.set_title(f'Radar Chart for {concept} - {label_to_focus_on}')
     ax.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1))
 
-    # Show the plot
-    #plt.show()
     return fig, ax
+
+
+def data_fingerprint(df):
+    """A hash of the contents of a score frame, to key cached figures on the data they were drawn from."""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+_radar_figures = OrderedDict()
+_radar_pngs = weakref.WeakKeyDictionary()  # rendered cached figures, dropped with their figure
+_radar_figures_lock = threading.Lock()
+
+
+def cached_radar_chart(df, concept, models_to_include, label_to_focus_on, fingerprint=None):
+    """plot_radar_chart, reusing the figure drawn before for the same selection and data.
+
+    Figures are kept per (concept, models, label, data fingerprint), the RADAR_FIGURE_CACHE most
+    recently used ones. Pass a fingerprint of the data (e.g. of the files it was read from) to
+    skip hashing df. Cached figures are shared, so don't draw on them.
+    """
+    if fingerprint is None:
+        fingerprint = data_fingerprint(df)
+    key = (concept, tuple(models_to_include), label_to_focus_on, fingerprint)
+    with _radar_figures_lock:
+        if key in _radar_figures:
+            _radar_figures.move_to_end(key)
+            return _radar_figures[key]
+
+    figure = plot_radar_chart(df, concept, models_to_include, label_to_focus_on)
+    with _radar_figures_lock:
+        _radar_figures[key] = figure
+        while len(_radar_figures) > RADAR_FIGURE_CACHE:
+            _radar_figures.popitem(last=False)
+    return figure
+
+
+def radar_chart_png(df, concept, models_to_include, label_to_focus_on, fingerprint=None):
+    """cached_radar_chart rendered as PNG bytes; each cached figure is rendered only once."""
+    fig, _ = cached_radar_chart(df, concept, models_to_include, label_to_focus_on, fingerprint)
+    with _radar_figures_lock:
+        png = _radar_pngs.get(fig)
+    if png is None:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        png = buffer.getvalue()
+        with _radar_figures_lock:
+            _radar_pngs[fig] = png
+    return png
     
 
 def normalize_and_export(df1, df2, save_path="model_score_comparison_flat.csv"):
@@ -146,12 +323,9 @@ def normalize_and_export(df1, df2, save_path="model_score_comparison_flat.csv"):
 
 if __name__ == "__main__":
         # Load files
-    data1 = load_json("evaluation_results/validation_data.json")
-    data2 = load_json("evaluation_results/model_eval_data.json")
-
-    # Extract scores
-    df1 = extract_all_model_scores(data1)
-    df2 = extract_all_model_scores(data2)
+    # Load and extract scores (.parquet files are read as columns, see src.columnar)
+    df1 = load_model_scores("evaluation_results/validation_data.json")
+    df2 = load_model_scores("evaluation_results/model_eval_data.json")
 
     # # Compare and export
     comparison_df = normalize_and_export(df1, df2)
@@ -16,6 +16,26 @@ class Concept(TypedDict):
     dimensions: List[str]
     weight: float  # importance weight within overall evaluation (default 1.0)
 
+class CallUsage(TypedDict):
+    model: str
+    requests: float  # 1, or the question's share of a batched request (all fields below are shared the same way)
+    prompt_tokens: float
+    completion_tokens: float
+    cached_tokens: float  # prompt tokens served from the provider's prefix cache
+    latency: Optional[float]  # seconds spent on the request, None if unknown (e.g. batch output)
+    queue_wait: Optional[float]  # seconds between queueing the request and sending it (incl. pacing and retries)
+    cost: Optional[float]  # USD, None if the model has no price in MODEL_PRICES
+    from_cache: bool  # True if the response came from the local response cache instead of the API
+
+class UsageTotals(TypedDict):
+    requests: float
+    prompt_tokens: float
+    completion_tokens: float
+    cached_tokens: float
+    latency: float  # summed request time, not wall time
+    queue_wait: float
+    cost: float
+
 class QuestionEval(TypedDict):
     label: str
     question: str
@@ -23,24 +43,29 @@ class QuestionEval(TypedDict):
     score: float  # percentage score from 0 to 1
     logprob: Optional[float]  # log probability of the ansœwer
     positive_contribution: bool  # if True, higher score is better; if False, lower score is better
+    top_logprobs: Optional[Dict[str, list]]  # {"tokens": [...], "logprobs": [...]} of the answer token, for re-scoring
+    usage: Optional[CallUsage]  # token usage and latency of the request (shared equally in batched mode)
 
 class DimensionEval(TypedDict):
     dimension_description: str
     questions: List[QuestionEval]
     overall_score: float # weighted average of question scores
     weight: float  # importance weight within parent concept (default 1.0)
+    usage: UsageTotals
 
 class ConceptEval(TypedDict):
     concept_description: str
     dimensions: List[DimensionEval]
     overall_score: float # weighted average of dimension scores
     weight: float  # importance weight within overall evaluation (default 1.0)
+    usage: UsageTotals
 
 class ModelEval(TypedDict):
     model_name: str
     concepts_scores: List[ConceptEval]
     overall_score: float
     weight: float # importance weight within overall evaluation (default 1.0)
+    usage: UsageTotals
     # top_logprobs: List[Dict[str, float]]  # logprobs for the model's responses
 
 class TextEval(TypedDict):
@@ -49,6 +74,7 @@ class TextEval(TypedDict):
     concepts: List[Concept]
     evaluations: Dict[str, ModelEval]  # model_id -> ModelEval mapping for multiple model support
    # aggregated_scores: dict{str:float}  # combined score across all models used
+    usage: UsageTotals  # summed over all models
     metadata: Dict[str, Any]  # information about evaluation parameters, etc.
     timestamp: str  # when evaluation was performed
 
@@ -0,0 +1,419 @@
+import time
+import numpy as np
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config.config import (
+    DEFAULT_WEIGHT,
+    TOP_LOGPROBS,
+    PROMPT_LAYOUT,
+    SCORING_MODE,
+    ANSWER_TOKENS,
+    ANSWER_LOGIT_BIAS,
+    ANSWER_TOKEN_IDS,
+    MODEL_PRICES,
+    BATCH_PRICE_FACTOR
+)
+from src.concepts import QuestionEval, DimensionEval, ConceptEval, ModelEval, TextEval, Concept, Dimension, Question, CallUsage, UsageTotals
+from src.response_cache import ResponseCache
+from src.rate_limit import create_with_retries, acreate_with_retries
+
+from prompts.eval_prompt import sys_eval_prompt, eval_prompts
+
+_response_cache: Optional[ResponseCache] = None  # see set_response_cache
+_prompt_layout: str = PROMPT_LAYOUT  # see set_prompt_layout
+_scoring_mode: str = SCORING_MODE  # see set_scoring_mode
+SCORING_MODES = ("first_token", "constrained")
+
+
+def set_prompt_layout(layout: str) -> None:
+    """Selects the prompt layout for all engines: "default" or "prefix_cache" (input text first)."""
+    global _prompt_layout
+    if layout not in eval_prompts:
+        raise ValueError(f"Unknown prompt layout {layout!r}, choose from {list(eval_prompts)}")
+    _prompt_layout = layout
+
+
+def get_prompt_layout() -> str:
+    return _prompt_layout
+
+
+def set_scoring_mode(mode: str) -> None:
+    """Selects how single questions are asked and scored: "first_token" or "constrained"."""
+    global _scoring_mode
+    if mode not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode {mode!r}, choose from {list(SCORING_MODES)}")
+    _scoring_mode = mode
+
+
+def get_scoring_mode() -> str:
+    return _scoring_mode
+
+
+def build_messages(
+        concept: Concept,
+        dimension: Dimension,
+        question_obj: Question,
+        input_text: str
+        ) -> List[Dict[str, str]]:
+    """Renders the system and user prompt for a single question."""
+    system_prompt = sys_eval_prompt.format(concept=concept)
+    base_prompt = eval_prompts[_prompt_layout].format(
+        concept=concept,
+        dimension=dimension,
+        question=question_obj["question"],
+        input_text=input_text,
+        examples=question_obj["examples"]
+    )
+
+    return [
+        {"role": "developer", "content": system_prompt},
+        {"role": "user", "content": base_prompt}
+    ]
+
+
+def request_params(model: str, messages: List[Dict[str, str]], **extra: Any) -> Dict[str, Any]:
+    """Returns the keyword arguments for a chat completion with logprobs."""
+    return {
+        "model": model,
+        "messages": messages,
+        "logprobs": True,
+        "top_logprobs": TOP_LOGPROBS,
+        **extra
+    }
+
+
+@lru_cache(maxsize=None)
+def answer_token_ids(model: str) -> Dict[str, int]:
+    """Token ids of the True/False answer tokens for a model, resolved once with tiktoken.
+
+    ANSWER_TOKEN_IDS in config/config.py takes precedence, e.g. for models tiktoken does not know.
+    """
+    if model in ANSWER_TOKEN_IDS:
+        return dict(ANSWER_TOKEN_IDS[model])
+
+    import tiktoken  # only needed for constrained scoring
+    encoding = tiktoken.encoding_for_model(model)
+
+    token_ids = {}
+    for token in ANSWER_TOKENS:
+        ids = encoding.encode(token)
+        if len(ids) != 1:
+            raise ValueError(f"Answer token {token!r} is not a single token for {model}: {ids}")
+        token_ids[token] = ids[0]
+    return token_ids
+
+
+def question_request_params(model: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Request parameters for a single question in the current scoring mode.
+
+    In constrained mode the answer is one token, and the logit bias leaves only True and False possible.
+    """
+    if _scoring_mode != "constrained":
+        return request_params(model, messages)
+
+    logit_bias = {str(token_id): ANSWER_LOGIT_BIAS for token_id in answer_token_ids(model).values()}
+    return request_params(model, messages, max_tokens=1, logit_bias=logit_bias)
+
+
+def response_payload(response) -> Dict[str, Any]:
+    """Converts a chat completion into the plain dict that is cached and parsed."""
+    choice = response.choices[0]
+    return {
+        "content": [token.model_dump() for token in choice.logprobs.content],
+        "usage": response.usage.model_dump() if response.usage else None
+    }
+
+
+def first_token_logprobs(payload: Dict[str, Any]) -> List[Dict[str, float]]:
+    """Extracts the top logprobs of the first answer token as plain dicts."""
+    top_logprobs = payload["content"][0]["top_logprobs"]
+    return [{"token": logprob["token"], "logprob": logprob["logprob"]} for logprob in top_logprobs]
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Sets the process-wide response cache. Pass None to disable caching."""
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
+
+
+def request_payload(client, params: Dict[str, Any], queued_at: Optional[float] = None) -> Dict[str, Any]:
+    """Returns the response payload for these request parameters, from the response cache if possible.
+
+    Requests that do go out are paced by the model's rate limits and retried on 429/5xx.
+    The payload gets the request latency, the time it waited before being sent (since `queued_at`,
+    a time.perf_counter() value, plus pacing and retries) and whether it was a response cache hit.
+    """
+    start = time.perf_counter()
+    queue_wait = start - queued_at if queued_at is not None else 0.0
+
+    payload = _response_cache.get(params) if _response_cache else None
+    if payload is not None:
+        return {**payload, "latency": time.perf_counter() - start, "queue_wait": queue_wait, "from_cache": True}
+
+    timing = {}
+    payload = response_payload(create_with_retries(client, params, timing))
+    if _response_cache:
+        _response_cache.put(params, payload)
+
+    return {**payload, "latency": timing["latency"], "queue_wait": queue_wait + timing["waited"], "from_cache": False}
+
+
+async def arequest_payload(client, params: Dict[str, Any], queued_at: Optional[float] = None) -> Dict[str, Any]:
+    """Async counterpart of request_payload for an AsyncOpenAI client."""
+    start = time.perf_counter()
+    queue_wait = start - queued_at if queued_at is not None else 0.0
+
+    payload = _response_cache.get(params) if _response_cache else None
+    if payload is not None:
+        return {**payload, "latency": time.perf_counter() - start, "queue_wait": queue_wait, "from_cache": True}
+
+    timing = {}
+    payload = response_payload(await acreate_with_retries(client, params, timing))
+    if _response_cache:
+        _response_cache.put(params, payload)
+
+    return {**payload, "latency": timing["latency"], "queue_wait": queue_wait + timing["waited"], "from_cache": False}
+
+
+def call_cost(model: str, prompt_tokens: float, completion_tokens: float, cached_tokens: float, batch: bool = False) -> Optional[float]:
+    """Price of a request in USD from MODEL_PRICES, or None if the model has no price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+
+    cost = (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * prices.get("cached_input", prices["input"])
+        + completion_tokens * prices["output"]
+    ) / 1_000_000
+    return cost * BATCH_PRICE_FACTOR if batch else cost
+
+
+def usage_from_payload(payload: Dict[str, Any], model: str, share: int = 1) -> CallUsage:
+    """Token usage, timing and cost of a request. With share > 1 everything is split over that many questions.
+
+    Responses from the response cache cost nothing.
+    """
+    usage = payload.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    prompt_tokens = (usage.get("prompt_tokens") or 0) / share
+    completion_tokens = (usage.get("completion_tokens") or 0) / share
+    cached_tokens = (details.get("cached_tokens") or 0) / share
+    from_cache = payload.get("from_cache", False)
+    latency = payload.get("latency")
+    queue_wait = payload.get("queue_wait")
+
+    return {
+        "model": model,
+        "requests": 1 / share,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "latency": latency / share if latency is not None else None,
+        "queue_wait": queue_wait / share if queue_wait is not None else None,
+        "cost": 0.0 if from_cache else call_cost(model, prompt_tokens, completion_tokens, cached_tokens, payload.get("batch", False)),
+        "from_cache": from_cache
+    }
+
+
+def compact_logprobs(top_logprobs: List[Dict[str, float]]) -> Dict[str, list]:
+    """Stores a top logprob distribution as two parallel lists, so it can be re-scored offline (see src.rescore)."""
+    return {
+        "tokens": [logprob["token"] for logprob in top_logprobs],
+        "logprobs": [logprob["logprob"] for logprob in top_logprobs]
+    }
+
+
+def score_payload(question_obj: Question, payload: Dict[str, Any], model: str) -> QuestionEval:
+    """Scores a single-question response payload in the current scoring mode and records its usage."""
+    top_logprobs = first_token_logprobs(payload)
+    score = score_constrained if _scoring_mode == "constrained" else score_question
+    question_eval = score(question_obj, top_logprobs)
+    question_eval["top_logprobs"] = compact_logprobs(top_logprobs)
+    question_eval["usage"] = usage_from_payload(payload, model)
+    return question_eval
+
+
+def answer_token(token: str) -> str:
+    """Normalizes an answer token for matching: surrounding whitespace and case are ignored (" True" -> "true")."""
+    return token.strip().lower()
+
+
+def score_question(question_obj: Question, top_logprobs: List[Dict[str, float]]) -> QuestionEval:
+    """Turns the top logprobs of the first answer token into a QuestionEval."""
+    positive_contribution = question_obj["positive_contribution"]
+
+    probability = None  # Initialize probability to None
+    logprob_value = None  # Initialize logprob_value to None
+    token = None
+
+    for logprob in top_logprobs:
+        token = answer_token(logprob["token"])
+
+        # If token is not true or false, assign None to probability
+        if token != "true" and token != "false":
+            continue
+
+        if positive_contribution == True:
+            if token == "true":
+                token = logprob["token"]
+                logprob_value = logprob["logprob"]
+                probability = np.round(np.exp(logprob_value), 3)
+                break  # Exit loop after finding the first valid token
+
+        elif positive_contribution == False:
+            if token == "false":
+                token = logprob["token"]
+                logprob_value = logprob["logprob"]
+                probability = 1 - np.round(np.exp(logprob_value), 3)
+                break  # Exit loop after finding the first valid token
+
+    return {
+        "label": question_obj["label"],
+        "question": question_obj["question"],
+        "answer": token,
+        "score": probability,
+        "logprob": logprob_value,
+        "positive_contribution": positive_contribution
+    }
+
+
+def score_constrained(question_obj: Question, top_logprobs: List[Dict[str, float]]) -> QuestionEval:
+    """Scores a constrained answer from the True/False pair of logprobs, renormalized to sum to one.
+
+    The equal logit bias on both tokens cancels out in the ratio, so the pair keeps the model's
+    own preference. A token missing from the top logprobs counts as probability zero; if both are
+    missing the question gets no score, like score_question when no answer token is found.
+    """
+    true_token, false_token = ANSWER_TOKENS
+    pair = {true_token: -np.inf, false_token: -np.inf}
+    answers = {answer_token(token): token for token in ANSWER_TOKENS}
+    for logprob in top_logprobs:
+        token = answers.get(answer_token(logprob["token"]))
+        if token is not None:
+            pair[token] = max(pair[token], logprob["logprob"])
+
+    positive_contribution = question_obj["positive_contribution"]
+    total = np.logaddexp(pair[true_token], pair[false_token])
+    if np.isneginf(total):
+        # Neither answer made the top logprobs: only this question goes without a score
+        return {
+            "label": question_obj["label"],
+            "question": question_obj["question"],
+            "answer": None,
+            "score": None,
+            "logprob": None,
+            "positive_contribution": positive_contribution
+        }
+    renormalized = {token: value - total for token, value in pair.items()}
+
+    scored_token = true_token if positive_contribution else false_token
+    probability = np.round(np.exp(renormalized[scored_token]), 3)
+    logprob_value = None if np.isneginf(renormalized[scored_token]) else float(renormalized[scored_token])
+
+    return {
+        "label": question_obj["label"],
+        "question": question_obj["question"],
+        "answer": max(renormalized, key=renormalized.get),
+        "score": probability if positive_contribution else 1 - probability,
+        "logprob": logprob_value,
+        "positive_contribution": positive_contribution
+    }
+
+
+def mean_score(scores: List[Optional[float]]) -> Optional[float]:
+    """Averages scores, excluding None values. Returns None if nothing is left."""
+    scores = [s for s in scores if s is not None]
+    return np.round(np.mean(scores), 3) if scores else None
+
+
+def weighted_score(scores: List[Optional[float]], weights: List[float]) -> Optional[float]:
+    """Weighted average of scores, excluding None values and renormalizing the remaining weights."""
+    pairs = [(s, w) for s, w in zip(scores, weights) if s is not None]
+    if not pairs or sum(w for _, w in pairs) == 0:
+        return None
+    values, weights = zip(*pairs)
+    return np.round(np.sum(np.multiply(values, weights)) / np.sum(weights), 3)
+
+
+def sum_usage(usages: List[Optional[Dict[str, Any]]]) -> UsageTotals:
+    """Adds up question usages (or the totals of lower levels) into UsageTotals. Missing usage is skipped."""
+    totals = {"requests": 0.0, "prompt_tokens": 0.0, "completion_tokens": 0.0, "cached_tokens": 0.0,
+              "latency": 0.0, "queue_wait": 0.0, "cost": 0.0}
+    for usage in usages:
+        if not usage:
+            continue
+        for key in ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "queue_wait", "cost"):
+            totals[key] += usage.get(key) or 0.0
+    return totals
+
+
+def build_dimension_eval(dimension: Dimension, question_scores: List[QuestionEval]) -> DimensionEval:
+    """Wraps question evaluations into a DimensionEval."""
+    return {
+        "dimension_description": dimension["dimension_description"],
+        "questions": question_scores,
+        "overall_score": mean_score([q["score"] for q in question_scores]),
+        "weight": dimension.get("weight", DEFAULT_WEIGHT),
+        "usage": sum_usage([q.get("usage") for q in question_scores])
+    }
+
+
+def build_concept_eval(concept: Concept, dimension_scores: List[DimensionEval]) -> ConceptEval:
+    """Wraps dimension evaluations into a ConceptEval."""
+    return {
+        "concept_description": concept["concept_description"],
+        "dimensions": dimension_scores,
+        "overall_score": weighted_score([d["overall_score"] for d in dimension_scores], [d["weight"] for d in dimension_scores]),
+        "weight": concept.get("weight", DEFAULT_WEIGHT),
+        "usage": sum_usage([d.get("usage") for d in dimension_scores])
+    }
+
+
+def build_model_eval(model: str, concept_scores: List[ConceptEval]) -> ModelEval:
+    """Wraps concept evaluations into a ModelEval."""
+    return {
+        "model_name": model,
+        "concepts_scores": concept_scores,
+        "overall_score": weighted_score([c["overall_score"] for c in concept_scores], [c["weight"] for c in concept_scores]),
+        "weight": DEFAULT_WEIGHT,
+        "usage": sum_usage([c.get("usage") for c in concept_scores])
+    }
+
+
+def build_text_eval(
+        models: List[str],
+        text: str,
+        label: str,
+        concepts: List[Concept],
+        evaluations: Dict[str, Optional[ModelEval]]
+        ) -> TextEval:
+    """Wraps model evaluations of a single text into a TextEval."""
+    scores = [m["overall_score"] for m in evaluations.values() if m]
+
+    metadata = {
+        "models_used": models,
+        "evaluation_parameters": {
+            "system_prompt": str(sys_eval_prompt),
+            "base_prompt": str(eval_prompts[_prompt_layout]),
+            "prompt_layout": _prompt_layout,
+            "scoring_mode": _scoring_mode
+        }
+    }
+
+    return {
+        "label": label,
+        "input_text": text,
+        "concepts": concepts,
+        "evaluations": evaluations,
+        "aggregated_score": mean_score(scores),
+        "usage": sum_usage([m.get("usage") for m in evaluations.values() if m]),
+        "metadata": metadata,
+        "timestamp": datetime.now().strftime("%Y-%m-%d")
+    }
@@ -0,0 +1,158 @@
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.concepts import TextEval
+
+LEVELS = ("text", "model", "concept", "dimension", "question")
+STRING_COLUMNS = ("label", "model", "concept", "dimension", "question_label", "question")
+INDEX_COLUMNS = ("concept_index", "dimension_index", "question_index")
+FLAT_COLUMNS = ["level", *STRING_COLUMNS, *INDEX_COLUMNS, "score", "logprob", "weight"]
+QUESTION_LEVEL = LEVELS.index("question")
+LEVEL_DTYPE = pd.CategoricalDtype(LEVELS)
+
+
+class _Columns:
+    """Column lists of a flat frame being built. Strings are stored as category codes right away."""
+
+    def __init__(self, levels: Iterable[str], models: Optional[Iterable[str]], labels: Optional[Iterable[str]]):
+        self.levels = set(levels)
+        self.models = set(models) if models is not None else None
+        self.labels = set(labels) if labels is not None else None
+        self.categories: Dict[str, Dict[str, int]] = {name: {} for name in STRING_COLUMNS}
+        self.codes: Dict[str, List[int]] = {name: [] for name in ("level", *STRING_COLUMNS)}
+        self.values: Dict[str, list] = {name: [] for name in (*INDEX_COLUMNS, "score", "logprob", "weight")}
+
+    def __len__(self) -> int:
+        return len(self.codes["level"])
+
+    def code(self, column: str, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        categories = self.categories[column]
+        code = categories.get(value)
+        if code is None:
+            code = categories[value] = len(categories)
+        return code
+
+    def add(self, level: str, codes: Dict[str, int], values: Dict[str, Any]) -> None:
+        """Adds an aggregate row; columns that are not given are missing."""
+        self.codes["level"].append(LEVELS.index(level))
+        for column in STRING_COLUMNS:
+            self.codes[column].append(codes.get(column, -1))
+        for column, column_values in self.values.items():
+            column_values.append(values.get(column, -1 if column in INDEX_COLUMNS else None))
+
+    def add_questions(self, questions: List[Dict[str, Any]], codes: Dict[str, int], c: int, d: int) -> None:
+        """Adds the question rows of one dimension, a column at a time."""
+        n = len(questions)
+        self.codes["level"].extend(repeat(QUESTION_LEVEL, n))
+        for column in ("label", "model", "concept", "dimension"):
+            self.codes[column].extend(repeat(codes[column], n))
+        for column, key in (("question_label", "label"), ("question", "question")):
+            # Interned inline: len() is evaluated before setdefault inserts a new value
+            categories = self.categories[column]
+            self.codes[column].extend([categories.setdefault(q[key], len(categories)) for q in questions])
+        self.values["concept_index"].extend(repeat(c, n))
+        self.values["dimension_index"].extend(repeat(d, n))
+        self.values["question_index"].extend(range(n))
+        self.values["score"].extend([q["score"] for q in questions])
+        self.values["logprob"].extend([q["logprob"] for q in questions])
+        self.values["weight"].extend(repeat(None, n))
+
+    def add_text(self, text_eval: TextEval) -> None:
+        """Adds the rows of one text, in nested order."""
+        label, levels, code = text_eval["label"], self.levels, self.code
+        if self.labels is not None and label not in self.labels:
+            return
+        text_codes = {"label": code("label", label)}
+        if "text" in levels:
+            self.add("text", text_codes, {"score": text_eval.get("aggregated_score")})
+
+        for model, model_eval in text_eval["evaluations"].items():
+            if model_eval is None or (self.models is not None and model not in self.models):
+                continue
+            model_codes = {**text_codes, "model": code("model", model)}
+            if "model" in levels:
+                self.add("model", model_codes, {"score": model_eval["overall_score"], "weight": model_eval.get("weight")})
+
+            for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                concept_codes = {**model_codes, "concept": code("concept", concept_eval["concept_description"])}
+                if "concept" in levels:
+                    self.add("concept", concept_codes, {"concept_index": c, "score": concept_eval["overall_score"],
+                                                        "weight": concept_eval.get("weight")})
+
+                for d, dimension_eval in enumerate(concept_eval["dimensions"]):
+                    dimension_codes = {**concept_codes, "dimension": code("dimension", dimension_eval["dimension_description"])}
+                    if "dimension" in levels:
+                        self.add("dimension", dimension_codes, {
+                            "concept_index": c, "dimension_index": d, "score": dimension_eval["overall_score"],
+                            "weight": dimension_eval.get("weight")
+                        })
+                    if "question" in levels:
+                        self.add_questions(dimension_eval["questions"], dimension_codes, c, d)
+
+    def frame(self, columns: Iterable[str] = FLAT_COLUMNS) -> pd.DataFrame:
+        """The rows added so far, as a frame of the given columns."""
+        # Codes are valid by construction, so skip pandas' validation of them
+        data = {}
+        for column in columns:
+            if column == "level":
+                data[column] = pd.Categorical.from_codes(np.array(self.codes[column], dtype=np.int8),
+                                                         dtype=LEVEL_DTYPE, validate=False)
+            elif column in STRING_COLUMNS:
+                data[column] = pd.Categorical.from_codes(np.array(self.codes[column], dtype=np.int32),
+                                                         categories=list(self.categories[column]), validate=False)
+            elif column in INDEX_COLUMNS:
+                data[column] = np.array(self.values[column], dtype=np.int16)
+            else:
+                data[column] = np.array(self.values[column], dtype=float)  # None -> NaN
+        return pd.DataFrame(data, copy=False)
+
+
+def flatten_text_evals(
+        text_evals: Iterable[TextEval],
+        levels: Iterable[str] = LEVELS,
+        models: Optional[Iterable[str]] = None,
+        labels: Optional[Iterable[str]] = None,
+        columns: Iterable[str] = FLAT_COLUMNS
+        ) -> pd.DataFrame:
+    """Flattens TextEvals into one typed frame in a single pass, with a row per score at the requested levels.
+
+    Rows come in nested order: a text, then per model its model row, per concept its concept row,
+    per dimension its dimension row followed by its questions. `level` says which kind of score a
+    row holds; the columns of lower levels are missing (NaN, index -1) on higher-level rows.
+    label, model, concept, dimension, question_label and question are categoricals whose codes
+    are assigned during the walk, so no string column is ever materialized as Python objects.
+    Texts outside `labels` and models outside `models` are skipped before they are flattened;
+    only the requested FLAT_COLUMNS are turned into a frame.
+    """
+    rows = _Columns(levels, models, labels)
+    for text_eval in text_evals:
+        rows.add_text(text_eval)
+    return rows.frame(columns)
+
+
+def iter_flat_chunks(
+        text_evals: Iterable[TextEval],
+        chunk_rows: int,
+        levels: Iterable[str] = LEVELS,
+        models: Optional[Iterable[str]] = None,
+        labels: Optional[Iterable[str]] = None,
+        columns: Iterable[str] = FLAT_COLUMNS
+        ) -> Iterator[pd.DataFrame]:
+    """flatten_text_evals in frames of whole texts, each closed once it holds at least `chunk_rows` rows.
+
+    Texts are consumed one at a time, so only the rows of the current frame are held in memory.
+    Categories differ per frame.
+    """
+    rows = _Columns(levels, models, labels)
+    for text_eval in text_evals:
+        rows.add_text(text_eval)
+        if len(rows) >= chunk_rows:
+            yield rows.frame(columns)
+            rows = _Columns(levels, models, labels)
+    if len(rows):
+        yield rows.frame(columns)
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+from config.config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_TIMEOUT,
+    HTTP2
+)
+
+try:
+    import h2  # noqa: F401, HTTP/2 support for httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ConnectionStats:
+    """Counts requests, new connections and TLS handshakes through httpcore's trace hook."""
+
+    def __init__(self):
+        self._counts = {"requests": 0, "connections": 0, "tls_handshakes": 0, "http2_connections": 0}
+        self._lock = threading.Lock()
+
+    def _add(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._add("connections")
+        elif event_name == "connection.start_tls.complete":
+            self._add("tls_handshakes")
+        elif event_name == "http2.send_connection_init.complete":
+            self._add("http2_connections")
+
+    async def atrace(self, event_name: str, info: Dict[str, Any]) -> None:
+        self.trace(event_name, info)
+
+    def on_request(self, request: httpx.Request) -> None:
+        self._add("requests")
+        request.extensions["trace"] = self.trace
+
+    async def aon_request(self, request: httpx.Request) -> None:
+        self._add("requests")
+        request.extensions["trace"] = self.atrace
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current counts plus the share of requests that reused a kept-alive connection."""
+        with self._lock:
+            counts = dict(self._counts)
+        reused = counts["requests"] - counts["connections"]
+        counts["reuse_rate"] = reused / counts["requests"] if counts["requests"] else 0.0
+        return counts
+
+
+_stats = ConnectionStats()
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+_async_client: Optional[AsyncOpenAI] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        "timeout": HTTP_TIMEOUT,
+        "http2": HTTP2 and HTTP2_AVAILABLE
+    }
+
+
+def get_client() -> OpenAI:
+    """Returns the process-wide OpenAI client. Its connection pool is shared by all threads and texts.
+
+    Retries are handled by src.rate_limit, so the client itself does not retry.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            http_client = DefaultHttpxClient(event_hooks={"request": [_stats.on_request]}, **_pool_options())
+            _client = OpenAI(max_retries=0, http_client=http_client)
+        return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Returns the AsyncOpenAI client of the running event loop, creating it on first use.
+
+    Async connections belong to one event loop, so every asyncio.run gets its own pool.
+    """
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        http_client = DefaultAsyncHttpxClient(event_hooks={"request": [_stats.aon_request]}, **_pool_options())
+        _async_client = AsyncOpenAI(max_retries=0, http_client=http_client)
+        _async_loop = loop
+    return _async_client
+
+
+async def close_async_client() -> None:
+    """Closes the async client of the running event loop, before the loop shuts down."""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+        _async_loop = None
+
+
+def connection_stats() -> Dict[str, Any]:
+    """Requests, new connections, TLS handshakes and the connection reuse rate of the shared clients."""
+    return _stats.snapshot()
@@ -0,0 +1,115 @@
+import numpy as np
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from src.concepts import CallUsage, TextEval
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def iter_question_usage(text_evals: Iterable[TextEval]) -> Iterator[CallUsage]:
+    """Yields the recorded usage of every question evaluation in a run."""
+    for text_eval in text_evals:
+        for model_eval in text_eval["evaluations"].values():
+            if model_eval is None:
+                continue
+            for concept_eval in model_eval["concepts_scores"]:
+                for dimension_eval in concept_eval["dimensions"]:
+                    for question_eval in dimension_eval["questions"]:
+                        if question_eval.get("usage"):
+                            yield question_eval["usage"]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 of a list of values, None when it is empty."""
+    return {
+        f"p{p}": float(np.percentile(values, p)) if values else None
+        for p in LATENCY_PERCENTILES
+    }
+
+
+def prefix_cache_latency(hits: List[float], misses: List[float]) -> Dict[str, Optional[float]]:
+    """Median latency of requests with and without a prefix cache hit, and the latency saved per hit.
+
+    The saving is None unless the run has requests of both kinds.
+    """
+    hit = float(np.median(hits)) if hits else None
+    miss = float(np.median(misses)) if misses else None
+    return {
+        "hit_p50": hit,
+        "miss_p50": miss,
+        "saved_p50": miss - hit if hit is not None and miss is not None else None
+    }
+
+
+def summarize_usage(usages: Iterable[CallUsage]) -> Dict[str, Any]:
+    """Totals and latency percentiles of a group of question usages.
+
+    Latency percentiles are over API requests only: response cache hits and batch output
+    (without timing) are left out. A batched request's latency is reassembled from its shares.
+    prefix_cache_latency compares the median latency of requests with and without cached prompt tokens.
+    """
+    totals = defaultdict(float)
+    latencies, queue_waits = [], []
+    prefix_latencies = {True: [], False: []}  # by whether the provider served part of the prompt from its cache
+    for usage in usages:
+        for key in ("requests", "prompt_tokens", "completion_tokens", "cached_tokens"):
+            totals[key] += usage[key]
+        totals["cost"] += usage.get("cost") or 0.0
+        if usage["from_cache"]:
+            totals["response_cache_hits"] += usage["requests"]
+            continue
+        # Only requests that reached the provider count towards its prefix cache hit rate
+        totals["fresh_prompt_tokens"] += usage["prompt_tokens"]
+        totals["fresh_cached_tokens"] += usage["cached_tokens"]
+        if usage.get("latency") is not None:
+            latencies.append(usage["latency"] / usage["requests"])
+            queue_waits.append(usage["queue_wait"] / usage["requests"])
+            prefix_latencies[usage["cached_tokens"] > 0].append(latencies[-1])
+
+    fresh_prompt_tokens = totals["fresh_prompt_tokens"]
+    return {
+        "requests": round(totals["requests"]),
+        "response_cache_hits": round(totals["response_cache_hits"]),
+        "prompt_tokens": round(totals["prompt_tokens"]),
+        "completion_tokens": round(totals["completion_tokens"]),
+        "cached_tokens": round(totals["cached_tokens"]),
+        "prefix_cache_hit_rate": totals["fresh_cached_tokens"] / fresh_prompt_tokens if fresh_prompt_tokens else 0.0,
+        "cost": totals["cost"],
+        "latency": percentiles(latencies),
+        "prefix_cache_latency": prefix_cache_latency(prefix_latencies[True], prefix_latencies[False]),
+        "queue_wait": percentiles(queue_waits)
+    }
+
+
+def run_summary(text_evals: Iterable[TextEval], wall_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run-level usage summary: per model and in total, with latency percentiles per model."""
+    by_model = defaultdict(list)
+    for usage in iter_question_usage(text_evals):
+        by_model[usage["model"]].append(usage)
+
+    return {
+        "wall_time": wall_time,
+        "models": {model: summarize_usage(usages) for model, usages in by_model.items()},
+        "total": summarize_usage(usage for usages in by_model.values() for usage in usages)
+    }
+
+
+def print_run_summary(summary: Dict[str, Any]) -> None:
+    """Prints one line per model with requests, tokens, prefix cache savings, cost and latency percentiles."""
+    if summary["wall_time"] is not None:
+        print(f"Run finished in {summary['wall_time']:.1f}s")
+
+    for model, stats in list(summary["models"].items()) + [("total", summary["total"])]:
+        latency = stats["latency"]
+        latency_text = (
+            " ".join(f"{p}={v * 1000:.0f}ms" for p, v in latency.items())
+            if latency["p50"] is not None else "n/a"
+        )
+        saved = stats["prefix_cache_latency"]["saved_p50"]
+        saved_text = f" (saves {saved * 1000:.0f}ms p50)" if saved is not None else ""
+        print(
+            f"{model}: {stats['requests']} requests ({stats['response_cache_hits']} cached), "
+            f"{stats['prompt_tokens']} prompt / {stats['completion_tokens']} completion tokens, "
+            f"prefix cache {stats['prefix_cache_hit_rate']:.0%}{saved_text}, ${stats['cost']:.4f}, latency {latency_text}"
+        )
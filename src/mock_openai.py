@@ -0,0 +1,359 @@
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Prompt caching as the provider does it: prefixes of at least 1024 tokens, in steps of 128 tokens
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_BLOCK_TOKENS = 128
+CHARS_PER_TOKEN = 4
+
+
+def _pseudo_probability(*parts: str) -> float:
+    """Deterministic probability in (0, 1) derived from the request, so reruns give identical answers."""
+    digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+    return (int(digest[:8], 16) % 998 + 1) / 1000
+
+
+def _token(token: str, alternatives: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    alternatives = alternatives or {token: 0.0}
+    return {
+        "token": token,
+        "logprob": alternatives.get(token, 0.0),
+        "bytes": list(token.encode("utf-8")),
+        "top_logprobs": [
+            {"token": t, "logprob": lp, "bytes": list(t.encode("utf-8"))} for t, lp in alternatives.items()
+        ]
+    }
+
+
+def _answer_alternatives(probability: float, capitalize: bool) -> Dict[str, float]:
+    true_token, false_token = ("True", "False") if capitalize else ("true", "false")
+    return {true_token: math.log(probability), false_token: math.log(1 - probability)}
+
+
+def prompt_text(body: Dict[str, Any]) -> str:
+    return "".join(m["content"] for m in body["messages"])
+
+
+def fake_completion(body: Dict[str, Any], cached_tokens: int = 0) -> Dict[str, Any]:
+    """Builds a chat completion with logprobs for a request body.
+
+    Single questions are answered with one True/False token. Requests with a json_schema
+    response format get a JSON object with one true/false slot per schema property.
+    """
+    model = body["model"]
+    prompt = json.dumps(body["messages"], sort_keys=True)
+    top_n = body.get("top_logprobs") or 0
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        labels = list(response_format["json_schema"]["schema"]["properties"])
+        content = [_token('{"')]
+        for i, label in enumerate(labels):
+            alternatives = _answer_alternatives(_pseudo_probability(model, prompt, label), capitalize=False)
+            answer = max(alternatives, key=alternatives.get)
+            content += [_token(label), _token('":'), _token(answer, alternatives)]
+            content.append(_token(',"' if i < len(labels) - 1 else "}"))
+    else:
+        alternatives = _answer_alternatives(_pseudo_probability(model, prompt), capitalize=True)
+        content = [_token(max(alternatives, key=alternatives.get), alternatives)]
+
+    max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+    if max_tokens:
+        content = content[:max_tokens]
+
+    for token in content:
+        token["top_logprobs"] = token["top_logprobs"][:top_n]
+
+    prompt_tokens = len(prompt_text(body)) // CHARS_PER_TOKEN
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "".join(t["token"] for t in content)},
+            "logprobs": {"content": content} if body.get("logprobs") else None
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+    }
+
+
+class MockBehaviour:
+    """Latency and failures of the simulated chat completions endpoint.
+
+    Latency is drawn from a log-normal distribution around `latency_median` seconds (sigma 0
+    makes it fixed). A request fails with a 500 with probability `error_rate` and is rejected
+    with a 429 and a Retry-After header with probability `rate_limit_rate`.
+    """
+
+    def __init__(
+            self,
+            latency_median: float = 0.0,
+            latency_sigma: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            retry_after: float = 0.1,
+            seed: Optional[int] = None
+            ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> Tuple[float, int]:
+        """Returns (latency in seconds, status code) for the next request."""
+        with self._lock:
+            latency = self._random.lognormvariate(math.log(self.latency_median), self.latency_sigma) if self.latency_median > 0 else 0.0
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return latency, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, 200
+
+
+class MockState:
+    """Files, batches and request counters held in memory by the mock server."""
+
+    def __init__(self, behaviour: Optional[MockBehaviour] = None):
+        self.behaviour = behaviour or MockBehaviour()
+        self.counters: Dict[str, int] = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.file_contents: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.prefixes: Set[str] = set()  # hashes of prompt prefixes seen so far
+        self.lock = threading.Lock()
+
+    def cached_prompt_tokens(self, body: Dict[str, Any]) -> int:
+        """Simulates provider-side prompt caching: the length of the longest already seen prompt prefix.
+
+        Prefixes are tracked in blocks of PREFIX_CACHE_BLOCK_TOKENS and only count from
+        PREFIX_CACHE_MIN_TOKENS on. Every block of this prompt is remembered for later requests.
+        """
+        text = body["model"] + "\x1f" + prompt_text(body)
+        block_chars = PREFIX_CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+        min_chars = PREFIX_CACHE_MIN_TOKENS * CHARS_PER_TOKEN
+
+        hasher = hashlib.sha256()
+        cached_chars = 0
+        with self.lock:
+            for end in range(block_chars, len(text) + 1, block_chars):
+                hasher.update(text[end - block_chars:end].encode("utf-8"))
+                digest = hasher.copy().hexdigest()
+                if digest in self.prefixes:
+                    cached_chars = end
+                else:
+                    self.prefixes.add(digest)
+
+        return cached_chars // CHARS_PER_TOKEN if cached_chars >= min_chars else 0
+
+    def count(self, status: int) -> None:
+        key = {200: "ok", 429: "rate_limited"}.get(status, "errors")
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters[key] += 1
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_obj = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed"
+        }
+        with self.lock:
+            self.files[file_obj["id"]] = file_obj
+            self.file_contents[file_obj["id"]] = content
+        return file_obj
+
+    def run_batch(self, batch_id: str) -> None:
+        """Answers every request of a batch input file and writes the output file."""
+        batch = self.batches[batch_id]
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+
+        lines = [json.loads(line) for line in self.file_contents[batch["input_file_id"]].decode("utf-8").splitlines() if line.strip()]
+        output = []
+        for line in lines:
+            output.append({
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(line["body"], self.cached_prompt_tokens(line["body"]))},
+                "error": None
+            })
+
+        output_file = self.add_file("\n".join(json.dumps(o) for o in output).encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output")
+        batch.update({
+            "status": "completed",
+            "output_file_id": output_file["id"],
+            "completed_at": int(time.time()),
+            "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0}
+        })
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately; Nagle would delay the body ~40ms
+    state: MockState = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass  # keep the console quiet
+
+    def _send_json(self, data: Dict[str, Any], status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_bytes(json.dumps(data).encode("utf-8"), "application/json", status, headers)
+
+    def _send_bytes(self, data: bytes, content_type: str, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chat_completion(self, request: Dict[str, Any]) -> None:
+        """Answers a chat completion after the simulated latency, or fails it as the behaviour dictates."""
+        latency, status = self.state.behaviour.draw()
+        time.sleep(latency)
+        self.state.count(status)
+
+        if status == 429:
+            error = {"message": "Rate limit reached (simulated)", "type": "requests", "code": "rate_limit_exceeded"}
+            self._send_json({"error": error}, 429, {"Retry-After": str(self.state.behaviour.retry_after)})
+        elif status != 200:
+            self._send_json({"error": {"message": "Internal server error (simulated)", "type": "server_error"}}, status)
+        else:
+            self._send_json(fake_completion(request, self.state.cached_prompt_tokens(request)))
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _not_found(self) -> None:
+        self._send_json({"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}}, 404)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        body = self._read_body()
+
+        if path.endswith("/chat/completions"):
+            self._chat_completion(json.loads(body))
+
+        elif path.endswith("/files"):
+            # Multipart upload: parse it as a MIME message
+            message = BytesParser(policy=default_policy).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            purpose = fields["purpose"].get_content().strip()
+            self._send_json(self.state.add_file(upload.get_payload(decode=True), upload.get_filename() or "upload.jsonl", purpose))
+
+        elif path.endswith("/batches"):
+            request = json.loads(body)
+            batch = {
+                "id": f"batch_{uuid.uuid4().hex[:24]}",
+                "object": "batch",
+                "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"],
+                "status": "validating",
+                "created_at": int(time.time()),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}
+            }
+            self.state.batches[batch["id"]] = batch
+            threading.Thread(target=self.state.run_batch, args=(batch["id"],), daemon=True).start()
+            self._send_json(batch)
+
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match and match.group(1) in self.state.file_contents:
+            self._send_bytes(self.state.file_contents[match.group(1)], "application/octet-stream")
+            return
+
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match and match.group(1) in self.state.batches:
+            self._send_json(self.state.batches[match.group(1)])
+            return
+
+        self._not_found()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 drops connections under concurrent load
+    state: MockState = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}/v1"
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8000, behaviour: Optional[MockBehaviour] = None) -> MockServer:
+    """Creates (but does not start) a mock server. Use port=0 to pick a free port."""
+    state = MockState(behaviour)
+    handler = type("Handler", (MockOpenAIHandler,), {"state": state})
+    server = MockServer((host, port), handler)
+    server.state = state
+    return server
+
+
+def start_in_background(host: str = "127.0.0.1", port: int = 0, behaviour: Optional[MockBehaviour] = None) -> MockServer:
+    """Starts a mock server on a daemon thread. The base url is server.base_url."""
+    server = make_server(host, port, behaviour)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions, files and batches endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="median latency of a chat completion in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="log-normal spread of the latency (0 = fixed)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of chat completions failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of chat completions rejected with a 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    behaviour = MockBehaviour(args.latency, args.latency_sigma, args.error_rate, args.rate_limit_rate, args.retry_after, args.seed)
+    server = make_server(args.host, args.port, behaviour)
+    print(f"Mock OpenAI server listening on http://{args.host}:{server.server_port}/v1")
+    print("Point the pipeline at it with OPENAI_BASE_URL and any OPENAI_API_KEY")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
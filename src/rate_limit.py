@@ -0,0 +1,175 @@
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Dict, Optional
+
+import openai
+
+from config.config import MODEL_RATE_LIMITS, MAX_RETRIES, BACKOFF_BASE, BACKOFF_MAX, EXPECTED_COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills continuously up to its capacity.
+
+    reserve() takes the requested amount right away, possibly driving the bucket into debt,
+    and returns how long the caller has to wait before the debt is paid off. Reserving
+    up front keeps concurrent callers in a fair first-come, first-served order and works
+    the same for threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` from the bucket and returns the number of seconds to wait."""
+        amount = min(amount, self.capacity)  # a single oversized request must still fit eventually
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= amount
+            return max(0.0, -self._level / self.refill_per_second)
+
+    def refund(self, amount: float) -> None:
+        """Gives back (or, with a negative amount, takes) tokens after the real cost is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level + amount)
+
+
+class ModelRateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one model."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.requests = TokenBucket(rpm, rpm / 60) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm else None
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Reserves one request and the estimated tokens. Returns the number of seconds to wait."""
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Corrects the token bucket once the usage of a response is known."""
+        if self.tokens and actual_tokens is not None:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+
+_limiters: Dict[str, Optional[ModelRateLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> Optional[ModelRateLimiter]:
+    """Returns the process-wide limiter for a model, or None if MODEL_RATE_LIMITS has no entry for it."""
+    with _limiters_lock:
+        if model not in _limiters:
+            limits = MODEL_RATE_LIMITS.get(model)
+            _limiters[model] = ModelRateLimiter(limits.get("rpm"), limits.get("tpm")) if limits else None
+        return _limiters[model]
+
+
+def estimate_tokens(params: Dict[str, Any]) -> int:
+    """Rough token estimate of a request: ~4 characters per prompt token plus the expected answer."""
+    prompt_chars = sum(len(message["content"]) for message in params["messages"])
+    completion = params.get("max_completion_tokens") or params.get("max_tokens") or EXPECTED_COMPLETION_TOKENS
+    return prompt_chars // 4 + completion
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):  # includes APITimeoutError
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Exponential backoff with full jitter. A Retry-After header from the server takes precedence."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date format, fall back to backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage else None
+
+
+def create_with_retries(client, params: Dict[str, Any], timing: Optional[Dict[str, float]] = None):
+    """Sends a chat completion paced by the model's rate limits, retrying 429/5xx with backoff.
+
+    The tokens reserved for a failed attempt are refunded. If a timing dict is given it receives
+    the latency of the successful attempt and the time spent waiting before it (pacing, backoff
+    and failed attempts).
+    """
+    limiter = get_rate_limiter(params["model"])
+    estimated = estimate_tokens(params)
+    start = time.perf_counter()
+
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter:
+            time.sleep(limiter.reserve(estimated))
+        sent = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**params)
+        except Exception as e:
+            if limiter:
+                limiter.settle(estimated, 0)  # a failed attempt uses no tokens; keep the bucket for real usage
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"Retrying {params['model']} in {delay:.1f}s after {type(e).__name__} (attempt {attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
+            continue
+
+        if timing is not None:
+            timing["latency"] = time.perf_counter() - sent
+            timing["waited"] = sent - start
+        if limiter:
+            limiter.settle(estimated, _usage_tokens(response))
+        return response
+
+
+async def acreate_with_retries(client, params: Dict[str, Any], timing: Optional[Dict[str, float]] = None):
+    """Async counterpart of create_with_retries for an AsyncOpenAI client."""
+    limiter = get_rate_limiter(params["model"])
+    estimated = estimate_tokens(params)
+    start = time.perf_counter()
+
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter:
+            await asyncio.sleep(limiter.reserve(estimated))
+        sent = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(**params)
+        except Exception as e:
+            if limiter:
+                limiter.settle(estimated, 0)  # a failed attempt uses no tokens; keep the bucket for real usage
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"Retrying {params['model']} in {delay:.1f}s after {type(e).__name__} (attempt {attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+            continue
+
+        if timing is not None:
+            timing["latency"] = time.perf_counter() - sent
+            timing["waited"] = sent - start
+        if limiter:
+            limiter.settle(estimated, _usage_tokens(response))
+        return response
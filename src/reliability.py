@@ -0,0 +1,288 @@
+import json
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config.config import RELIABILITY_CATEGORIES
+from src.checkpoint import setup_hash
+from src.compare_scores import load_model_scores
+
+QUESTION_KEYS = ["label", "concept", "question"]  # question labels are only unique within a concept
+DISAGREEMENT_KEYS = ["model", "concept", "dimension", "question"]
+REPORT_COLUMNS = ["model", "n", "agreement", "mean_abs_diff", "cohen_kappa", "linear_kappa", "quadratic_kappa",
+                  "alpha_nominal", "alpha_ordinal", "alpha_interval"]
+
+
+def question_rows(scores: pd.DataFrame) -> pd.DataFrame:
+    """The question rows of a frame like extract_all_model_scores makes."""
+    return scores[scores["question"].notna() & (scores["question"] != "")]
+
+
+def align_scores(human_scores: pd.DataFrame, model_scores: pd.DataFrame, rater: Optional[str] = None) -> pd.DataFrame:
+    """Pairs every model question score with the human score of the same text, concept and question label.
+
+    Both frames are like extract_all_model_scores makes them, e.g. load_model_scores of
+    validation_data.json and model_eval_data.json. The human frame holds one rater (load_eval_data
+    stores the sheet ratings under one model name); pick one with `rater` if it holds more.
+    Questions without a score on either side are left out.
+    """
+    human = question_rows(human_scores)
+    if rater is not None:
+        human = human[human["model"] == rater]
+    elif human["model"].nunique() > 1:
+        raise ValueError(f"The human scores hold several raters {list(human['model'].unique())}, pick one with rater=")
+    human = (human[QUESTION_KEYS + ["dimension", "score"]].astype({key: object for key in QUESTION_KEYS})
+             .drop_duplicates(QUESTION_KEYS).rename(columns={"score": "human"}))
+    models = question_rows(model_scores)[QUESTION_KEYS + ["model", "score"]].astype({key: object for key in QUESTION_KEYS})
+    aligned = models.merge(human, on=QUESTION_KEYS, how="inner").dropna(subset=["human", "score"])
+    return aligned[["label", "concept", "dimension", "question", "model", "human", "score"]].reset_index(drop=True)
+
+
+def rating_categories(scores, categories: int = RELIABILITY_CATEGORIES) -> np.ndarray:
+    """Scores in [0, 1] as rating categories 0 .. categories - 1 (the human 1-5 scale is 0, 0.25, .. 1)."""
+    return np.clip(np.rint(np.asarray(scores, dtype=float) * (categories - 1)), 0, categories - 1).astype(np.intp)
+
+
+def disagreement_weights(categories: int, metric: str, marginals: Optional[np.ndarray] = None) -> np.ndarray:
+    """Squared-distance matrix between rating categories for a kappa or alpha metric.
+
+    nominal: 0 on the diagonal, 1 elsewhere; linear: |c - k| / (K - 1); interval (quadratic):
+    ((c - k) / (K - 1))^2; ordinal: Krippendorff's rank-based distance, which needs the category
+    marginals (one row per model).
+    """
+    c, k = np.indices((categories, categories))
+    if metric == "nominal":
+        return (c != k).astype(float)
+    if metric == "linear":
+        return np.abs(c - k) / (categories - 1)
+    if metric in ("quadratic", "interval"):
+        return ((c - k) / (categories - 1)) ** 2
+    if metric == "ordinal":
+        cumulative = np.cumsum(marginals, axis=-1)
+        low, high = np.minimum(c, k), np.maximum(c, k)
+        between = np.take(cumulative, high, axis=-1) - np.take(cumulative, low, axis=-1) + np.take(marginals, low, axis=-1)
+        return (between - (np.take(marginals, c, axis=-1) + np.take(marginals, k, axis=-1)) / 2) ** 2
+    raise ValueError(f"Unknown metric {metric!r}")
+
+
+def cohen_kappa(confusion: np.ndarray, weights: Optional[str] = None) -> np.ndarray:
+    """Cohen's kappa of confusion matrices (..., K, K), unweighted or with 'linear' or 'quadratic' weights."""
+    categories = confusion.shape[-1]
+    n = confusion.sum(axis=(-2, -1))
+    expected = confusion.sum(axis=-1)[..., :, None] * confusion.sum(axis=-2)[..., None, :] / n[..., None, None]
+    w = disagreement_weights(categories, weights or "nominal")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 1 - (w * confusion).sum(axis=(-2, -1)) / (w * expected).sum(axis=(-2, -1))
+
+
+def coincidence_alpha(coincidence: np.ndarray, metric: str = "nominal") -> np.ndarray:
+    """Krippendorff's alpha of coincidence matrices (..., K, K) for a nominal, ordinal or interval metric."""
+    categories = coincidence.shape[-1]
+    marginals = coincidence.sum(axis=-1)
+    n = marginals.sum(axis=-1)
+    delta = disagreement_weights(categories, metric, marginals)
+    observed = (coincidence * delta).sum(axis=(-2, -1))
+    expected = (marginals[..., :, None] * marginals[..., None, :] * delta).sum(axis=(-2, -1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 1 - (n - 1) * observed / expected
+
+
+def krippendorff_alpha(ratings, metric: str = "interval", categories: int = RELIABILITY_CATEGORIES) -> float:
+    """Krippendorff's alpha of a units x raters matrix of scores in [0, 1], NaN where a rater gave none.
+
+    Any number of raters, e.g. the human and all models at once. The interval metric uses the
+    scores as they are; nominal and ordinal use their rating categories. Units with fewer than
+    two ratings are not pairable and are left out.
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    present = ~np.isnan(ratings)
+    values = present.sum(axis=1)
+    ratings, present, values = ratings[values > 1], present[values > 1], values[values > 1]
+    if metric == "interval":
+        n = values.sum()
+        filled = np.where(present, ratings, 0.0)
+        sums, squares = filled.sum(axis=1), (filled ** 2).sum(axis=1)
+        observed = (2 * (values * squares - sums ** 2) / (values - 1)).sum() / n
+        expected = 2 * (n * squares.sum() - sums.sum() ** 2) / (n * (n - 1))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return float(1 - observed / expected)
+
+    counts = np.zeros((len(ratings), categories))
+    units, raters = np.nonzero(present)
+    np.add.at(counts, (units, rating_categories(ratings[units, raters], categories)), 1)
+    # Coincidences within every unit: pairs of values from different raters, weighted by 1 / (m - 1)
+    scaled = counts / (values - 1)[:, None]
+    coincidence = scaled.T @ counts - np.diag(scaled.sum(axis=0))
+    return float(coincidence_alpha(coincidence, metric))
+
+
+class ReliabilityTracker:
+    """Agreement statistics of models with the human ratings, updated run by run.
+
+    Everything kept is additive: per model a confusion matrix of human x model rating categories,
+    the moments the interval alpha needs, and per question the number of pairs, summed absolute
+    difference and exact agreements. Adding a run only computes these for its new pairs; kappas,
+    alphas and disagreement rankings are derived from the totals. A (text, concept, question) that
+    was already counted for a model is skipped, so re-adding a run does not count it twice.
+
+    Pass the `setup` of a run (the setup_hash of its manifest, see run_setup) to keep scores of a
+    model under another prompt or scoring mode apart: they are tracked as "model [setup]". Without
+    it a re-run of a model under the same name is taken for the run that was already counted.
+    """
+
+    def __init__(self, categories: int = RELIABILITY_CATEGORIES):
+        self.categories = categories
+        self.models: List[str] = []
+        self.confusion = np.zeros((0, categories, categories))
+        self.moments = np.zeros((0, 4))  # per model: values (two per pair), their sum and sum of squares, summed squared differences
+        self.abs_diff = np.zeros(0)
+        self.questions = pd.DataFrame(columns=["n", "abs_diff", "agree"],
+                                      index=pd.MultiIndex.from_tuples([], names=DISAGREEMENT_KEYS))
+        self.seen: Dict[str, np.ndarray] = {}  # sorted hashes of the (text, concept, question) keys counted per model
+
+    def update(self, aligned: pd.DataFrame, setup: Optional[str] = None) -> "ReliabilityTracker":
+        """Adds the pairs of an align_scores frame that were not counted before, for models under `setup`."""
+        if setup is not None:
+            aligned = aligned.assign(model=aligned["model"].astype(str) + f" [{setup}]")
+        hashes = pd.util.hash_pandas_object(aligned[QUESTION_KEYS], index=False).to_numpy()
+        new = np.ones(len(aligned), dtype=bool)
+        for model, positions in aligned.groupby("model", observed=True, sort=False).indices.items():
+            seen = self.seen.get(model, np.empty(0, dtype=np.uint64))
+            model_hashes, first = np.unique(hashes[positions], return_index=True)
+            fresh = ~np.isin(model_hashes, seen, assume_unique=True)
+            new[positions] = False
+            new[positions[first[fresh]]] = True
+            self.seen[model] = np.union1d(seen, model_hashes)
+        aligned = aligned[new]
+        if aligned.empty:
+            return self
+
+        for model in aligned["model"].unique():
+            if model not in self.models:
+                self.models.append(model)
+                self.confusion = np.concatenate([self.confusion, np.zeros((1, self.categories, self.categories))])
+                self.moments = np.concatenate([self.moments, np.zeros((1, 4))])
+                self.abs_diff = np.append(self.abs_diff, 0.0)
+
+        # One bincount gives the confusion matrices of all models
+        index = pd.Index(self.models).get_indexer(aligned["model"])
+        human, score = aligned["human"].to_numpy(dtype=float), aligned["score"].to_numpy(dtype=float)
+        human_category, model_category = rating_categories(human, self.categories), rating_categories(score, self.categories)
+        cells = (index * self.categories + human_category) * self.categories + model_category
+        size = len(self.models) * self.categories ** 2
+        self.confusion += np.bincount(cells, minlength=size).reshape(self.confusion.shape)
+
+        difference = score - human
+        for column, values in enumerate((np.full(len(score), 2.0), human + score, human ** 2 + score ** 2, difference ** 2)):
+            self.moments[:, column] += np.bincount(index, weights=values, minlength=len(self.models))
+        self.abs_diff += np.bincount(index, weights=np.abs(difference), minlength=len(self.models))
+
+        per_question = aligned.astype({key: str for key in DISAGREEMENT_KEYS})
+        per_question = per_question.assign(n=1, abs_diff=np.abs(difference), agree=human_category == model_category)
+        per_question = per_question.groupby(DISAGREEMENT_KEYS, observed=True)[["n", "abs_diff", "agree"]].sum()
+        self.questions = self.questions.add(per_question, fill_value=0)
+        return self
+
+    def report(self) -> pd.DataFrame:
+        """Per model: pairs, exact agreement, mean absolute difference, kappas and Krippendorff's alphas."""
+        n = self.confusion.sum(axis=(1, 2))
+        coincidence = self.confusion + self.confusion.transpose(0, 2, 1)
+        values, sums, squares, squared_differences = self.moments.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # Two values per pair: D_o = 2 * sum of squared differences / values, D_e from the pooled moments
+            alpha_interval = 1 - (2 * squared_differences / values) / (2 * (values * squares - sums ** 2) / (values * (values - 1)))
+            agreement = np.trace(self.confusion, axis1=1, axis2=2) / n
+            mean_abs_diff = self.abs_diff / n
+        return pd.DataFrame({
+            "model": self.models,
+            "n": n.astype(int),
+            "agreement": agreement,
+            "mean_abs_diff": mean_abs_diff,
+            "cohen_kappa": cohen_kappa(self.confusion),
+            "linear_kappa": cohen_kappa(self.confusion, "linear"),
+            "quadratic_kappa": cohen_kappa(self.confusion, "quadratic"),
+            "alpha_nominal": coincidence_alpha(coincidence, "nominal"),
+            "alpha_ordinal": coincidence_alpha(coincidence, "ordinal"),
+            "alpha_interval": alpha_interval
+        }, columns=REPORT_COLUMNS)
+
+    def question_disagreements(self, per_model: bool = False) -> pd.DataFrame:
+        """Questions ranked by mean absolute difference between human and model scores, largest first.
+
+        Over all models by default; per_model=True ranks every (model, question) separately.
+        """
+        questions = self.questions if per_model else self.questions.groupby(DISAGREEMENT_KEYS[1:]).sum()
+        ranking = pd.DataFrame({
+            "n": questions["n"].astype(int),
+            "mean_abs_diff": questions["abs_diff"] / questions["n"],
+            "agreement": questions["agree"] / questions["n"]
+        })
+        return ranking.sort_values("mean_abs_diff", ascending=False, kind="stable").reset_index()
+
+    def save(self, path: str) -> None:
+        """Writes the statistics to a JSON file, to be continued with ReliabilityTracker.load."""
+        state = {
+            "categories": self.categories,
+            "models": self.models,
+            "confusion": self.confusion.tolist(),
+            "moments": self.moments.tolist(),
+            "abs_diff": self.abs_diff.tolist(),
+            "questions": self.questions.reset_index().to_dict(orient="records"),
+            "seen": {model: hashes.tolist() for model, hashes in self.seen.items()}
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path: str) -> "ReliabilityTracker":
+        """Reads the statistics written by save."""
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        tracker = cls(state["categories"])
+        tracker.models = state["models"]
+        tracker.confusion = np.array(state["confusion"], dtype=float).reshape(-1, tracker.categories, tracker.categories)
+        tracker.moments = np.array(state["moments"], dtype=float).reshape(-1, 4)
+        tracker.abs_diff = np.array(state["abs_diff"], dtype=float)
+        if state["questions"]:
+            tracker.questions = pd.DataFrame(state["questions"]).set_index(DISAGREEMENT_KEYS)
+        tracker.seen = {model: np.array(hashes, dtype=np.uint64) for model, hashes in state["seen"].items()}
+        return tracker
+
+
+def run_setup(results_path: str) -> Optional[str]:
+    """setup_hash of the manifest next to a results file (JSON, JSONL or Parquet), None if it has none."""
+    path = Path(results_path)
+    manifest_path = path.with_name(path.name.split(".")[0] + ".manifest.json")
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        settings = json.load(f).get("settings")
+    return setup_hash(settings) if settings else None
+
+
+def reliability_report(aligned: pd.DataFrame, categories: int = RELIABILITY_CATEGORIES) -> pd.DataFrame:
+    """ReliabilityTracker.report for the pairs of one align_scores frame."""
+    return ReliabilityTracker(categories).update(aligned).report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agreement of the model scores with the human ratings")
+    parser.add_argument("human", help="Results file with the human ratings, e.g. evaluation_results/validation_data.json")
+    parser.add_argument("models", nargs="+", help="Results files with model scores")
+    parser.add_argument("--rater", help="Model name of the human ratings, if the human file holds several")
+    parser.add_argument("--state", help="JSON file with the statistics of earlier runs, updated with these runs")
+    args = parser.parse_args()
+
+    human_scores = load_model_scores(args.human)
+    tracker = ReliabilityTracker.load(args.state) if args.state and Path(args.state).exists() else ReliabilityTracker()
+    for path in args.models:
+        tracker.update(align_scores(human_scores, load_model_scores(path), args.rater), run_setup(path))
+    if args.state:
+        tracker.save(args.state)
+
+    print(tracker.report().to_string(index=False))
+    print("\nQuestions with the largest disagreement")
+    print(tracker.question_disagreements().head(20).to_string(index=False))
@@ -0,0 +1,221 @@
+import copy
+import json
+import time
+import argparse
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+from src.concepts import TextEval, Concept
+from src.aggregation import ScoreTensor, aggregate, apply_aggregates
+from src.evaluation import answer_token
+from src.result_writer import iter_latest_text_evals
+
+TRUE_TOKENS = ("true",)
+FALSE_TOKENS = ("false",)
+
+
+class DistributionTensor:
+    """The stored top logprob distributions of a run as dense arrays, for fast offline re-scoring.
+
+    `token_ids` and `logprobs` have shape (texts, models, concepts, dimensions, questions, k).
+    Tokens are normalized with answer_token and numbered in `vocabulary`; -1 / NaN mark padding and questions
+    without a stored distribution.
+    """
+
+    def __init__(self, text_evals: List[TextEval]):
+        self.text_evals = text_evals
+        self.labels = [t["label"] for t in text_evals]
+        self.models = list(dict.fromkeys(m for t in text_evals for m in t["evaluations"]))
+        self.concepts = text_evals[0]["concepts"]
+        tensor = ScoreTensor(self.labels, self.models, self.concepts)
+
+        k = max(
+            (len(q["top_logprobs"]["tokens"]) for q in self._questions() if q.get("top_logprobs")),
+            default=1
+        )
+        shape = tensor.scores.shape + (k,)
+        self.token_ids = np.full(shape, -1, dtype=np.int32)
+        self.logprobs = np.full(shape, np.nan)
+        self.missing = 0  # questions without a stored distribution
+
+        vocabulary: Dict[str, int] = {}
+        model_positions = {model: m for m, model in enumerate(self.models)}
+        for t, text_eval in enumerate(text_evals):
+            for model, model_eval in text_eval["evaluations"].items():
+                if model_eval is None:
+                    continue
+                m = model_positions[model]
+                for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                    for d, dimension_eval in enumerate(concept_eval["dimensions"]):
+                        for q, question_eval in enumerate(dimension_eval["questions"]):
+                            distribution = question_eval.get("top_logprobs")
+                            if not distribution:
+                                self.missing += 1
+                                continue
+                            n = len(distribution["tokens"])
+                            self.token_ids[t, m, c, d, q, :n] = [
+                                vocabulary.setdefault(answer_token(token), len(vocabulary)) for token in distribution["tokens"]
+                            ]
+                            self.logprobs[t, m, c, d, q, :n] = distribution["logprobs"]
+
+        self.vocabulary = list(vocabulary)
+
+    def _questions(self) -> Iterable[dict]:
+        for text_eval in self.text_evals:
+            for model_eval in text_eval["evaluations"].values():
+                if model_eval is None:
+                    continue
+                for concept_eval in model_eval["concepts_scores"]:
+                    for dimension_eval in concept_eval["dimensions"]:
+                        yield from dimension_eval["questions"]
+
+    def answer_probabilities(self, tokens: Iterable[str]) -> np.ndarray:
+        """Probability of the most likely of `tokens` for every question, NaN if none of them is in the top k."""
+        tokens = set(tokens)
+        wanted = np.array([token in tokens for token in self.vocabulary] or [False])
+        matches = (self.token_ids >= 0) & wanted[np.maximum(self.token_ids, 0)]
+        with np.errstate(invalid="ignore"):
+            best = np.where(matches, self.logprobs, -np.inf).max(axis=-1)
+        return np.where(np.isneginf(best), np.nan, np.exp(best))
+
+
+def positive_mask(concepts: List[Concept], shape: tuple) -> np.ndarray:
+    """positive_contribution of every (concept, dimension, question) position, padded with True."""
+    positive = np.ones(shape, dtype=bool)
+    for c, concept in enumerate(concepts):
+        for d, dimension in enumerate(concept["dimensions"]):
+            for q, question in enumerate(dimension["questions"]):
+                positive[c, d, q] = question["positive_contribution"]
+    return positive
+
+
+def renormalize(p_true: np.ndarray, p_false: np.ndarray) -> tuple:
+    """The True/False pair scaled to sum to one, as score_constrained does. A missing token counts as zero."""
+    p_true, p_false = np.nan_to_num(p_true), np.nan_to_num(p_false)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        total = p_true + p_false
+        return p_true / total, p_false / total  # NaN where neither token was seen
+
+
+def question_scores(
+        p_true: np.ndarray,
+        p_false: np.ndarray,
+        positive: np.ndarray,
+        threshold: Optional[float] = None
+        ) -> np.ndarray:
+    """Question scores from answer probabilities, with the same rules as score_question / score_constrained.
+
+    P(True) for a positive question, 1 - P(False) for a negative one; missing tokens give NaN.
+    For constrained runs pass the renormalized pair (see renormalize).
+    With a threshold the score becomes 1.0 or 0.0 depending on whether it reaches the threshold.
+    """
+    scores = np.where(positive, np.round(p_true, 3), 1 - np.round(p_false, 3))
+    if threshold is not None:
+        scores = np.where(np.isnan(scores), np.nan, (scores >= threshold).astype(float))
+    return scores
+
+
+def check_structure(old: List[Concept], new: List[Concept]) -> None:
+    """New concepts may change weights and positive_contribution, not which questions there are."""
+    def labels(concepts):
+        return [[[q["label"] for q in d["questions"]] for d in c["dimensions"]] for c in concepts]
+    if labels(old) != labels(new):
+        raise ValueError("Re-scoring needs the same concepts, dimensions and questions as the stored run")
+
+
+def rescore(
+        distributions: DistributionTensor,
+        concepts: Optional[List[Concept]] = None,
+        scoring_mode: Optional[str] = None,
+        true_tokens: Iterable[str] = TRUE_TOKENS,
+        false_tokens: Iterable[str] = FALSE_TOKENS,
+        threshold: Optional[float] = None
+        ) -> Dict[str, np.ndarray]:
+    """Re-scores a stored run without any API calls. Returns question scores and all aggregates as arrays.
+
+    `concepts` replaces the weights and positive_contribution flags of the run; scoring_mode
+    defaults to the mode the run was made with. Cheap enough to call in a loop over many schemes.
+    """
+    concepts = concepts or distributions.concepts
+    check_structure(distributions.concepts, concepts)
+    if scoring_mode is None:
+        parameters = distributions.text_evals[0]["metadata"].get("evaluation_parameters", {})
+        scoring_mode = parameters.get("scoring_mode", "first_token")
+
+    tensor = ScoreTensor(distributions.labels, distributions.models, concepts)
+    p_true = distributions.answer_probabilities(answer_token(t) for t in true_tokens)
+    p_false = distributions.answer_probabilities(answer_token(t) for t in false_tokens)
+    if scoring_mode == "constrained":
+        p_true, p_false = renormalize(p_true, p_false)
+    positive = positive_mask(concepts, tensor.present.shape)
+    tensor.scores = question_scores(p_true, p_false, positive, threshold)
+
+    return {"question": tensor.scores, "p_true": p_true, "p_false": p_false, **aggregate(tensor), "tensor": tensor}
+
+
+def rescored_text_evals(distributions: DistributionTensor, result: Dict[str, np.ndarray]) -> List[TextEval]:
+    """Builds new nested TextEvals from a re-score result; the stored run is left unchanged."""
+    tensor = result["tensor"]
+    text_evals = copy.deepcopy(distributions.text_evals)
+    scores, p_true, p_false = (result[k].tolist() for k in ("question", "p_true", "p_false"))
+
+    for t, text_eval in enumerate(text_evals):
+        text_eval["concepts"] = tensor.concepts
+        for m, model in enumerate(tensor.models):
+            model_eval = text_eval["evaluations"].get(model)
+            if model_eval is None:
+                continue
+            for c, (concept, concept_eval) in enumerate(zip(tensor.concepts, model_eval["concepts_scores"])):
+                concept_eval["weight"] = concept.get("weight", concept_eval["weight"])
+                for d, (dimension, dimension_eval) in enumerate(zip(concept["dimensions"], concept_eval["dimensions"])):
+                    dimension_eval["weight"] = dimension.get("weight", dimension_eval["weight"])
+                    for q, (question, question_eval) in enumerate(zip(dimension["questions"], dimension_eval["questions"])):
+                        score, pt, pf = scores[t][m][c][d][q], p_true[t][m][c][d][q], p_false[t][m][c][d][q]
+                        positive = question["positive_contribution"]
+                        probability = pt if positive else pf
+                        question_eval.update({
+                            "answer": None if np.isnan(pt) and np.isnan(pf) else ("True" if np.nan_to_num(pt) >= np.nan_to_num(pf) else "False"),
+                            "score": None if np.isnan(score) else score,
+                            "logprob": None if np.isnan(probability) or probability == 0 else float(np.log(probability)),
+                            "positive_contribution": positive
+                        })
+
+    apply_aggregates(text_evals, tensor, result)
+    return text_evals
+
+
+def load_text_evals(path: str) -> List[TextEval]:
+    """Reads a run from the nested JSON file or the streamed results JSONL file (the last record of every text)."""
+    if path.endswith(".jsonl"):
+        return list(iter_latest_text_evals(path))
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score a stored run from its logprob distributions, without API calls.")
+    parser.add_argument("results", help="model_eval_data.json or model_eval_data.jsonl of an earlier run")
+    parser.add_argument("--concepts", default=None, help="concept JSON with new weights / positive_contribution flags")
+    parser.add_argument("--scoring", choices=["first_token", "constrained"], default=None,
+                        help="scoring rule, defaults to the one the run was made with")
+    parser.add_argument("--true-tokens", default=",".join(TRUE_TOKENS), help="comma-separated tokens that mean True")
+    parser.add_argument("--false-tokens", default=",".join(FALSE_TOKENS), help="comma-separated tokens that mean False")
+    parser.add_argument("--threshold", type=float, default=None, help="turn question scores into 1/0 at this threshold")
+    parser.add_argument("--output", required=True, help="where to write the re-scored JSON")
+    args = parser.parse_args()
+
+    concepts = None
+    if args.concepts:
+        with open(args.concepts, "r") as f:
+            concepts = json.load(f)["concepts"]
+
+    distributions = DistributionTensor(load_text_evals(args.results))
+    if distributions.missing:
+        print(f"Warning: {distributions.missing} questions have no stored distribution and score as None")
+
+    start = time.perf_counter()
+    result = rescore(distributions, concepts, args.scoring, args.true_tokens.split(","), args.false_tokens.split(","), args.threshold)
+    print(f"Re-scored {len(distributions.labels)} texts in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump(rescored_text_evals(distributions, result), f, indent=4)
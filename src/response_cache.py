@@ -0,0 +1,178 @@
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from config.config import (
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL
+)
+
+EVICT_EVERY = 100  # run eviction after this many writes instead of on every put
+
+
+class ResponseCache:
+    """Persistent SQLite cache for raw chat completion logprob payloads.
+
+    Entries are keyed on the full request parameters (model, rendered messages, logprobs and
+    top_logprobs), so any change to a prompt template, text or model results in a miss.
+    The cache is bounded by entry count, total payload size and age; the least recently used
+    entries are evicted first.
+    """
+
+    def __init__(
+            self,
+            database_path: str = RESPONSE_CACHE_PATH,
+            max_entries: Optional[int] = RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes: Optional[int] = RESPONSE_CACHE_MAX_BYTES,
+            ttl_seconds: Optional[float] = RESPONSE_CACHE_TTL
+            ):
+        self.database_path = database_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()  # one connection is shared by all worker threads
+
+        self._conn = sqlite3.connect(database_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """Hashes the request parameters into a stable cache key."""
+        return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the cached payload for these request parameters, or None on a miss."""
+        key = self.make_key(params)
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT payload, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._is_expired(row[1], now):
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, params: Dict[str, Any], payload: Dict[str, Any]) -> None:
+        """Stores a response payload for these request parameters."""
+        key = self.make_key(params)
+        data = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, payload, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, params["model"], data, len(data), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self) -> int:
+        """Removes expired entries, then least recently used entries over the size limits."""
+        removed = 0
+        if self.ttl_seconds is not None:
+            removed += self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+
+        if self.max_entries is not None:
+            removed += self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,)).rowcount
+
+        if self.max_bytes is not None:
+            removed += self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS running_size FROM responses
+                    ) WHERE running_size > ?
+                )""", (self.max_bytes,)).rowcount
+
+        self._conn.commit()
+        return removed
+
+    def evict(self) -> int:
+        """Applies the TTL and size limits now. Returns the number of removed entries."""
+        with self._lock:
+            return self._evict()
+
+    def compact(self) -> int:
+        """Evicts, then rebuilds the database file to reclaim the freed space."""
+        with self._lock:
+            removed = self._evict()
+            self._conn.execute("VACUUM")
+        return removed
+
+    def clear(self) -> None:
+        """Removes every entry."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters for this process and the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.response_cache [stats|compact|clear] [database_path]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    cache = ResponseCache(sys.argv[2] if len(sys.argv) > 2 else RESPONSE_CACHE_PATH)
+
+    if command == "compact":
+        removed = cache.compact()
+        print(f"Removed {removed} entries")
+    elif command == "clear":
+        cache.clear()
+        cache.compact()
+        print("Cache cleared")
+    elif command != "stats":
+        print(f"Unknown command: {command}")
+        sys.exit(1)
+
+    print(cache.stats())
+    cache.close()
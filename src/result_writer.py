@@ -0,0 +1,137 @@
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.config import RESULT_FLUSH_EVERY
+from src.concepts import QuestionEval, TextEval
+from src.aggregation import iter_aggregated
+
+
+def _to_builtin(value):
+    """json.dumps fallback for numpy scalars in the evaluation results."""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _ends_with_newline(path: Path) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
+
+
+class JsonlResultWriter:
+    """Appends evaluation results to a JSONL file while a run is in progress.
+
+    Every finished question is written as a {"type": "question", ...} record and every finished
+    text as a {"type": "text", ...} record holding the full TextEval. Records are buffered and
+    written in batches of `flush_every`, so partial results can be read while the run goes on.
+    Use jsonl_to_json to turn the text records into the legacy nested JSON file.
+    """
+
+    def __init__(self, path: str, flush_every: int = RESULT_FLUSH_EVERY, append: bool = False):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+        if append and self._file.tell() and not _ends_with_newline(self.path):
+            self._file.write("\n")  # keep a half-written last line of a crashed run apart from the new records
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=_to_builtin)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+        self._file.flush()
+
+    def write_question(self, item: Dict[str, Any], question_eval: QuestionEval) -> None:
+        """Writes one finished question together with the work item it belongs to."""
+        self._write({"type": "question", **item, "result": question_eval})
+
+    def write_text(self, text_eval: TextEval) -> None:
+        """Writes one finished text and flushes, so completed texts are never lost."""
+        self._write({"type": "text", **text_eval})
+        self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_records(path: str, record_type: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yields the records of a results JSONL file one at a time, optionally of a single type.
+
+    A partially written last line (from a run that is still going or crashed) is skipped.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record_type is None or record.get("type") == record_type:
+                yield record
+
+
+def iter_text_evals(path: str) -> Iterator[TextEval]:
+    """Yields the finished TextEvals of a results JSONL file, without the record type."""
+    for record in iter_records(path, "text"):
+        record.pop("type")
+        yield record
+
+
+def iter_latest_text_evals(path: str) -> Iterator[TextEval]:
+    """Yields the TextEvals of a results JSONL file, keeping only the last record of every text.
+
+    A text can be evaluated more than once, e.g. across resumed runs. The file is read twice
+    so that only one text is held in memory at a time.
+    """
+    # First pass: only remember which record is the last one for each label
+    last_record = {}
+    for i, text_eval in enumerate(iter_text_evals(path)):
+        last_record[text_eval["label"]] = i
+    keep = set(last_record.values())
+
+    for i, text_eval in enumerate(iter_text_evals(path)):
+        if i in keep:
+            yield text_eval
+
+
+def jsonl_to_json(jsonl_path: str, json_path: str) -> int:
+    """Converts the text records of a results JSONL file to the legacy list-of-TextEval JSON.
+
+    The output matches json.dump(results, f, indent=4) but is written one text at a time.
+    If a text was evaluated more than once (e.g. across resumed runs) only its last record is kept.
+    All overall scores are recomputed with the vectorized aggregation (see src.aggregation.iter_aggregated).
+    Returns the number of texts written.
+    """
+    count = 0
+    with open(json_path, "w") as f:
+        f.write("[")
+        for text_eval in iter_aggregated(iter_latest_text_evals(jsonl_path)):
+            body = json.dumps(text_eval, indent=4, default=_to_builtin).replace("\n", "\n    ")
+            f.write(("," if count else "") + "\n    " + body)
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
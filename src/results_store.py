@@ -0,0 +1,319 @@
+import sys
+import json
+import time
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from config.config import RESULTS_DB_NAME
+from src.concepts import TextEval
+from src.checkpoint import text_hash
+from src.result_writer import _to_builtin
+
+USAGE_COLUMNS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "cost")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        source TEXT NOT NULL,  -- "model" for LLM evaluations, "human" for validation ratings
+        created_at REAL NOT NULL,
+        batched INTEGER NOT NULL,
+        prompt_layout TEXT,
+        scoring_mode TEXT,
+        metadata TEXT,  -- JSON metadata of the run's first text
+        run_key TEXT  -- run_key of the run's manifest (see src.checkpoint), so a resumed run replaces its rows
+    );
+    CREATE TABLE IF NOT EXISTS texts (
+        text_id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs (run_id),
+        label TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        input_text TEXT NOT NULL,
+        aggregated_score REAL,
+        timestamp TEXT
+    );
+    CREATE TABLE IF NOT EXISTS models (
+        model_eval_id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL REFERENCES runs (run_id),
+        text_id INTEGER NOT NULL REFERENCES texts (text_id),
+        model TEXT NOT NULL,
+        failed INTEGER NOT NULL,
+        overall_score REAL,
+        requests REAL, prompt_tokens REAL, completion_tokens REAL, cached_tokens REAL, cost REAL
+    );
+    CREATE TABLE IF NOT EXISTS concepts (
+        concept_eval_id INTEGER PRIMARY KEY,
+        model_eval_id INTEGER NOT NULL REFERENCES models (model_eval_id),
+        run_id INTEGER NOT NULL,
+        concept_index INTEGER NOT NULL,
+        concept TEXT NOT NULL,
+        weight REAL,
+        overall_score REAL
+    );
+    CREATE TABLE IF NOT EXISTS dimensions (
+        dimension_eval_id INTEGER PRIMARY KEY,
+        concept_eval_id INTEGER NOT NULL REFERENCES concepts (concept_eval_id),
+        run_id INTEGER NOT NULL,
+        dimension_index INTEGER NOT NULL,
+        dimension TEXT NOT NULL,
+        weight REAL,
+        overall_score REAL
+    );
+    CREATE TABLE IF NOT EXISTS questions (
+        question_eval_id INTEGER PRIMARY KEY,
+        dimension_eval_id INTEGER NOT NULL REFERENCES dimensions (dimension_eval_id),
+        run_id INTEGER NOT NULL,
+        text_id INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        concept TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        question_index INTEGER NOT NULL,
+        question_label TEXT NOT NULL,
+        question TEXT NOT NULL,
+        answer TEXT,
+        score REAL,
+        logprob REAL,
+        positive_contribution INTEGER NOT NULL,
+        top_logprobs TEXT,  -- JSON {"tokens": [...], "logprobs": [...]}
+        requests REAL, prompt_tokens REAL, completion_tokens REAL, cached_tokens REAL, cost REAL,
+        latency REAL, queue_wait REAL, from_cache INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_questions_run_model_label ON questions (run_id, model, question_label);
+    CREATE INDEX IF NOT EXISTS idx_texts_hash ON texts (text_hash);
+    CREATE INDEX IF NOT EXISTS idx_texts_run ON texts (run_id);
+    CREATE INDEX IF NOT EXISTS idx_models_text ON models (text_id);
+"""
+
+# Columns that question queries can filter and group on, with the SQL they stand for
+QUESTION_COLUMNS = {
+    "run": "q.run_id",
+    "run_name": "r.name",
+    "label": "t.label",
+    "text_key": "t.label",  # the name analysis.py uses for the text
+    "text_hash": "t.text_hash",
+    "model": "q.model",
+    "concept": "q.concept",
+    "dimension": "q.dimension",
+    "question_label": "q.question_label",
+    "question": "q.question",
+    "answer": "q.answer",
+    "positive_contribution": "q.positive_contribution",
+}
+QUESTION_FROM = """
+    FROM questions q
+    JOIN texts t ON t.text_id = q.text_id
+    JOIN runs r ON r.run_id = q.run_id
+"""
+
+
+def where_clause(filters: Dict[str, Any], columns: Dict[str, str] = QUESTION_COLUMNS) -> Tuple[str, list]:
+    """WHERE clause for filters on `columns`: a list, tuple or set value means IN, None is ignored."""
+    clauses, params = [], []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in columns:
+            raise ValueError(f"Unknown filter {name!r}, expected one of {sorted(columns)}")
+        if isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(f"{columns[name]} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+        else:
+            clauses.append(f"{columns[name]} = ?")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+class ResultsStore:
+    """Embedded SQLite store holding the results of every run, for queries across many runs.
+
+    Each run is stored as rows of the runs, texts, models, concepts, dimensions and questions
+    tables. Questions carry their run, text, model, concept and dimension so that most
+    queries need no more than a join with texts; filters and group-bys run in SQL and only
+    the result is loaded into pandas.
+    """
+
+    def __init__(self, database_path: str = f"evaluation_results/{RESULTS_DB_NAME}"):
+        self.database_path = database_path
+        self._conn = sqlite3.connect(database_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(runs)")}
+        if "run_key" not in columns:  # stores created before runs had a key
+            self._conn.execute("ALTER TABLE runs ADD COLUMN run_key TEXT")
+        self._conn.commit()
+
+    def add_run(
+            self,
+            name: str,
+            text_evals: Iterable[TextEval],
+            source: str = "model",
+            batched: bool = False,
+            run_key: Optional[str] = None
+            ) -> int:
+        """Stores the TextEvals of one run in a single transaction and returns its run_id.
+
+        If a run with the same `run_key` is stored already (a resumed run), its rows are replaced
+        and its run_id is kept, so the run is never counted twice.
+        """
+        with self._conn:
+            existing = self._conn.execute(
+                "SELECT run_id FROM runs WHERE run_key = ?", (run_key,)
+            ).fetchone() if run_key is not None else None
+            if existing:
+                run_id = existing[0]
+                for table in ("questions", "dimensions", "concepts", "models", "texts"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
+                self._conn.execute(
+                    "UPDATE runs SET name = ?, source = ?, batched = ? WHERE run_id = ?", (name, source, int(batched), run_id)
+                )
+            else:
+                run_id = self._conn.execute(
+                    "INSERT INTO runs (name, source, created_at, batched, run_key) VALUES (?, ?, ?, ?, ?)",
+                    (name, source, time.time(), int(batched), run_key)
+                ).lastrowid
+            metadata = None
+            for text_eval in text_evals:
+                if metadata is None:
+                    metadata = text_eval.get("metadata") or {}
+                self._add_text(run_id, text_eval)
+
+            parameters = (metadata or {}).get("evaluation_parameters", {})
+            self._conn.execute(
+                "UPDATE runs SET prompt_layout = ?, scoring_mode = ?, metadata = ? WHERE run_id = ?",
+                (parameters.get("prompt_layout"), parameters.get("scoring_mode"),
+                 json.dumps(metadata, ensure_ascii=False, default=_to_builtin), run_id)
+            )
+        return run_id
+
+    def _add_text(self, run_id: int, text_eval: TextEval) -> None:
+        text_id = self._conn.execute(
+            "INSERT INTO texts (run_id, label, text_hash, input_text, aggregated_score, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            (run_id, text_eval["label"], text_hash(text_eval["input_text"]), text_eval["input_text"],
+             _value(text_eval.get("aggregated_score")), text_eval.get("timestamp"))
+        ).lastrowid
+
+        for model, model_eval in text_eval["evaluations"].items():
+            if model_eval is None:
+                self._conn.execute(
+                    "INSERT INTO models (run_id, text_id, model, failed) VALUES (?, ?, ?, 1)", (run_id, text_id, model)
+                )
+                continue
+            usage = model_eval.get("usage") or {}
+            model_eval_id = self._conn.execute(
+                "INSERT INTO models (run_id, text_id, model, failed, overall_score, requests, prompt_tokens, "
+                "completion_tokens, cached_tokens, cost) VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?, ?)",
+                (run_id, text_id, model, _value(model_eval["overall_score"]), *(usage.get(k) for k in USAGE_COLUMNS))
+            ).lastrowid
+
+            for c, concept_eval in enumerate(model_eval["concepts_scores"]):
+                concept_eval_id = self._conn.execute(
+                    "INSERT INTO concepts (model_eval_id, run_id, concept_index, concept, weight, overall_score) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (model_eval_id, run_id, c, concept_eval["concept_description"], concept_eval.get("weight"),
+                     _value(concept_eval["overall_score"]))
+                ).lastrowid
+
+                for d, dimension_eval in enumerate(concept_eval["dimensions"]):
+                    dimension_eval_id = self._conn.execute(
+                        "INSERT INTO dimensions (concept_eval_id, run_id, dimension_index, dimension, weight, overall_score) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (concept_eval_id, run_id, d, dimension_eval["dimension_description"], dimension_eval.get("weight"),
+                         _value(dimension_eval["overall_score"]))
+                    ).lastrowid
+
+                    self._conn.executemany(
+                        "INSERT INTO questions (dimension_eval_id, run_id, text_id, model, concept, dimension, question_index, "
+                        "question_label, question, answer, score, logprob, positive_contribution, top_logprobs, requests, "
+                        "prompt_tokens, completion_tokens, cached_tokens, cost, latency, queue_wait, from_cache) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            _question_row(dimension_eval_id, run_id, text_id, model, concept_eval, dimension_eval, q, question_eval)
+                            for q, question_eval in enumerate(dimension_eval["questions"])
+                        ]
+                    )
+
+    def query(self, sql: str, params: Optional[list] = None) -> pd.DataFrame:
+        """Runs any read query against the store."""
+        return pd.read_sql_query(sql, self._conn, params=params or [])
+
+    def runs(self, source: Optional[str] = None) -> pd.DataFrame:
+        """All stored runs with their number of texts, newest first."""
+        where = " WHERE r.source = ?" if source else ""
+        return self.query(f"""
+            SELECT r.run_id, r.name, r.source, datetime(r.created_at, 'unixepoch') AS created, r.batched,
+                   r.prompt_layout, r.scoring_mode, COUNT(t.text_id) AS texts
+            FROM runs r LEFT JOIN texts t ON t.run_id = r.run_id{where}
+            GROUP BY r.run_id ORDER BY r.created_at DESC""", [source] if source else [])
+
+    def question_scores(self, columns: Optional[List[str]] = None, **filters) -> pd.DataFrame:
+        """Question evaluations matching the filters, e.g. question_scores(run=[3, 4], model="gpt-4o").
+
+        `columns` are names from QUESTION_COLUMNS; score and logprob are always included.
+        """
+        columns = columns or ["run", "label", "model", "concept", "dimension", "question_label", "question"]
+        select = ", ".join(f"{QUESTION_COLUMNS[c]} AS {c}" for c in columns)
+        where, params = where_clause(filters)
+        return self.query(f"SELECT {select}, q.score, q.logprob {QUESTION_FROM}{where}", params)
+
+    def mean_scores(self, by: List[str], **filters) -> pd.DataFrame:
+        """Mean question score and number of scored questions per group, computed in SQL."""
+        group = ", ".join(QUESTION_COLUMNS[c] for c in by)
+        select = ", ".join(f"{QUESTION_COLUMNS[c]} AS {c}" for c in by)
+        where, params = where_clause(filters)
+        return self.query(
+            f"SELECT {select}, AVG(q.score) AS score, COUNT(q.score) AS n {QUESTION_FROM}{where} GROUP BY {group} ORDER BY {group}",
+            params
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _value(value) -> Any:
+    """numpy scalars as plain Python values for sqlite3."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def _question_row(dimension_eval_id, run_id, text_id, model, concept_eval, dimension_eval, q, question_eval) -> tuple:
+    usage = question_eval.get("usage") or {}
+    top_logprobs = question_eval.get("top_logprobs")
+    answer = question_eval["answer"]
+    return (
+        dimension_eval_id, run_id, text_id, model, concept_eval["concept_description"],
+        dimension_eval["dimension_description"], q, question_eval["label"], question_eval["question"],
+        None if answer is None else str(answer), _value(question_eval["score"]), _value(question_eval["logprob"]),
+        int(question_eval["positive_contribution"]), json.dumps(top_logprobs) if top_logprobs else None,
+        *(usage.get(k) for k in USAGE_COLUMNS), usage.get("latency"), usage.get("queue_wait"),
+        None if not usage else int(usage["from_cache"])
+    )
+
+
+if __name__ == "__main__":
+    # Import existing results: python -m src.results_store model_eval_data.json|jsonl [run name]
+    from src.columnar import read_text_evals
+    from src.result_writer import iter_latest_text_evals
+
+    input_path = sys.argv[1]
+    name = sys.argv[2] if len(sys.argv) > 2 else input_path.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+
+    if input_path.endswith(".jsonl"):
+        text_evals = iter_latest_text_evals(input_path)
+    elif input_path.endswith(".parquet"):
+        text_evals = read_text_evals(input_path)
+    else:
+        with open(input_path, "r") as f:
+            text_evals = json.load(f)
+
+    with ResultsStore() as store:
+        source = "human" if name.startswith("validation") else "model"
+        run_id = store.add_run(name, text_evals, source=source, batched="batched" in name)
+        print(f"Stored {input_path} as run {run_id} in {store.database_path}")
@@ -0,0 +1,174 @@
+import argparse
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config.config import REGRESSION_THRESHOLD
+from src.compare_scores import load_model_scores, query_model_scores
+from src.results_store import ResultsStore
+
+SCORE_KEYS = ["label", "model", "concept", "dimension", "question"]
+
+
+def key_hashes(scores: pd.DataFrame) -> np.ndarray:
+    """64-bit hashes of the (label, model, concept, dimension, question) keys of extract_all_model_scores rows.
+
+    Equal keys hash equally whatever the column dtypes (categorical, str or object), so rows of
+    different runs are matched on integers instead of five string columns. A missing dimension
+    or question (as read back from CSV) counts as ''.
+    """
+    keys = scores[SCORE_KEYS]
+    if keys.isna().any().any():
+        keys = keys.astype(object).fillna("")
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+
+class RunComparison:
+    """Scores of any number of runs aligned on one hashed key index, with deltas and regression flags.
+
+    Every run is a frame like extract_all_model_scores makes (model, concept, dimension and
+    question rows). The runs are joined once into `scores`, one float column per run indexed by
+    key hash, and `keys` holds the key columns of every hash. Deltas are column differences on
+    that index; a key missing from a run has a NaN score there. A key that occurs more than once
+    in a run (the same label twice) gets the mean of its scores, like compare_datasets does.
+    """
+
+    def __init__(self, runs: Dict[str, pd.DataFrame], baseline: Optional[str] = None):
+        if not runs:
+            raise ValueError("No runs to compare")
+        self.runs: List[str] = list(runs)
+        self.baseline = self.runs[0] if baseline is None else baseline
+        if self.baseline not in runs:
+            raise ValueError(f"Baseline {self.baseline!r} is not one of the runs")
+
+        hashes = [key_hashes(scores) for scores in runs.values()]
+        all_hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+        first = ~pd.Series(all_hashes).duplicated().to_numpy()
+
+        # Key columns are taken from the first run that has the key, in order of appearance
+        key_frames, offset = [], 0
+        for scores, run_hashes in zip(runs.values(), hashes):
+            new = first[offset:offset + len(run_hashes)]
+            key_frames.append(scores.loc[new, SCORE_KEYS].astype(object))
+            offset += len(run_hashes)
+        index = pd.Index(all_hashes[first], name="key")
+        self.keys = pd.concat(key_frames, ignore_index=True).set_axis(index).astype("category")
+
+        columns = {}
+        for name, scores, run_hashes in zip(self.runs, runs.values(), hashes):
+            run_scores = pd.Series(scores["score"].to_numpy(dtype=float), index=run_hashes)
+            if run_scores.index.has_duplicates:
+                run_scores = run_scores.groupby(level=0, sort=False).mean()
+            columns[name] = run_scores.reindex(index).to_numpy()
+        self.scores = pd.DataFrame(columns, index=index)
+
+    @classmethod
+    def from_files(cls, paths: Iterable[str], baseline: Optional[str] = None) -> "RunComparison":
+        """Compares results files (JSON, JSONL or Parquet), keyed by path; the first is the baseline by default."""
+        return cls({path: load_model_scores(path) for path in paths}, baseline)
+
+    @classmethod
+    def from_store(cls, store: ResultsStore, runs: Iterable[int], baseline: Optional[int] = None, **filters) -> "RunComparison":
+        """Compares stored runs, keyed by run id; filters are those of query_model_scores."""
+        runs = list(runs)
+        scores = query_model_scores(store, run=runs, **filters)
+        by_run = dict(tuple(scores.groupby("run", sort=False)))
+        return cls({run: by_run.get(run, scores.iloc[:0]) for run in runs}, baseline)
+
+    def table(self) -> pd.DataFrame:
+        """Key columns and the score of every run side by side."""
+        return self.keys.join(self.scores).reset_index(drop=True)
+
+    def deltas(self, run, against=None) -> pd.Series:
+        """Score of `run` minus that of `against` (the baseline by default) per key; NaN where either is missing."""
+        against = self.baseline if against is None else against
+        return (self.scores[run] - self.scores[against]).rename(run)
+
+    def baseline_deltas(self) -> pd.DataFrame:
+        """Every other run minus the baseline, one column per run."""
+        others = [run for run in self.runs if run != self.baseline]
+        return self.scores[others].sub(self.scores[self.baseline], axis=0)
+
+    def pairwise_mean_deltas(self) -> pd.DataFrame:
+        """Mean of column run minus row run over the keys both runs have, for all pairs at once.
+
+        Computed with matrix products of the score and presence matrices, so dozens of runs do
+        not need a join per pair.
+        """
+        present = self.scores.notna().to_numpy(dtype=float)
+        values = np.nan_to_num(self.scores.to_numpy())
+        shared = present.T @ present
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (present.T @ values - values.T @ present) / shared
+        return pd.DataFrame(means, index=self.runs, columns=self.runs)
+
+    def _references(self, against: str) -> List[tuple]:
+        """(run, reference run) pairs: every run against the baseline, or against the run before it."""
+        if against == "baseline":
+            return [(run, self.baseline) for run in self.runs if run != self.baseline]
+        if against == "previous":
+            return list(zip(self.runs[1:], self.runs[:-1]))
+        raise ValueError(f"Unknown reference {against!r}, use 'baseline' or 'previous'")
+
+    def regressions(self, threshold: float = REGRESSION_THRESHOLD, against: str = "baseline") -> pd.DataFrame:
+        """Keys whose score dropped by more than `threshold` compared to the baseline (or the previous run).
+
+        One row per (key, run) with the reference run, both scores and the delta, largest drops first.
+        """
+        pairs = self._references(against)
+        if not pairs:
+            return pd.DataFrame(columns=[*SCORE_KEYS, "run", "reference", "reference_score", "score", "delta"])
+        scores = self.scores.to_numpy()
+        position = {run: i for i, run in enumerate(self.runs)}
+        run_columns = [position[run] for run, _ in pairs]
+        reference_columns = [position[reference] for _, reference in pairs]
+        deltas = scores[:, run_columns] - scores[:, reference_columns]
+        with np.errstate(invalid="ignore"):
+            rows, pair = np.nonzero(deltas < -threshold)
+
+        flagged = self.keys.iloc[rows].reset_index(drop=True)
+        flagged["run"] = [pairs[p][0] for p in pair]
+        flagged["reference"] = [pairs[p][1] for p in pair]
+        flagged["reference_score"] = scores[rows, np.array(reference_columns)[pair]]
+        flagged["score"] = scores[rows, np.array(run_columns)[pair]]
+        flagged["delta"] = deltas[rows, pair]
+        return flagged.sort_values("delta", kind="stable").reset_index(drop=True)
+
+    def summary(self, threshold: float = REGRESSION_THRESHOLD, against: str = "baseline") -> pd.DataFrame:
+        """Per run: keys compared to its reference, mean (absolute) delta and number of regressions and improvements."""
+        rows = []
+        for run, reference in self._references(against):
+            delta = self.deltas(run, reference).dropna()
+            rows.append({
+                "run": run,
+                "reference": reference,
+                "compared": len(delta),
+                "mean_delta": delta.mean(),
+                "mean_abs_delta": delta.abs().mean(),
+                "regressions": int((delta < -threshold).sum()),
+                "improvements": int((delta > threshold).sum())
+            })
+        return pd.DataFrame(rows, columns=["run", "reference", "compared", "mean_delta", "mean_abs_delta",
+                                           "regressions", "improvements"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the scores of several runs against a baseline")
+    parser.add_argument("files", nargs="+", help="Results files (JSON, JSONL or Parquet); the first is the baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Score drop that counts as a regression")
+    parser.add_argument("--against", choices=["baseline", "previous"], default="baseline",
+                        help="Compare every run to the baseline or to the run before it")
+    parser.add_argument("--output", help="CSV file to write the regressions to")
+    args = parser.parse_args()
+
+    comparison = RunComparison.from_files(args.files)
+    print(comparison.summary(args.threshold, args.against).to_string(index=False))
+    regressions = comparison.regressions(args.threshold, args.against)
+    print(f"\n{len(regressions)} regressions of more than {args.threshold}")
+    if args.output:
+        regressions.to_csv(args.output, index=False)
+        print(f"Regressions saved to {args.output}")
+    else:
+        print(regressions.head(20).to_string(index=False))
@@ -0,0 +1,241 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TypedDict, Any, Dict, Iterator, List, Optional, Union
+from openai import OpenAI
+
+from config.config import MAX_WORKERS
+from src.concepts import QuestionEval, TextEval, Concept
+from src.evaluation import (
+    build_messages,
+    question_request_params,
+    request_payload,
+    score_payload,
+    build_dimension_eval,
+    build_concept_eval,
+    build_model_eval,
+    build_text_eval
+)
+from src.batched_eval import batched_request_params, score_dimension_payload
+from src.result_writer import JsonlResultWriter
+from src.http_client import get_client
+from src.checkpoint import text_hash, item_question_ids
+
+QUEUE_DEPTH_PER_WORKER = 4  # work items in flight per worker; bounds memory without starving workers
+
+
+class WorkItem(TypedDict):
+    text_label: str
+    model: str
+    concept_index: int
+    dimension_index: int
+    question_index: Optional[int]  # None for a batched item covering the whole dimension
+
+
+def flatten_run(texts: dict, models: list[str], concepts: list[Concept], batched: bool = False) -> List[WorkItem]:
+    """Flattens texts x models x concepts x dimensions x questions into one ordered list of work items.
+
+    With batched=True there is one work item per dimension instead of one per question.
+    """
+    items = []
+    for label in texts:
+        for model in models:
+            for c, concept in enumerate(concepts):
+                for d, dimension in enumerate(concept["dimensions"]):
+                    if batched:
+                        items.append(WorkItem(
+                            text_label=label,
+                            model=model,
+                            concept_index=c,
+                            dimension_index=d,
+                            question_index=None
+                        ))
+                        continue
+                    for q in range(len(dimension["questions"])):
+                        items.append(WorkItem(
+                            text_label=label,
+                            model=model,
+                            concept_index=c,
+                            dimension_index=d,
+                            question_index=q
+                        ))
+    return items
+
+
+def work_item_params(item: WorkItem, texts: dict, concepts: list[Concept]) -> Dict[str, Any]:
+    """Request parameters for the question (or, for a batched item, the whole dimension) a work item points to."""
+    concept = concepts[item["concept_index"]]
+    dimension = concept["dimensions"][item["dimension_index"]]
+    input_text = texts[item["text_label"]]
+
+    if item["question_index"] is None:
+        return batched_request_params(item["model"], concept, dimension, input_text)
+
+    question_obj = dimension["questions"][item["question_index"]]
+    return question_request_params(item["model"], build_messages(concept, dimension, question_obj, input_text))
+
+
+def score_work_item(item: WorkItem, concepts: list[Concept], payload: Dict[str, Any]) -> List[QuestionEval]:
+    """Turns the response payload of a work item into its question evaluations."""
+    dimension = concepts[item["concept_index"]]["dimensions"][item["dimension_index"]]
+
+    if item["question_index"] is None:
+        return score_dimension_payload(dimension, payload, item["model"])["questions"]
+
+    question_obj = dimension["questions"][item["question_index"]]
+    return [score_payload(question_obj, payload, item["model"])]
+
+
+def evaluate_work_item(
+        client: OpenAI,
+        item: WorkItem,
+        texts: dict,
+        concepts: list[Concept],
+        queued_at: Optional[float] = None
+        ) -> List[QuestionEval]:
+    """Evaluates the question (or, for a batched item, every question of the dimension) a work item points to."""
+    payload = request_payload(client, work_item_params(item, texts, concepts), queued_at)
+    return score_work_item(item, concepts, payload)
+
+
+def store_result(
+        text_results: Dict[tuple, Union[QuestionEval, Exception]],
+        item: WorkItem,
+        result: Union[List[QuestionEval], Exception]
+        ) -> None:
+    """Files the outcome of a work item under its (model, concept, dimension, question) keys."""
+    key = (item["model"], item["concept_index"], item["dimension_index"])
+    if isinstance(result, Exception):
+        text_results[key + (item["question_index"],)] = result
+        return
+
+    first = item["question_index"] or 0
+    for q, question_eval in enumerate(result, start=first):
+        text_results[key + (q,)] = question_eval
+
+
+def assemble_text_eval(
+        label: str,
+        text: str,
+        models: list[str],
+        concepts: list[Concept],
+        results: Dict[tuple, Union[QuestionEval, Exception]]
+        ) -> TextEval:
+    """Rebuilds the nested TextEval for one text from flat question results.
+
+    `results` maps (model, concept_index, dimension_index, question_index) to a QuestionEval,
+    or to the exception raised while evaluating it. A model with any failed question is stored
+    as None, the same way text_eval handles a failing model.
+    """
+    evaluations = {}
+    for model in models:
+        errors = [r for key, r in results.items() if key[0] == model and isinstance(r, Exception)]
+        if errors:
+            print(f"Error evaluating model {model} on {label}: {errors[0]}")
+            evaluations[model] = None
+            continue
+
+        concept_scores = []
+        for c, concept in enumerate(concepts):
+            dimension_scores = []
+            for d, dimension in enumerate(concept["dimensions"]):
+                question_scores = [results[(model, c, d, q)] for q in range(len(dimension["questions"]))]
+                dimension_scores.append(build_dimension_eval(dimension, question_scores))
+            concept_scores.append(build_concept_eval(concept, dimension_scores))
+        evaluations[model] = build_model_eval(model, concept_scores)
+
+    return build_text_eval(models, text, label, concepts, evaluations)
+
+
+def iter_scheduled(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        max_workers: Optional[int] = None,
+        batched: bool = False,
+        writer: Optional[JsonlResultWriter] = None,
+        completed: Optional[Dict[str, QuestionEval]] = None
+        ) -> Iterator[TextEval]:
+    """Drains the whole run through one fixed-size worker pool, yielding each TextEval once it is done.
+
+    Work items of all (text, model) pairs share one queue, so workers never wait on text or model
+    boundaries. Only a bounded window of items is in flight, and results of a text are dropped as
+    soon as its TextEval has been yielded, so memory stays flat for large corpora. Texts are
+    yielded in the original order. If a writer is given, every finished question is written to it
+    the moment it completes, tagged with its stable question id (see src.checkpoint).
+
+    `completed` maps question ids to results of an earlier, interrupted run; work items whose
+    questions are all in there are not scheduled again.
+    """
+    items = flatten_run(texts, models, concepts, batched)
+    digests = {label: text_hash(text) for label, text in texts.items()}
+    completed = completed or {}
+    max_workers = max_workers or MAX_WORKERS
+    window = max_workers * QUEUE_DEPTH_PER_WORKER
+    client = get_client()  # thread-safe, so all workers share one connection pool
+
+    print(f"Scheduling {len(items)} requests over {max_workers} workers")
+
+    remaining = Counter(item["text_label"] for item in items)
+    results_by_text: Dict[str, Dict[tuple, Union[QuestionEval, Exception]]] = {label: {} for label in texts}
+    labels = list(texts)
+    next_text = 0  # index of the next text to yield
+    pending = {}  # future -> work item
+    skipped = 0  # work items already completed in an earlier run
+
+    def collect(done) -> None:
+        for future in done:
+            item = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            store_result(results_by_text[item["text_label"]], item, result)
+            if writer and not isinstance(result, Exception):
+                question_ids = item_question_ids(item, digests, concepts)
+                for q, (item_id, question_eval) in enumerate(zip(question_ids, result), start=item["question_index"] or 0):
+                    writer.write_question({**item, "question_index": q, "item_id": item_id}, question_eval)
+            remaining[item["text_label"]] -= 1
+
+    def finished_texts() -> Iterator[TextEval]:
+        nonlocal next_text
+        while next_text < len(labels) and remaining[labels[next_text]] == 0:
+            label = labels[next_text]
+            next_text += 1
+            yield assemble_text_eval(label, texts[label], models, concepts, results_by_text.pop(label))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            question_ids = item_question_ids(item, digests, concepts) if completed else []
+            if question_ids and all(i in completed for i in question_ids):
+                store_result(results_by_text[item["text_label"]], item, [completed[i] for i in question_ids])
+                remaining[item["text_label"]] -= 1
+                skipped += 1
+                continue
+
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                yield from finished_texts()
+            pending[executor.submit(evaluate_work_item, client, item, texts, concepts, time.perf_counter())] = item
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+            yield from finished_texts()
+
+    yield from finished_texts()  # texts without any work items left to run
+
+    if skipped:
+        print(f"Resumed run: {skipped} of {len(items)} requests were already done")
+
+
+def run_scheduled(
+        texts: dict,
+        models: list[str],
+        concepts: list[Concept],
+        max_workers: Optional[int] = None,
+        batched: bool = False
+        ) -> list[TextEval]:
+    """Runs iter_scheduled to completion and returns all TextEvals in the original order."""
+    return list(iter_scheduled(texts, models, concepts, max_workers, batched))
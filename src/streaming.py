@@ -0,0 +1,114 @@
+import json
+from typing import Any, Iterable, Iterator, List, Optional
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from config.config import STREAM_CHUNK_ROWS, STREAM_READ_CHARS
+from src.concepts import TextEval
+from src.flatten import iter_flat_chunks
+from src.result_writer import iter_latest_text_evals
+
+QUESTION_ROW_COLUMNS = ["label", "model", "concept", "dimension", "question_label", "question", "score", "logprob"]
+CATEGORY_COLUMNS = ["label", "model", "concept", "dimension", "question_label", "question"]
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(path: str, read_chars: int = STREAM_READ_CHARS) -> Iterator[Any]:
+    """Yields the elements of a JSON array file one at a time, without loading the whole file.
+
+    The file is read in blocks and each element is decoded as soon as it is complete, so memory
+    holds at most a few blocks plus the element being decoded. A file holding a single object
+    (like the per-text files of the dashboard) yields that object.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, position, eof = "", 0, False
+
+        def fill(minimum: int) -> bool:
+            """Reads at least `minimum` more characters (or up to the end), dropping consumed ones."""
+            nonlocal buffer, position, eof
+            data = f.read(max(read_chars, minimum))
+            eof = not data
+            buffer = buffer[position:] + data
+            position = 0
+            return not eof
+
+        def skip(characters: str) -> Optional[str]:
+            """Skips whitespace and the given separators; returns the next character, None at the end."""
+            nonlocal position
+            while True:
+                while position < len(buffer) and (buffer[position] in _WHITESPACE or buffer[position] in characters):
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if not fill(0):
+                    return None
+
+        first = skip("")
+        if first == "{":
+            while fill(0):
+                pass
+            yield json.loads(buffer)
+            return
+        if first != "[":
+            raise ValueError(f"{path} does not hold a JSON array or object")
+        position += 1
+
+        while skip(",") not in (None, "]"):
+            try:
+                element, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element is not complete yet: read at least as much again as is buffered,
+                # so an element is decoded a logarithmic number of times
+                if eof or not fill(len(buffer) - position):
+                    raise
+                continue
+            position = end
+            yield element
+
+
+def iter_result_file(path: str) -> Iterator[TextEval]:
+    """Yields the TextEvals of a results file: a JSON array, a single-TextEval JSON file or a results JSONL."""
+    if path.endswith(".jsonl"):
+        return iter_latest_text_evals(path)
+    return iter_json_array(path)
+
+
+def iter_eval_chunks(
+        path: str,
+        chunk_rows: int = STREAM_CHUNK_ROWS,
+        models: Optional[Iterable[str]] = None,
+        labels: Optional[Iterable[str]] = None
+        ) -> Iterator[pd.DataFrame]:
+    """Streams a results file as DataFrames of question rows (QUESTION_ROW_COLUMNS), about `chunk_rows` each.
+
+    A chunk holds whole texts and is closed once it reaches `chunk_rows` rows, so peak memory is
+    bounded by one chunk plus the TextEval being flattened, whatever the size of the file.
+    String columns are categoricals; filter on models and labels to skip everything else
+    before it is flattened.
+    """
+    yield from iter_flat_chunks(iter_result_file(path), chunk_rows, levels=["question"], models=models,
+                                labels=labels, columns=QUESTION_ROW_COLUMNS)
+
+
+def load_question_frame(
+        path: str,
+        models: Optional[Iterable[str]] = None,
+        labels: Optional[Iterable[str]] = None,
+        chunk_rows: int = STREAM_CHUNK_ROWS
+        ) -> pd.DataFrame:
+    """All (matching) question rows of a results file in one frame, built chunk by chunk.
+
+    Only the flat rows are held in memory, never the nested results.
+    """
+    chunks: List[pd.DataFrame] = list(iter_eval_chunks(path, chunk_rows, models=models, labels=labels))
+    if not chunks:
+        return pd.DataFrame(columns=QUESTION_ROW_COLUMNS)
+    # Categories differ per chunk; union them instead of letting concat fall back to object columns
+    return pd.DataFrame({
+        column: union_categoricals([chunk[column] for chunk in chunks]) if column in CATEGORY_COLUMNS
+        else pd.concat([chunk[column] for chunk in chunks], ignore_index=True)
+        for column in QUESTION_ROW_COLUMNS
+    })
@@ -26,6 +26,9 @@ def fancy_print_output(eval_object: Union[Dict[str, Any], QuestionEval, Dimensio
         print("=====================================")
         print(f"Input Text: {eval_obj['input_text']}")
         for model_name, model_eval in eval_obj['evaluations'].items():
+            if model_eval is None:  # the model failed on this text
+                print(Style.BRIGHT + f"Model: {model_name}" + Style.RESET_ALL + f" {Fore.RED}failed{Style.RESET_ALL}\n")
+                continue
             fancy_print_output(model_eval, level=0)  # Recursive call for ModelEval
 
     elif "model_name" in eval_object and "concepts_scores" in eval_object:  # Check for ModelEval
@@ -1,10 +1,45 @@
+import glob
+import os
 import streamlit as st
 import pandas as pd
-from src.compare_scores import plot_radar_chart
+from src.compare_scores import radar_chart_png
+from src.columnar import read_aggregates
 
 st.title("Model Score Comparison")
 
-eval_data = pd.read_csv("evaluation_results/model_score_comparison_flat.csv")
+# Dimension scores per model, materialized when the results were written (see src.columnar.aggregate_tables).
+# The CSV exported by src.compare_scores is a fallback for models without Parquet results, such as the
+# human ratings when validation_data was not written as Parquet.
+COMPARISON_CSV = "evaluation_results/model_score_comparison_flat.csv"
+runs = [path.replace(".aggregates.parquet", ".parquet") for path in glob.glob("evaluation_results/*.aggregates.parquet")]
+if os.path.exists(COMPARISON_CSV):
+    runs.append(COMPARISON_CSV)
+selected_runs = st.multiselect("Results", runs, default=runs)
+if not selected_runs:
+    st.stop()
+
+# Path, size and modification time of the files identify the data the charts are drawn from
+data_paths = [run if run.endswith(".csv") else run.replace(".parquet", ".aggregates.parquet") for run in selected_runs]
+fingerprint = tuple((path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in data_paths)
+
+
+@st.cache_data(show_spinner=False)
+def load_eval_data(fingerprint):
+    frames = [
+        read_aggregates(path.replace(".aggregates.parquet", ".parquet"), level="dimension", cross_model=False)
+        .rename(columns={"text_key": "label"})
+        for path, _, _ in fingerprint if path.endswith(".aggregates.parquet")
+    ]
+    models = set().union(*(frame["model"] for frame in frames))
+    for path, _, _ in fingerprint:
+        if path.endswith(".csv"):
+            # Dimension rows of the models the Parquet results do not have
+            scores = pd.read_csv(path)
+            frames.append(scores[scores["dimension"].notna() & scores["question"].isna() & ~scores["model"].isin(models)])
+    return pd.concat(frames, ignore_index=True)
+
+
+eval_data = load_eval_data(fingerprint)
 
 st.write("Select models to include in the radar chart:")
 models = eval_data['model'].unique()
@@ -22,16 +57,12 @@ st.write("Selected data")
 filtered_data = eval_data[(eval_data['model'].isin(selected_models)) & (eval_data['concept'] == selected_concept)]
 st.dataframe(filtered_data)
 
-fig, ax = plot_radar_chart(
+# Selections viewed before are shown from the figure cache, without plotting or rendering again
+png = radar_chart_png(
     eval_data,
     selected_concept,
     selected_models,
-    selected_text
+    selected_text,
+    fingerprint=fingerprint
 )
-st.pyplot(fig)
-
-
-
-
-  
-
+st.image(png)